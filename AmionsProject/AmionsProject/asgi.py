@@ -29,4 +29,8 @@ application = ProtocolTypeRouter({
     "websocket": AuthMiddlewareStack(
         URLRouter(get_websocket_urls())  # 用函数延迟加载路由
     )
-})
\ No newline at end of file
+})
+
+# 7. 搜索联想索引还没有建立时在后台线程中构建，联想请求不查询数据库
+from trade.suggest import ensure_suggest_index
+ensure_suggest_index()
\ No newline at end of file
@@ -103,14 +103,25 @@ CORS_ALLOW_ALL_ORIGINS = True
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # 响应压缩（brotli/gzip），需要放在会修改响应内容的中间件之前
+    'trade.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     #'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # 请求内的 User/Goods/GoodsCategory 身份映射 request.loaders，需要放在 JWT 认证之前
+    'trade.loaders.RequestLoaderMiddleware',
+    # 校验 JWT 访问令牌，设置 request.auth_user_id / request.auth_user
+    'trade.authentication.JWTAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # 调试模式下支持 ?pretty=1 输出带缩进的 JSON
+    'trade.responses.PrettyJSONMiddleware',
 ]
 
+# 超过该大小（字节）的响应才会被压缩
+RESPONSE_COMPRESSION_MIN_SIZE = 1024
+
 CORS_ALLOW_METHODS = [
     "DELETE",
     "GET",
@@ -133,6 +144,8 @@ CORS_ALLOW_HEADERS = [
     "x-requested-with",
 ]
 CORS_PREFLIGHT_MAX_AGE = 86400
+# 允许前端读取 ETag 响应头，用于条件请求
+CORS_EXPOSE_HEADERS = ['ETag']
 
 ROOT_URLCONF = 'AmionsProject.urls'
 
@@ -189,6 +202,13 @@ CHANNEL_LAYERS = {
     },
 }
 
+# 聊天消息写缓冲：每隔多少秒或积累多少条消息批量写入数据库一次
+CHAT_BUFFER_FLUSH_INTERVAL = 0.2
+CHAT_BUFFER_MAX_MESSAGES = 200
+# 聊天在线状态：连接过期时间和心跳续期间隔（秒），见 chat/presence.py
+CHAT_PRESENCE_TTL = 60
+CHAT_PRESENCE_HEARTBEAT_INTERVAL = 20
+
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
@@ -304,6 +324,10 @@ BASE_URL = LOCAL_BASE_URL
 PORT = LOCAL_PORT
 #支付宝回调函数
 ALIPAY_RETURN_URL = f'{BASE_URL}:{PORT}/api/settlement/settlementSuccess/'
+#支付宝异步通知地址，需要支付宝服务器能够访问
+ALIPAY_NOTIFY_URL = f'{BASE_URL}:{PORT}/api/settlement/alipayNotify/'
+#下单后商品的预订时长（秒），超时未付款由 release_expired_reservations 命令关闭订单并恢复在售，见 settlement/reservation.py
+GOODS_RESERVE_TIMEOUT = 15 * 60
 FRONTEND_BASE_URL = FRONTEND_BASE_URL
 
 
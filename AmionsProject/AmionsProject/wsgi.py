@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'AmionsProject.settings')
 
 application = get_wsgi_application()
+
+# 搜索联想索引还没有建立时在后台线程中构建，联想请求不查询数据库
+from trade.suggest import ensure_suggest_index
+ensure_suggest_index()
@@ -1,3 +1,47 @@
-from django.test import TestCase
+import json
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from trade.models import Goods, User
+from trade.testing import RedisTestCase
+
+
+# 管理员修改商品价格的测试：只有在售商品可以改价，检查之后商品被买家预订时不会覆盖预订状态
+class ProductManageTests(RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.seller = User.objects.create(phone='13800000401', password='x', nickname='seller')
+        self.goods = Goods.objects.create(
+            title='二手自行车', category_id=1, price=Decimal('99.50'), quality=8, publisher=self.seller
+        )
+        self.url = f'/api/admin_manage/product/{self.goods.id}/'
+
+    def put_price(self, price):
+        return json.loads(self.client.put(self.url, json.dumps({'price': price}), content_type='application/json').content)
+
+    def test_update_price(self):
+        with mock.patch('admin_manage.views.send_goods_changed') as goods_changed:
+            self.assertEqual(self.put_price('120')['status'], '200')
+        self.goods.refresh_from_db()
+        self.assertEqual((self.goods.price, self.goods.status), (Decimal('120.00'), Goods.STATUS_ON))
+        goods_changed.assert_called_once_with(self.goods.id, update_fields=('price',))
+
+    def test_reservation_after_check_is_a_conflict(self):
+        get = Goods.objects.get
+
+        def get_then_reserve(**kwargs):
+            # 视图读取商品之后、更新之前，买家下单预订了该商品
+            goods = get(**kwargs)
+            Goods.objects.filter(id=goods.id).update(status=Goods.STATUS_RESERVED)
+            return goods
+
+        with mock.patch.object(Goods.objects, 'get', get_then_reserve), \
+                mock.patch('admin_manage.views.send_goods_changed') as goods_changed:
+            self.assertEqual(self.put_price('120')['status'], '409')
+        self.goods.refresh_from_db()
+        self.assertEqual((self.goods.price, self.goods.status), (Decimal('99.50'), Goods.STATUS_RESERVED))
+        goods_changed.assert_not_called()
+
+    def test_reserved_goods_cannot_be_repriced(self):
+        Goods.objects.filter(id=self.goods.id).update(status=Goods.STATUS_RESERVED)
+        self.assertEqual(self.put_price('120')['status'], '400')
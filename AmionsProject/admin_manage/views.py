@@ -2,20 +2,25 @@ import json
 
 from django.http import HttpResponse
 from django.conf import settings
-from django.http import JsonResponse
+from trade.responses import OrjsonResponse
 from django.views import View
 import json
 from trade.models import User, Goods, GoodsCategory, Order
-from django.core.cache import cache
+from trade.serializers import serialize_goods_queryset
+from trade.authentication import restore_user, revoke_user
+from settlement.settle import send_goods_changed
+from django.utils.decorators import method_decorator
+from trade.conditional import TABLE_GOODS, TABLE_GOODS_CATEGORY, TABLE_ORDER, TABLE_USER, etag_by_tables
 
 
 #获取所有用户
+@method_decorator(etag_by_tables(TABLE_USER), name='get')
 class GetUsersView(View):
     def get(self,request):
         getUsers=User.objects.all()
         try:
             if not getUsers:
-                return JsonResponse({
+                return OrjsonResponse({
                     'status':'400',
                     'msg':'数据库为空',
                     'data':[]
@@ -40,14 +45,11 @@ class GetUsersView(View):
                 "data": results_list
             }
 
-            return HttpResponse(
-                json.dumps(results_json, indent=4, ensure_ascii=False),
-                content_type="application/json; charset=utf-8"
-            )
+            return OrjsonResponse(results_json)
 
 
         except Exception as e:
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '500',
                 'msg': f"服务器错误:{str(e)}",
                 'data': []
@@ -59,46 +61,28 @@ class GetUsersView(View):
         pass
 
 #获取所有商品
+@method_decorator(etag_by_tables(TABLE_GOODS, TABLE_GOODS_CATEGORY, TABLE_USER), name='get')
 class GetGoodsView(View):
     def get(self,request):
-        # 使用 select_related 优化查询，获取商品和发布者信息
-        getGoods=Goods.objects.select_related('publisher').all()
-        
-        # 获取所有分类信息，用于后续匹配
-        categories = {cat.id: cat.name for cat in GoodsCategory.objects.all()}
         try:
-            if not getGoods:
-                return JsonResponse({
+            # 发布者昵称和分类名称在同一条查询中取回
+            results_list = serialize_goods_queryset(
+                Goods.objects.all(),
+                fields=(
+                    "id", "title", "category_id", "category_name", "price", "quality", "status",
+                    "create_time", "publisher_id", "publisher_nickname", "image"
+                ),
+                time_format=None,
+                default_category_name=''
+            )
+            if not results_list:
+                return OrjsonResponse({
                     'status':'400',
                     'msg':'数据库为空',
                     'data':[]
                 })
 
 
-            results_list = []
-
-            for goods in getGoods:
-
-                image_url = ""
-                if goods.image:
-                    # 直接使用 goods.image，因为它已经是相对于 MEDIA_ROOT 的路径
-                    image_url = f"{settings.MEDIA_URL}{goods.image}".replace("\\", "/")
-
-                results_list.append({
-                    "id": goods.id,
-                    "title": goods.title,
-                    "category_id": goods.category_id,
-                    "category_name": categories.get(goods.category_id, ''),
-                    "price": float(goods.price) ,
-                    "quality": int(goods.quality) ,
-                    "status": int(goods.status) ,
-                    "create_time": goods.create_time.isoformat(),
-                    "publisher_id": goods.publisher.id,
-                    "publisher_nickname": goods.publisher.nickname,
-                    "image": image_url
-                })
-
-
             results_json = {
                 "status": "200",
                 'msg':'商品数据返回成功',
@@ -106,16 +90,11 @@ class GetGoodsView(View):
             }
 
 
-            return HttpResponse(
-                # ensure_ascii=False防止乱码
-                json.dumps(results_json, indent=4, ensure_ascii=False),
-                # 指定响应类型和编码
-                content_type="application/json; charset=utf-8"
-            )
+            return OrjsonResponse(results_json)
 
 
         except Exception as e:
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '500',
                 'msg': f"服务器错误:{str(e)}",
                 'data': []
@@ -127,6 +106,7 @@ class GetGoodsView(View):
         pass
 
 #获取所有商品一级分类
+@method_decorator(etag_by_tables(TABLE_GOODS_CATEGORY), name='get')
 class GetGoodsCategories(View):
     def get(self,request):
         # 按照 parent_id 从小到大排序
@@ -136,7 +116,7 @@ class GetGoodsCategories(View):
         categories_dict = {cat.id: cat.name for cat in get_categories}
         try:
             if not get_categories:
-                return JsonResponse({
+                return OrjsonResponse({
                     'status':'400',
                     'msg':'数据库为空',
                     'data':[]
@@ -164,16 +144,11 @@ class GetGoodsCategories(View):
             }
 
 
-            return HttpResponse(
-                # ensure_ascii=False防止乱码
-                json.dumps(results_json, indent=4, ensure_ascii=False),
-                # 指定响应类型和编码
-                content_type="application/json; charset=utf-8"
-            )
+            return OrjsonResponse(results_json)
 
 
         except Exception as e:
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '500',
                 'msg': f"服务器错误:{str(e)}",
                 'data': []
@@ -185,12 +160,13 @@ class GetGoodsCategories(View):
 
 
 #获取所有订单信息
+@method_decorator(etag_by_tables(TABLE_ORDER), name='get')
 class GetOrders(View):
     def get(self,request):
         get_orders=Order.objects.all()
         try:
             if not get_orders:
-                return JsonResponse({
+                return OrjsonResponse({
                     'status':'400',
                     'msg':'数据库为空',
                     'data':[]
@@ -218,16 +194,11 @@ class GetOrders(View):
             }
 
 
-            return HttpResponse(
-                # ensure_ascii=False防止乱码
-                json.dumps(results_json, indent=4, ensure_ascii=False),
-                # 指定响应类型和编码
-                content_type="application/json; charset=utf-8"
-            )
+            return OrjsonResponse(results_json)
 
 
         except Exception as e:
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '500',
                 'msg': f"服务器错误:{str(e)}",
                 'data': []
@@ -251,31 +222,30 @@ class BanUserView(View):
             current_user_id = body_data.get('current_user_id')  # 获取操作管理员的ID
 
             if not user_id or not current_user_id:
-                return JsonResponse({
+                return OrjsonResponse({
                     'status':'400',
                     'msg':'缺少必要参数',
                 })
 
-            # 获取目标用户和管理员用户对象
+            # 获取目标用户和管理员用户对象，一条查询
             try:
-                target_user = User.objects.get(id=user_id)
-                current_user_id = User.objects.get(id=current_user_id)
+                target_user, current_user_id = request.loaders.users.get_many([user_id, current_user_id])
             except User.DoesNotExist:
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '404',
                     'msg': '用户不存在'
                 })
 
             # 权限检查：不能操作自己
             if target_user.id == current_user_id.id:
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '403',
                     'msg': '不能对自己进行操作'
                 })
 
             # 权限检查：不能操作权限相同或更高的用户
             if target_user.role >= current_user_id.role:
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '403',
                     'msg': '权限不足，不能操作同级或更高级别的用户'
                 })
@@ -284,32 +254,33 @@ class BanUserView(View):
             if target_user.status == 1:  # 正常状态，执行封禁
                 target_user.status = 0  # 0表示禁用状态
                 target_user.save()
-                #封禁时把用户jwt从redis中删除，实现实时的强制下线
-                cache.delete(f"jwt_token_{user_id}")
-                return JsonResponse({
+                #封禁时把用户加入令牌吊销集合，已签发的令牌立即失效，实现实时的强制下线
+                revoke_user(target_user.id)
+                return OrjsonResponse({
                     'status': '200',
                     'msg': '封禁成功',
                 })
             elif target_user.status == 0:  # 封禁状态，执行解封
                 target_user.status = 1  # 1表示正常状态
                 target_user.save()
-                return JsonResponse({
+                restore_user(target_user.id)
+                return OrjsonResponse({
                     'status': '200',
                     'msg': '解封成功',
                 })
             else:
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '400',
                     'msg': '用户状态异常'
                 })
 
         except json.JSONDecodeError:
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '400',
                 'msg': '请求数据格式错误'
             })
         except Exception as e:
-            return JsonResponse({
+            return OrjsonResponse({
                 'status':'500',
                 'msg': f'服务器错误: {str(e)}',
             })
@@ -320,7 +291,7 @@ class ProductManageView(View):
         try:
             # 检查请求体是否为空
             if not request.body:
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '400',
                     'msg': '请求体为空'
                 })
@@ -329,7 +300,7 @@ class ProductManageView(View):
             try:
                 data = json.loads(request.body.decode('utf-8'))
             except json.JSONDecodeError as e:
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '400',
                     'msg': f'JSON格式错误: {str(e)}'
                 })
@@ -337,7 +308,7 @@ class ProductManageView(View):
             # 获取并验证价格参数
             new_price = data.get('price')
             if not new_price:
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '400',
                     'msg': '缺少价格参数'
                 })
@@ -346,17 +317,17 @@ class ProductManageView(View):
             try:
                 price_decimal = float(new_price)
                 if price_decimal <= 0:
-                    return JsonResponse({
+                    return OrjsonResponse({
                         'status': '400',
                         'msg': '价格必须大于0'
                     })
                 if price_decimal > 9999999:  # 设置合理的价格上限
-                    return JsonResponse({
+                    return OrjsonResponse({
                         'status': '400',
                         'msg': '价格超出合理范围'
                     })
             except (ValueError, TypeError):
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '400',
                     'msg': '价格格式不正确'
                 })
@@ -367,43 +338,57 @@ class ProductManageView(View):
 
                 # 检查商品状态，已卖出的商品不能修改价格
                 if product.status == Goods.STATUS_SOLD:
-                    return JsonResponse({
+                    return OrjsonResponse({
                         'status': '400',
                         'msg': '该商品已卖出'
                     })
 
                 if product.status == Goods.STATUS_OFF or product.status==Goods.STATUS_FORCE_OFF:
-                    return JsonResponse({
+                    return OrjsonResponse({
                         'status': '400',
                         'msg': '该商品已下架'
                     })
 
+                # 已被预订的商品订单金额已经确定，不能修改价格
+                if product.status == Goods.STATUS_RESERVED:
+                    return OrjsonResponse({
+                        'status': '400',
+                        'msg': '该商品已被买家预订'
+                    })
+
                 # 检查新价格是否与当前价格相同
                 if float(product.price) == price_decimal:
-                    return JsonResponse({
+                    return OrjsonResponse({
                         'status': '200',
                         'msg': '价格未发生变化，无需更新'
                     })
 
-                # 更新商品价格
+                # 更新商品价格：带条件的 UPDATE，只有商品仍然在售时才修改，
+                # 检查之后商品被买家下单预订时不会用 save() 把预订状态覆盖回在售
                 old_price = float(product.price)
-                product.price = price_decimal
-                product.save()
+                updated = Goods.objects.filter(id=product.id, status=Goods.STATUS_ON).update(price=price_decimal)
+                if not updated:
+                    return OrjsonResponse({
+                        'status': '409',
+                        'msg': '商品状态已发生变化，请刷新后重试'
+                    })
+                # queryset.update() 不触发 post_save，手动通知商品缓存、索引和表版本号
+                send_goods_changed(product.id, update_fields=('price',))
 
                 print(f"商品 {product_id} 价格已从 {old_price} 更新为: {price_decimal}")
 
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '200',
                     'msg': f'商品价格更新成功，从 {old_price} 修改为 {price_decimal}'
                 })
             except Goods.DoesNotExist:
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '404',
                     'msg': '商品不存在'
                 })
 
         except Exception as e:
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '500',
                 'msg': f'更新失败: {str(e)}'
             })
@@ -417,7 +402,7 @@ class AddCategoryView(View):
             
             # 验证必填参数
             if not name:
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '400',
                     'msg': '分类名称不能为空'
                 })
@@ -425,14 +410,14 @@ class AddCategoryView(View):
             # 验证分类名称
             name = name.strip()
             if not name:
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '400',
                     'msg': '分类名称不能为空'
                 })
             
             # 验证名称长度
             if len(name) > 18:
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '400',
                     'msg': '分类名称长度不能超过18个字符'
                 })
@@ -441,24 +426,24 @@ class AddCategoryView(View):
             try:
                 parent_id = int(parent_id_str)
                 if parent_id < 0:
-                    return JsonResponse({
+                    return OrjsonResponse({
                         'status': '400',
                         'msg': '父分类ID不能为负数'
                     })
             except ValueError:
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '400',
                     'msg': '父分类ID格式不正确'
                 })
             
             # 检查分类名称是否已存在
             if GoodsCategory.objects.filter(name=name).exists():
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '400',
                     'msg': '该分类名称已存在'
                 })
             
-            # 创建新的分类
+            # 创建新的分类（分类缓存和首页分类菜单由 GoodsCategory 的 post_save 信号统一失效，版本号随之递增）
             new_category = GoodsCategory.objects.create(
                 name=name,
                 parent_id=parent_id
@@ -467,7 +452,7 @@ class AddCategoryView(View):
             print(f"成功创建分类: ID={new_category.id}, 名称={new_category.name}, 父ID={new_category.parent_id}")
             
             # 返回成功响应，状态码201
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '201',
                 'msg': f'分类"{name}"创建成功',
                 'data': {
@@ -479,7 +464,7 @@ class AddCategoryView(View):
             
         except Exception as e:
             print(f"创建分类时发生错误: {str(e)}")
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '500',
                 'msg': f'创建失败: {str(e)}'
             })
@@ -490,7 +475,7 @@ class UpdateCategoryNameView(View):
             new_name = request.POST.get('name')
             if not new_name:
                 print("未找到 name 参数")
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '400',
                     'msg': '缺少分类名称参数'
                 })
@@ -499,7 +484,7 @@ class UpdateCategoryNameView(View):
 
             # 验证分类名称
             if not new_name.strip():
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '400',
                     'msg': '分类名称不能为空'
                 })
@@ -509,7 +494,7 @@ class UpdateCategoryNameView(View):
 
             # 验证名称长度 (修正为32，与模型保持一致)
             if len(new_name) > 32:
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '400',
                     'msg': '分类名称长度不能超过32个字符'
                 })
@@ -519,14 +504,14 @@ class UpdateCategoryNameView(View):
                 category = GoodsCategory.objects.get(id=category_id)
                 # 检查新名称是否与当前名称相同
                 if category.name == new_name:
-                    return JsonResponse({
+                    return OrjsonResponse({
                         'status': '200',
                         'msg': '分类名称未发生变化'
                     })
 
                 # 检查是否与其他分类名称重复
                 if GoodsCategory.objects.filter(name=new_name).exclude(id=category_id).exists():
-                    return JsonResponse({
+                    return OrjsonResponse({
                         'status': '400',
                         'msg': '该分类名称已存在'
                     })
@@ -534,26 +519,26 @@ class UpdateCategoryNameView(View):
                 # 保存原始名称用于日志
                 old_name = category.name
 
-                # 更新分类名称
+                # 更新分类名称（分类缓存和首页分类菜单由 GoodsCategory 的 post_save 信号统一失效，版本号随之递增）
                 category.name = new_name
                 category.save()
 
                 print(f"分类 {category_id} 名称已从 '{old_name}' 更新为: '{new_name}'")
 
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '200',
                     'msg': f'分类名称更新成功，从 "{old_name}" 修改为 "{new_name}"'
                 })
 
             except GoodsCategory.DoesNotExist:
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '404',
                     'msg': '分类不存在'
                 })
 
         except Exception as e:
             print(f"更新分类名称时发生错误: {str(e)}")
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '500',
                 'msg': f'更新失败: {str(e)}'
             })
@@ -1,7 +1,8 @@
 
 from langchain_core.tools import tool
-from trade.models import Goods, GoodsCategory, Order, User
-from django.db.models import Q
+from trade.models import Goods, Order, User
+from trade.categories import get_category_list, get_category_name_map
+from trade.search_index import search_on_sale_goods
 from .knowledge_base import search_knowledge_base
 
 # 根据关键词搜索商品
@@ -18,34 +19,24 @@ def search_goods(keyword: str) -> str:
     Returns:
         匹配的商品列表信息，包含商品ID、标题、价格、成色等
     """
-    goods_list = Goods.objects.filter(
-        Q(title__icontains=keyword) | Q(details__icontains=keyword),
-        status=Goods.STATUS_ON  # 只搜索在售商品
+    # 与商品搜索接口共用倒排索引，只搜索在售商品，按相关度取前20个
+    results, total = search_on_sale_goods(
+        keyword,
+        limit=20,
+        fields=(
+            "id", "title", "category_id", "category_name", "price", "quality", "status",
+            "publisher_id", "publisher_nickname", "create_time", "details"
+        )
     )
 
-    if not goods_list:
+    if not results:
         return f"未找到与'{keyword}'相关的商品"
 
-    # 获取所有分类信息，用于后续匹配
-    categories = {cat.id: cat.name for cat in GoodsCategory.objects.all()}
-
-    results = []
-    for goods in goods_list:
-        results.append({
-            "id": goods.id,
-            "title": goods.title,
-            "category_id": goods.category_id,
-            "category_name": categories.get(goods.category_id, "未知分类"),
-            "price": float(goods.price),
-            "quality": goods.quality,
-            "status": goods.status,
-            "publisher_id": goods.publisher_id,
-            "publisher_nickname": goods.publisher.nickname,
-            "create_time": goods.create_time.strftime("%Y-%m-%d %H:%M:%S"),
-            "details": goods.details[:100] + "..." if len(goods.details) > 100 else goods.details
-        })
+    for goods in results:
+        if len(goods["details"]) > 100:
+            goods["details"] = goods["details"][:100] + "..."
 
-    return f"找到{len(results)}个相关商品：\n" + str(results)
+    return f"共找到{total}个相关商品，以下是最相关的{len(results)}个：\n" + str(results)
 
 
 # 获取所有商品分类列表
@@ -57,8 +48,7 @@ def get_goods_categories() -> str:
     Returns:
         商品分类信息
     """
-    categories = GoodsCategory.objects.all()
-    results = [{"id": c.id, "name": c.name, "parent_id": c.parent_id} for c in categories]
+    results = get_category_list()
     return f"商品分类列表：\n{results}"
 
 
@@ -123,7 +113,7 @@ def get_user_orders(user_id: int) -> str:
     if bought_orders:
         result_text += "【买入的订单】\n"
         for order in bought_orders:
-            status = "已支付" if order.status == Order.STATUS_PAY else "未支付"
+            status = order.get_status_display()
             result_text += (
                 f"- 订单ID: {order.id}\n"
                 f"  商品: {order.goods.title}\n"
@@ -139,7 +129,7 @@ def get_user_orders(user_id: int) -> str:
     if sold_orders:
         result_text += "【卖出的订单】\n"
         for order in sold_orders:
-            status = "已支付" if order.status == Order.STATUS_PAY else "未支付"
+            status = order.get_status_display()
             result_text += (
                 f"- 订单ID: {order.id}\n"
                 f"  商品: {order.goods.title}\n"
@@ -192,7 +182,7 @@ def get_user_related_goods(user_id: int) -> str:
         return f"用户ID {user_id} 不存在"
 
     # 获取所有分类信息
-    categories = {cat.id: cat.name for cat in GoodsCategory.objects.all()}
+    categories = get_category_name_map()
 
     # 1. 用户发布的商品（所有状态）
     published_goods = Goods.objects.filter(publisher=user)
@@ -1,6 +1,6 @@
 import json
 import logging
-from django.http import JsonResponse
+from trade.responses import OrjsonResponse
 from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
@@ -53,7 +53,7 @@ class AIChatView(View):
             user_id = data.get('user_id')
 
             if not user_message:
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '400',
                     'msg': '消息内容不能为空',
                     'data': []
@@ -77,7 +77,7 @@ class AIChatView(View):
             ai_response = response.get('output', '抱歉，我暂时无法回答这个问题。')
             logger.info(f"AI助手回答用户 {user_id}: {ai_response}")
 
-            return JsonResponse({
+            return OrjsonResponse({
                 'status':'200',
                 'msg':'success',
                 'data': {
@@ -87,14 +87,14 @@ class AIChatView(View):
             })
 
         except json.JSONDecodeError:
-            return JsonResponse({
+            return OrjsonResponse({
                 'status':'400',
                 'msg':'请求JSON格式错误',
                 'data':[]
             })
         except Exception as e:
             logger.error(f"AI助手处理请求时出错: {str(e)}")
-            return JsonResponse({
+            return OrjsonResponse({
                 'status':'500',
                 'msg':f'服务器内部错误: {str(e)}',
                 'data':[]
@@ -0,0 +1,119 @@
+import asyncio
+import logging
+from collections import Counter
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from .conversations import update_conversations
+from .models import ChatMessage
+from .unread import incr_unread
+
+# 聊天消息异步写缓冲（write-behind）
+# 消息先广播给房间成员，再放入进程内缓冲区，由后台任务每隔 FLUSH_INTERVAL 秒
+# 或者缓冲区达到 MAX_MESSAGES 条时用一次 bulk_create 批量写入数据库，
+# 避免每条消息都占用一个线程执行一次 INSERT。
+# 注意：进程异常退出时，缓冲区中最多 FLUSH_INTERVAL 秒内的消息会丢失
+
+# 缓冲区达到多少条消息时立即写库
+CHAT_BUFFER_MAX_MESSAGES = getattr(settings, 'CHAT_BUFFER_MAX_MESSAGES', 200)
+# 后台定时写库的间隔（秒）
+CHAT_BUFFER_FLUSH_INTERVAL = getattr(settings, 'CHAT_BUFFER_FLUSH_INTERVAL', 0.2)
+# 写库失败时缓冲区最多保留的消息数量，超过后丢弃最旧的消息，防止数据库长时间不可用时内存无限增长
+CHAT_BUFFER_MAX_PENDING = getattr(settings, 'CHAT_BUFFER_MAX_PENDING', 10000)
+
+
+#消息和会话摘要在同一个事务中写入，两者始终一致；提交后再用一次 Redis 管道更新接收者的未读计数
+def _bulk_insert(messages):
+    with transaction.atomic():
+        ChatMessage.objects.bulk_create(messages, batch_size=CHAT_BUFFER_MAX_MESSAGES)
+        update_conversations(messages)
+    incr_unread(Counter(
+        (message.receiver_id, message.room_name) for message in messages
+        if message.sender_id != message.receiver_id
+    ))
+
+
+#批量写入因为个别消息违反约束（例如用户已被删除）失败时，逐条写入并丢弃无法写入的消息，
+#避免这些消息让整批消息一直写入失败；逐条写入时遇到其他数据库异常（例如连接断开）则停止，
+#返回还没有处理的消息，由调用方放回缓冲区重试
+def _insert_one_by_one(messages):
+    inserted = 0
+    for index, message in enumerate(messages):
+        try:
+            _bulk_insert([message])
+            inserted += 1
+        except IntegrityError as e:
+            logging.error(f"丢弃无法写入的聊天消息（房间 {message.room_name}，发送者 {message.sender_id}）：{str(e)}")
+        except Exception as e:
+            logging.error(f"逐条写入聊天消息失败，剩余 {len(messages) - index} 条稍后重试：{str(e)}")
+            return inserted, messages[index:]
+    return inserted, []
+
+
+class MessageWriteBuffer:
+    """每个 worker 进程一个实例，在事件循环中运行"""
+
+    def __init__(self, max_messages=CHAT_BUFFER_MAX_MESSAGES, flush_interval=CHAT_BUFFER_FLUSH_INTERVAL):
+        self.max_messages = max_messages
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._lock = None
+        self._loop = None
+        self._flusher = None
+
+    def _ensure_flusher(self):
+        # 缓冲区绑定到当前事件循环，事件循环变化（例如测试中）时重新创建后台任务
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._flusher is None or self._flusher.done():
+            self._loop = loop
+            self._lock = asyncio.Lock()
+            self._flusher = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def add(self, **fields):
+        """放入一条待写入的消息，字段与 ChatMessage 一致"""
+        self._ensure_flusher()
+        self._pending.append(ChatMessage(**fields))
+        if len(self._pending) >= self.max_messages:
+            await self.flush()
+
+    async def flush(self):
+        """把缓冲区中的消息批量写入数据库，返回写入的条数"""
+        if self._lock is None:
+            return 0
+        async with self._lock:
+            if not self._pending:
+                return 0
+            messages, self._pending = self._pending, []
+            try:
+                await database_sync_to_async(_bulk_insert)(messages)
+            except IntegrityError:
+                try:
+                    inserted, remaining = await database_sync_to_async(_insert_one_by_one)(messages)
+                except Exception as e:
+                    logging.error(f"逐条写入 {len(messages)} 条聊天消息失败，稍后重试：{str(e)}")
+                    inserted, remaining = 0, messages
+                self._requeue(remaining)
+                return inserted
+            except Exception as e:
+                logging.error(f"批量写入 {len(messages)} 条聊天消息失败，稍后重试：{str(e)}")
+                self._requeue(messages)
+                return 0
+            logging.debug(f"批量写入 {len(messages)} 条聊天消息")
+            return len(messages)
+
+    def _requeue(self, messages):
+        # 放回缓冲区头部等待下次重试
+        self._pending = (messages + self._pending)[-CHAT_BUFFER_MAX_PENDING:]
+
+    def pending_count(self):
+        return len(self._pending)
+
+
+message_buffer = MessageWriteBuffer()
@@ -1,267 +1,290 @@
-import json
+import asyncio
+import logging
 import re
-from channels.exceptions import StopConsumer
-from channels.generic.websocket import WebsocketConsumer
-from asgiref.sync import async_to_sync
+import time
+from urllib.parse import parse_qs
 
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
 
-class ChatConsumer(WebsocketConsumer):
+from trade.authentication import authenticate_token
+
+from . import presence
+from .buffer import message_buffer
+from .conversations import mark_room_read
+from .framing import FORMAT_MSGPACK, decode_frame, encode_frame, frame_bytes
+from .nicknames import get_nickname
+
+logger = logging.getLogger(__name__)
+
+ROOM_NAME_PATTERN = re.compile(r'room_(\d+)_(\d+)')
+PERSONAL_ROOM_PATTERN = re.compile(r'user_(\d+)')
+
+
+_get_nickname = database_sync_to_async(get_nickname)
+# 封禁用户集合缺失时会查询数据库重建
+_authenticate_token = database_sync_to_async(authenticate_token)
+_mark_room_read = database_sync_to_async(mark_room_read)
+# 在线状态只访问 Redis，不需要在数据库连接所在的线程中执行
+_presence_touch = sync_to_async(presence.touch, thread_sensitive=False)
+_presence_leave = sync_to_async(presence.leave, thread_sensitive=False)
+_is_online = sync_to_async(presence.is_online, thread_sensitive=False)
+
+# 接收者在线状态在连接上缓存的时间（秒），连续发送消息时不必每条都查询 Redis。
+# 只缓存“在线”：误判为在线只是多推送一次没有人接收的消息，而缓存“离线”会让接收者上线后几秒内的推送被丢弃
+RECEIVER_PRESENCE_CACHE_SECONDS = 5
+
+
+#聊天 WebSocket 消费者（异步）：所有 IO 都在事件循环中完成，不再为每条消息占用一个线程，
+#消息先广播，再交给写缓冲批量入库（见 chat/buffer.py）；
+#推送的消息在 group_send 前序列化成 JSON 一次，连接地址带 ?format=msgpack 时转换成二进制帧（见 chat/framing.py）；
+#连接地址必须带 ?token=<访问令牌>，用户ID和昵称取自令牌，只能加入自己所在的房间，消息中的 senderId 被忽略
+class ChatConsumer(AsyncWebsocketConsumer):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.user_id = None  # 初始化用户ID属性
-    
+        self.user_id = None  # 连接时从访问令牌中解析
+        self.nickname = None  # 连接时解析一次，发送消息时不再查询
+        self.group = None
+        self.use_msgpack = False  # 连接时协商的帧格式
+        self._heartbeat = None
+        self._receiver_online_at = {}  # 在线的接收者ID -> 查询时间
+
     def _get_receiver_room(self, room_name, sender_id):
         """
         从聊天房间名中提取接收者的用户ID，并返回其个人房间名
         例如：room_1_2 -> 如果sender_id是1，则返回user_2；如果是2，则返回user_1
         """
-        try:
-            # 解析房间名格式 room_user1_user2
-            match = re.match(r'room_(\d+)_(\d+)', room_name)
-            if not match:
-                print(f"房间名格式不正确: {room_name}")
-                return None
-            
-            user1_id = int(match.group(1))
-            user2_id = int(match.group(2))
-            
-            # 确定接收者ID（不是发送者的那个用户）
-            receiver_id = user2_id if sender_id == user1_id else user1_id
-            
-            receiver_room = f"user_{receiver_id}"
-            print(f"从房间 {room_name} 中确定接收者: {receiver_id}, 个人房间: {receiver_room}")
-            return receiver_room
-            
-        except Exception as e:
-            print(f"解析接收者房间失败: {str(e)}")
-            return None
-    
+        receiver_id = self._parse_receiver_id_from_room(room_name, sender_id)
+        return f"user_{receiver_id}" if receiver_id else None
+
     def _parse_receiver_id_from_room(self, room_name, sender_id):
         """
         从聊天房间名中提取接收者的用户ID
         例如：room_1_2 -> 如果sender_id是1，则返回2；如果是2，则返回1
         """
+        # 解析房间名格式 room_user1_user2
+        match = ROOM_NAME_PATTERN.match(room_name)
+        if not match:
+            logger.debug(f"房间名格式不正确: {room_name}")
+            return None
+
+        user1_id = int(match.group(1))
+        user2_id = int(match.group(2))
+
+        # 确定接收者ID（不是发送者的那个用户）
+        return user2_id if sender_id == user1_id else user1_id
+
+    @staticmethod
+    def _is_room_member(room_name, user_id):
+        """用户能否加入房间：聊天房间 room_用户1_用户2 只允许这两个用户，个人房间 user_用户 只允许本人"""
+        match = ROOM_NAME_PATTERN.fullmatch(room_name)
+        if match:
+            return user_id in (int(match.group(1)), int(match.group(2)))
+        match = PERSONAL_ROOM_PATTERN.fullmatch(room_name)
+        return bool(match) and user_id == int(match.group(1))
+
+    async def _send_frame(self, frame):
+        """按连接协商的格式发送已经序列化好的 JSON 帧"""
+        if self.use_msgpack:
+            await self.send(bytes_data=frame_bytes(frame))
+        else:
+            await self.send(text_data=frame)
+
+    async def _send_error(self, message):
+        await self._send_frame(encode_frame({
+            "type": "error",
+            "message": message
+        }))
+
+    async def _run_heartbeat(self):
+        # 连接存活期间定时续期在线状态
+        while True:
+            await asyncio.sleep(presence.HEARTBEAT_INTERVAL)
+            try:
+                await _presence_touch(self.user_id, self.channel_name)
+            except Exception as e:
+                logger.error(f"续期用户 {self.user_id} 的在线状态失败：{str(e)}")
+
+    async def _receiver_online(self, receiver_id):
+        """接收者是否在线，查询失败时按在线处理，保证消息照常推送"""
+        checked_at = self._receiver_online_at.get(receiver_id)
+        if checked_at is not None and time.monotonic() - checked_at < RECEIVER_PRESENCE_CACHE_SECONDS:
+            return True
         try:
-            # 解析房间名格式 room_user1_user2
-            match = re.match(r'room_(\d+)_(\d+)', room_name)
-            if not match:
-                print(f"房间名格式不正确: {room_name}")
-                return None
-            
-            user1_id = int(match.group(1))
-            user2_id = int(match.group(2))
-            
-            # 确定接收者ID（不是发送者的那个用户）
-            receiver_id = user2_id if sender_id == user1_id else user1_id
-            print(f"从房间 {room_name} 中解析出接收者ID: {receiver_id}")
-            return receiver_id
-            
+            online = await _is_online(receiver_id)
         except Exception as e:
-            print(f"解析接收者ID失败: {str(e)}")
-            return None
-    
-    def websocket_connect(self, message):
-        print("WebSocket连接请求")
+            logger.error(f"查询用户 {receiver_id} 的在线状态失败：{str(e)}")
+            return True
+        if online:
+            self._receiver_online_at[receiver_id] = time.monotonic()
+        else:
+            self._receiver_online_at.pop(receiver_id, None)
+        return online
 
-        group = self.scope['url_route']['kwargs'].get("group")
-        if not group:
-            print("错误：未获取到房间组名")
+    async def _handle_read_ack(self, data):
+        """
+        已读回执：{"type": "read", "upTo": 消息id}，upTo 省略时把整个房间标记为已读
+        一次回执用一条 UPDATE 批量标记，然后通知房间内的对方
+        """
+        match = ROOM_NAME_PATTERN.match(self.group)
+        if not match or self.user_id not in (int(match.group(1)), int(match.group(2))):
+            await self._send_error("只有房间成员可以发送已读回执")
             return
 
-        print(f"连接到房间: {group}")
-
-        # 允许创建连接
-        self.accept()
-
-        # 加入到指定房间
-        async_to_sync(self.channel_layer.group_add)(group, self.channel_name)
-        print(f"用户已加入房间: {group}")
-        
-        # 从URL查询参数中获取用户ID
-        query_string = self.scope.get('query_string', b'').decode()
-        print(f"原始查询字符串: {query_string}")
-        
-        from urllib.parse import parse_qs
-        query_params = parse_qs(query_string)
-        print(f"解析后的参数: {query_params}")
-        
-        user_ids = query_params.get('user_id', [])
-        self.user_id = user_ids[0] if user_ids else None
-        print(f"当前用户ID: {self.user_id}")
-
-    def websocket_receive(self, message):
-        print("接收到原始消息：", message)
+        up_to = data.get('upTo')
+        if up_to is not None:
+            try:
+                up_to = int(up_to)
+            except (TypeError, ValueError):
+                await self._send_error("upTo格式错误")
+                return
+
+        # 先把本进程缓冲区中的消息写入数据库，保证刚收到的消息也能被标记为已读
+        await message_buffer.flush()
+        marked, remaining = await _mark_room_read(self.group, self.user_id, up_to)
+        logger.debug(f"用户 {self.user_id} 在房间 {self.group} 标记了 {marked} 条已读消息")
+
+        await self.channel_layer.group_send(self.group, {
+            "type": "read_receipt",
+            "reader_id": self.user_id,
+            "frame": encode_frame({
+                "type": "read",
+                "readerId": self.user_id,
+                "upTo": up_to,
+                "unread": remaining,
+                "room": self.group
+            })
+        })
 
+    async def connect(self):
+        self.group = self.scope['url_route']['kwargs'].get("group")
+        if not self.group:
+            logger.warning("未获取到房间组名，拒绝连接")
+            await self.close()
+            return
+
+        # 从URL查询参数中的访问令牌认证用户（浏览器的 WebSocket 不能设置 Authorization 请求头）
+        query_params = parse_qs(self.scope.get('query_string', b'').decode())
+        self.use_msgpack = query_params.get('format', [''])[0] == FORMAT_MSGPACK
+        tokens = query_params.get('token', [])
+        if not tokens:
+            logger.info(f"WebSocket 连接缺少访问令牌，拒绝加入房间: {self.group}")
+            await self.close()
+            return
+        user_id, error = await _authenticate_token(tokens[0])
+        if user_id is None:
+            logger.info(f"WebSocket 连接认证失败（{error}），拒绝加入房间: {self.group}")
+            await self.close()
+            return
+        if not self._is_room_member(self.group, user_id):
+            logger.warning(f"用户 {user_id} 不是房间 {self.group} 的成员，拒绝连接")
+            await self.close()
+            return
+        nickname = await _get_nickname(user_id)
+        if nickname is None:
+            logger.warning(f"用户 {user_id} 不存在，拒绝连接")
+            await self.close()
+            return
+        self.user_id = user_id
+        self.nickname = nickname
+
+        # 加入到指定房间，允许创建连接
+        await self.channel_layer.group_add(self.group, self.channel_name)
+        await self.accept()
+        logger.debug(f"用户 {self.user_id} 已加入房间: {self.group}")
+
+        # 登记在线状态并启动心跳
         try:
-            # 解析客户端发送的JSON数据
-            data = json.loads(message['text'])
-            print("解析后的数据：", data)
+            await _presence_touch(self.user_id, self.channel_name)
+            self._heartbeat = asyncio.create_task(self._run_heartbeat())
+        except Exception as e:
+            logger.error(f"登记用户 {self.user_id} 的在线状态失败：{str(e)}")
 
-            # 验证必要字段
-            required_fields = ['type', 'content']
-            if not all(key in data for key in required_fields):
-                print("消息格式不完整，缺少必要字段")
-                self.send(text_data=json.dumps({
-                    "type": "error",
-                    "message": "消息格式错误：缺少必要字段"
-                }))
-                return
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            # 解析客户端发送的数据：文本帧为JSON，二进制帧为msgpack
+            data = decode_frame(text_data, bytes_data)
+        except ValueError:
+            await self._send_error("msgpack格式错误" if bytes_data is not None else "JSON格式错误")
+            return
 
-            # 验证senderId（如果是聊天消息）
-            if data.get('type') == 'message' and not data.get('senderId'):
-                print("聊天消息缺少senderId")
-                self.send(text_data=json.dumps({
-                    "type": "error",
-                    "message": "聊天消息必须包含发送者ID"
-                }))
+        try:
+            if isinstance(data, dict) and data.get('type') == 'read':
+                await self._handle_read_ack(data)
                 return
 
-            # 根据senderId查询用户昵称
-            if data.get('type') == 'message' and data.get('senderId'):
-                from trade.models import User
-                try:
-                    sender_id = int(data['senderId'])
-                    user = User.objects.get(id=sender_id)
-                    data['senderName'] = user.nickname
-                    data['senderId'] = sender_id  # 确保senderId是数字
-                    print(f"获取到发送者昵称: {user.nickname}")
-                except User.DoesNotExist:
-                    print(f"用户ID {data['senderId']} 不存在")
-                    self.send(text_data=json.dumps({
-                        "type": "error",
-                        "message": "发送者用户不存在"
-                    }))
-                    return
-                except Exception as e:
-                    print(f"查询用户信息失败: {str(e)}")
-                    self.send(text_data=json.dumps({
-                        "type": "error",
-                        "message": "获取发送者信息失败"
-                    }))
-                    return
-
-            group = self.scope['url_route']['kwargs'].get("group")
-            if not group:
-                print("错误：无法获取房间组名")
+            # 验证必要字段
+            if not isinstance(data, dict) or not all(key in data for key in ('type', 'content')):
+                await self._send_error("消息格式错误：缺少必要字段")
                 return
 
-            # 保存消息到数据库
-            try:
-                from .models import ChatMessage
-                # 从房间名中解析接收者ID
-                receiver_id = self._parse_receiver_id_from_room(group, data['senderId'])
-                if receiver_id:
-                    # 确定消息类型
-                    message_type = data.get('type', 'text')
-                    if message_type not in ['text', 'image', 'file']:
-                        message_type = 'text'
-                    
-                    # 创建聊天消息记录
-                    chat_message = ChatMessage.objects.create(
-                        room_name=group,
-                        sender_id=data['senderId'],
-                        receiver_id=receiver_id,
-                        content=data.get('content', ''),
-                        message_type=message_type
-                    )
-                    print(f"消息已保存到数据库，ID: {chat_message.id}")
-                else:
-                    print("警告：无法解析接收者ID，消息未保存到数据库")
-            except Exception as e:
-                print(f"保存消息到数据库失败: {str(e)}")
-                # 即使数据库保存失败，也要继续处理消息广播
+            # 发送者就是连接时认证的用户，忽略消息中的 senderId，昵称使用连接时解析好的
+            sender_id = self.user_id
+            data['senderId'] = sender_id
+            data['senderName'] = self.nickname
 
             # 广播消息给房间内的所有用户（包含发送者昵称）
-            print(f"广播消息到房间 {group}，发送者: {data.get('senderName', '未知')}")
-            
-            # 同时广播到接收者的个人消息房间（用于Message.vue同步）
-            receiver_personal_room = self._get_receiver_room(group, data['senderId'])
-            if receiver_personal_room:
-                print(f"同时广播到接收者个人房间: {receiver_personal_room}")
-            
-            # 发送到聊天房间
-            async_to_sync(self.channel_layer.group_send)(
-                group,
-                {
-                    "type": "chat_message",
-                    "message": data,
-                    "target_room": group
-                }
-            )
-            
-            # 发送到接收者个人房间
-            if receiver_personal_room:
-                async_to_sync(self.channel_layer.group_send)(
-                    receiver_personal_room,
-                    {
+            await self.channel_layer.group_send(self.group, {
+                "type": "chat_message",
+                "sender_id": sender_id,
+                "frame": encode_frame({**data, 'room': self.group})
+            })
+
+            # 同时广播到接收者的个人消息房间（用于Message.vue同步），接收者离线时没有人订阅，跳过
+            receiver_id = self._parse_receiver_id_from_room(self.group, sender_id)
+            if receiver_id:
+                if await self._receiver_online(receiver_id):
+                    await self.channel_layer.group_send(f"user_{receiver_id}", {
                         "type": "personal_message",
-                        "message": data,
-                        "target_room": group
-                    }
+                        # 标记为个人消息（用于Message.vue同步）
+                        "frame": encode_frame({**data, 'room': self.group, 'isPersonal': True})
+                    })
+
+                # 放入写缓冲，由后台任务批量写入数据库
+                message_type = data.get('type', 'text')
+                if message_type not in ['text', 'image', 'file']:
+                    message_type = 'text'
+                await message_buffer.add(
+                    room_name=self.group,
+                    sender_id=sender_id,
+                    receiver_id=receiver_id,
+                    content=data.get('content', ''),
+                    message_type=message_type
                 )
+            else:
+                logger.warning(f"无法从房间 {self.group} 解析接收者ID，消息未保存到数据库")
 
-        except json.JSONDecodeError as e:
-            print("JSON解析错误：", str(e))
-            self.send(text_data=json.dumps({
-                "type": "error",
-                "message": "JSON格式错误"
-            }))
         except Exception as e:
-            print("处理消息时出错：", str(e))
-            self.send(text_data=json.dumps({
-                "type": "error",
-                "message": "服务器内部错误"
-            }))
-
-    def chat_message(self, event):
-        # 发送消息给客户端
-        message = event['message']
-        target_room = event.get('target_room', '')
-        print(f"向客户端发送聊天消息：{message}, 目标房间: {target_room}")
+            logger.error(f"处理消息时出错：{str(e)}")
+            await self._send_error("服务器内部错误")
 
+    async def chat_message(self, event):
         # 避免发送者收到自己的消息（防止回声）
-        try:
-            # 获取当前连接的用户ID（需要在连接时存储）
-            current_user_id = getattr(self, 'user_id', None)
-            sender_id = message.get('senderId')
-            
-            # 如果是发送者自己，不发送消息
-            if current_user_id and str(current_user_id) == str(sender_id):
-                print(f"阻止发送者收到自己的消息: {current_user_id}")
-                return
-            
-            # 添加房间信息
-            message['room'] = target_room
-            
-            # 发送给其他房间成员
-            self.send(text_data=json.dumps(message, ensure_ascii=False))
-            print("聊天消息发送成功")
-        except Exception as e:
-            print("发送聊天消息失败：", str(e))
-    
-    def personal_message(self, event):
-        # 处理个人消息（用于Message.vue同步）
-        message = event['message']
-        target_room = event.get('target_room', '')
-        print(f"向客户端发送个人消息：{message}, 目标房间: {target_room}")
-        
-        try:
-            # 个人消息直接发送，不需要过滤
-            message['room'] = target_room
-            message['isPersonal'] = True  # 标记为个人消息
-            
-            self.send(text_data=json.dumps(message, ensure_ascii=False))
-            print("个人消息发送成功")
-        except Exception as e:
-            print("发送个人消息失败：", str(e))
+        if self.user_id == event.get('sender_id'):
+            return
 
-    def websocket_disconnect(self, message):
-        group = self.scope['url_route']['kwargs'].get("group")
-        if group:
-            print(f"用户离开房间: {group}")
-            async_to_sync(self.channel_layer.group_discard)(group, self.channel_name)
-        else:
-            print("用户断开连接（未加入房间）")
+        # 消息中已经带有房间信息，直接发送给其他房间成员
+        await self._send_frame(event['frame'])
 
-        # 断开连接时自动触发
-        raise StopConsumer
+    async def personal_message(self, event):
+        # 处理个人消息（用于Message.vue同步），个人消息直接发送，不需要过滤
+        await self._send_frame(event['frame'])
+
+    async def read_receipt(self, event):
+        # 已读回执只需要通知房间内的对方
+        if self.user_id == event.get('reader_id'):
+            return
+        await self._send_frame(event['frame'])
+
+    async def disconnect(self, code):
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+            try:
+                await _presence_leave(self.user_id, self.channel_name)
+            except Exception as e:
+                logger.error(f"删除用户 {self.user_id} 的在线状态失败：{str(e)}")
+        if self.group:
+            await self.channel_layer.group_discard(self.group, self.channel_name)
+            logger.debug(f"用户 {self.user_id} 离开房间: {self.group}")
@@ -0,0 +1,105 @@
+import logging
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, Value, When
+
+from .models import ChatMessage, Conversation
+from .unread import set_unread
+
+# 会话摘要表（chat_conversations）的维护
+# 每批消息按房间汇总后，每个房间只执行一条 UPDATE（会话不存在时 INSERT），
+# 由 chat/buffer.py 在 bulk_create 消息的同一个事务中调用；
+# 已读回执由 mark_room_read 一次性批量标记并重置未读数
+
+
+def _summarize(messages):
+    """按房间汇总一批消息：消息数、最后一条消息、双方新增的未读数"""
+    summaries = {}
+    for message in messages:
+        # 自己给自己发的消息不计入会话（与原消息列表的逻辑一致）
+        if message.sender_id == message.receiver_id:
+            continue
+        summary = summaries.get(message.room_name)
+        if summary is None:
+            summary = summaries[message.room_name] = {
+                'user1_id': min(message.sender_id, message.receiver_id),
+                'user2_id': max(message.sender_id, message.receiver_id),
+                'message_count': 0,
+                'user1_unread': 0,
+                'user2_unread': 0,
+            }
+        summary['message_count'] += 1
+        if message.receiver_id == summary['user1_id']:
+            summary['user1_unread'] += 1
+        else:
+            summary['user2_unread'] += 1
+        # 同一批消息按发送顺序排列，最后一条即最新消息
+        summary['last_message'] = message.content
+        summary['last_sender_id'] = message.sender_id
+        summary['last_time'] = message.created_at
+    return summaries
+
+
+def _latest(field, summary):
+    # 多个 worker 进程可能乱序写入，只有更新的消息才覆盖会话中的最后一条消息
+    return Case(
+        When(last_time__lte=summary['last_time'], then=Value(summary[field])),
+        default=F(field),
+        output_field=Conversation._meta.get_field(field),
+    )
+
+
+def _apply_summary(room_name, summary):
+    # 注意：MySQL 按从左到右的顺序执行 SET，last_time 必须放在最后，前面的条件才能比较到旧值
+    return Conversation.objects.filter(room_name=room_name).update(
+        message_count=F('message_count') + summary['message_count'],
+        user1_unread=F('user1_unread') + summary['user1_unread'],
+        user2_unread=F('user2_unread') + summary['user2_unread'],
+        last_message=_latest('last_message', summary),
+        last_sender_id=_latest('last_sender_id', summary),
+        last_time=_latest('last_time', summary),
+    )
+
+
+def update_conversations(messages):
+    """根据新写入的一批消息更新会话摘要，需要在写入消息的事务中调用"""
+    for room_name, summary in _summarize(messages).items():
+        if _apply_summary(room_name, summary):
+            continue
+        try:
+            # 使用保存点，其他进程同时创建了该会话时不影响外层事务
+            with transaction.atomic():
+                Conversation.objects.create(room_name=room_name, **summary)
+        except IntegrityError:
+            logging.debug(f"会话 {room_name} 已被其他进程创建，改为更新")
+            _apply_summary(room_name, summary)
+
+
+def _reset_unread(reader_id, field, remaining):
+    return Case(
+        When(**{f'{field}_id': reader_id}, then=Value(remaining)),
+        default=F(f'{field}_unread'),
+        output_field=Conversation._meta.get_field(f'{field}_unread'),
+    )
+
+
+def mark_room_read(room_name, reader_id, up_to=None):
+    """
+    已读回执：把房间内发给 reader 的未读消息用一条 UPDATE 标记为已读
+    :param up_to: 只标记 id 小于等于该值的消息，为 None 时标记房间内全部消息
+    :return: (本次标记的条数, 剩余未读数)
+    """
+    unread = ChatMessage.objects.filter(room_name=room_name, receiver_id=reader_id, is_read=False)
+    with transaction.atomic():
+        if up_to is None:
+            marked = unread.update(is_read=True)
+            remaining = 0
+        else:
+            marked = unread.filter(id__lte=up_to).update(is_read=True)
+            remaining = unread.count()
+        Conversation.objects.filter(room_name=room_name).update(
+            user1_unread=_reset_unread(reader_id, 'user1', remaining),
+            user2_unread=_reset_unread(reader_id, 'user2', remaining),
+        )
+    set_unread(reader_id, room_name, remaining)
+    return marked, remaining
@@ -0,0 +1,204 @@
+import asyncio
+import json
+import random
+import secrets
+import time
+
+import msgpack
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from rest_framework_simplejwt.tokens import AccessToken
+
+from chat.framing import FORMAT_JSON, FORMAT_MSGPACK, decode_frame
+from chat.models import ChatMessage
+from trade.models import User
+
+try:
+    from websockets.asyncio.client import connect
+except ImportError:  # websockets 为压测专用依赖
+    connect = None
+
+
+def _percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(percent / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+# 临时用户的手机号保留前缀，正常业务生成的手机号不使用字母；
+# 即使已有同名号码，插入也会整批回滚，清理时只删除本次创建的号码
+LOADTEST_PHONE_PREFIX = 'LT'
+# 手机号最长 11 位：前缀 2 位 + 批次号 4 位 + 序号 5 位
+LOADTEST_MAX_USERS = 100000
+
+
+#聊天 WebSocket 压测：先启动 ASGI 服务（daphne AmionsProject.asgi:application 或
+#uvicorn AmionsProject.asgi:application），再执行
+#  python manage.py chat_loadtest --confirm-database <数据库名> --url ws://127.0.0.1:8000 --rooms 50 --clients 4 --rate 2 --duration 30
+#压测会在当前数据库中创建临时用户，必须通过 --confirm-database 给出当前配置的数据库名才会执行；
+#每个房间由两个临时用户组成，客户端用临时用户的访问令牌连接，每个客户端按照 --rate 的速率发送消息，消息中附带发送时间，
+#收到消息的客户端据此计算投递延迟；结束后统计数据库写入的消息数，并只删除本次创建的临时用户（级联删除消息和会话）
+class Command(BaseCommand):
+    help = "对聊天 WebSocket（room/<group>/）进行压测，输出投递延迟 p50/p99、吞吐量和数据库写入速率"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--confirm-database', required=True,
+                            help="当前配置的数据库名，用于确认压测写入的数据库，与配置不一致时拒绝执行")
+        parser.add_argument('--url', default='ws://127.0.0.1:8000', help="ASGI 服务地址")
+        parser.add_argument('--rooms', type=int, default=10, help="房间数量")
+        parser.add_argument('--clients', type=int, default=2, help="每个房间的客户端数量（至少 2 个）")
+        parser.add_argument('--rate', type=float, default=2.0, help="每个客户端每秒发送的消息数")
+        parser.add_argument('--duration', type=float, default=10.0, help="发送消息的持续时间（秒）")
+        parser.add_argument('--drain', type=float, default=5.0, help="发送结束后等待消息投递和写库的最长时间（秒）")
+        parser.add_argument('--format', choices=(FORMAT_JSON, FORMAT_MSGPACK), default=FORMAT_JSON,
+                            help="WebSocket 帧格式：JSON 文本帧或 msgpack 二进制帧")
+        parser.add_argument('--keep-users', action='store_true', help="结束后保留临时用户和聊天记录")
+
+    def handle(self, *args, **options):
+        if connect is None:
+            raise CommandError("需要安装 websockets 才能运行压测")
+        rooms = max(1, options['rooms'])
+        clients = max(2, options['clients'])
+        rate = options['rate']
+        if rate <= 0:
+            raise CommandError("--rate 必须大于 0")
+        if rooms * 2 > LOADTEST_MAX_USERS:
+            raise CommandError(f"--rooms 不能超过 {LOADTEST_MAX_USERS // 2}")
+        database_name = str(connection.settings_dict['NAME'])
+        if options['confirm_database'] != database_name:
+            raise CommandError(f"--confirm-database 与当前配置的数据库 {database_name} 不一致，拒绝执行")
+
+        users = self._create_users(rooms * 2)
+        try:
+            stats = asyncio.run(self._run(
+                options['url'], users, clients, rate, options['duration'], options['drain'], options['format']
+            ))
+            inserted, insert_elapsed = self._wait_for_inserts(users, stats['sent'], options['drain'], stats['send_started'])
+            self._report(stats, inserted, insert_elapsed, rooms, clients)
+        finally:
+            if not options['keep_users']:
+                User.objects.filter(id__in=[user.id for user in users]).delete()
+
+    def _create_users(self, count):
+        # 手机号唯一：LT + 4 位随机批次号 + 5 位序号，只记录本次创建的号码，清理时不会误删其他用户
+        batch = secrets.token_hex(2)
+        phones = [f"{LOADTEST_PHONE_PREFIX}{batch}{index:05d}" for index in range(count)]
+        with transaction.atomic():
+            # 与已有号码冲突时整批回滚，不会留下部分临时用户
+            users = User.objects.bulk_create([
+                User(phone=phone, password='', nickname=f"loadtest_{index}")
+                for index, phone in enumerate(phones)
+            ])
+        if any(user.id is None for user in users):
+            # MySQL 的 bulk_create 不返回主键，按本次创建的号码重新查询一次
+            users = list(User.objects.filter(phone__in=phones).order_by('phone'))
+        return users
+
+    async def _run(self, url, users, clients, rate, duration, drain, frame_format):
+        url = url.rstrip('/')
+        # 服务端从访问令牌中认证连接的用户
+        tokens = {user.id: str(AccessToken.for_user(user)) for user in users}
+        use_msgpack = frame_format == FORMAT_MSGPACK
+        latencies = []
+        stats = {'sent': 0, 'received': 0, 'expected': 0, 'errors': 0, 'format': frame_format}
+
+        # 同一房间内同一用户的其他客户端不会收到自己发的消息（服务端防回声），
+        # 每条消息的接收者是房间内以另一个用户身份连接的客户端
+        receivers_of = [sum(1 for index in range(clients) if index % 2 != position) for position in (0, 1)]
+
+        # 每个房间两个用户，房间内的客户端轮流以这两个用户的身份连接
+        connections = []
+        connect_started = time.perf_counter()
+        for room_index in range(len(users) // 2):
+            user_ids = sorted((users[room_index * 2].id, users[room_index * 2 + 1].id))
+            room_name = ChatMessage.get_room_name(*user_ids)
+            for client_index in range(clients):
+                connections.append((room_name, user_ids[client_index % 2], receivers_of[client_index % 2]))
+        sockets = await asyncio.gather(*[
+            connect(f"{url}/room/{room_name}/?token={tokens[user_id]}&format={frame_format}", max_queue=None)
+            for room_name, user_id, _ in connections
+        ])
+        stats['connect_seconds'] = time.perf_counter() - connect_started
+        stats['connections'] = len(sockets)
+
+        async def receive(ws):
+            try:
+                async for raw in ws:
+                    if isinstance(raw, bytes):
+                        message = decode_frame(bytes_data=raw)
+                    else:
+                        message = decode_frame(text_data=raw)
+                    if message.get('type') == 'error':
+                        stats['errors'] += 1
+                    elif 'sentAt' in message:
+                        latencies.append(time.time() - message['sentAt'])
+                        stats['received'] += 1
+            except Exception:
+                pass
+
+        async def send(ws, receivers):
+            interval = 1 / rate
+            # 错开各客户端的首次发送时间，避免所有消息同时到达
+            await asyncio.sleep(random.random() * interval)
+            next_send = time.perf_counter()
+            while time.perf_counter() < deadline:
+                message = {
+                    'type': 'message',
+                    'content': 'loadtest',
+                    'sentAt': time.time()
+                }
+                await ws.send(msgpack.packb(message) if use_msgpack else json.dumps(message))
+                stats['sent'] += 1
+                stats['expected'] += receivers
+                next_send += interval
+                await asyncio.sleep(max(0, next_send - time.perf_counter()))
+
+        receive_tasks = [asyncio.create_task(receive(ws)) for ws in sockets]
+        stats['send_started'] = time.time()
+        send_started = time.perf_counter()
+        deadline = send_started + duration
+        await asyncio.gather(*[
+            send(ws, receivers) for ws, (_, _, receivers) in zip(sockets, connections)
+        ])
+        stats['send_seconds'] = time.perf_counter() - send_started
+
+        # 等待剩余的消息投递完成
+        drain_deadline = time.perf_counter() + drain
+        while stats['received'] < stats['expected'] and time.perf_counter() < drain_deadline:
+            await asyncio.sleep(0.05)
+        stats['deliver_seconds'] = time.perf_counter() - send_started
+
+        await asyncio.gather(*[ws.close() for ws in sockets], return_exceptions=True)
+        for task in receive_tasks:
+            task.cancel()
+        stats['latencies'] = sorted(latencies)
+        return stats
+
+    def _wait_for_inserts(self, users, sent, drain, send_started):
+        # 消息由服务端写缓冲批量入库，轮询直到全部写入或者超时
+        sender_ids = [user.id for user in users]
+        deadline = time.time() + drain
+        inserted = 0
+        while True:
+            inserted = ChatMessage.objects.filter(sender_id__in=sender_ids).count()
+            if inserted >= sent or time.time() >= deadline:
+                return inserted, time.time() - send_started
+            time.sleep(0.1)
+
+    def _report(self, stats, inserted, insert_elapsed, rooms, clients):
+        latencies = stats['latencies']
+        send_seconds = stats['send_seconds'] or 1
+        deliver_seconds = stats['deliver_seconds'] or 1
+        lines = [
+            f"帧格式 {stats['format']}，房间 {rooms} 个 × 客户端 {clients} 个，共 {stats['connections']} 个连接，"
+            f"建立连接耗时 {stats['connect_seconds']:.2f} 秒",
+            f"发送消息 {stats['sent']} 条，发送吞吐量 {stats['sent'] / send_seconds:.0f} 条/秒",
+            f"投递 {stats['received']}/{stats['expected']} 次，投递吞吐量 {stats['received'] / deliver_seconds:.0f} 次/秒，"
+            f"错误 {stats['errors']} 次",
+            f"投递延迟：p50 {_percentile(latencies, 50) * 1000:.1f} ms，p90 {_percentile(latencies, 90) * 1000:.1f} ms，"
+            f"p99 {_percentile(latencies, 99) * 1000:.1f} ms，max {_percentile(latencies, 100) * 1000:.1f} ms",
+            f"数据库写入 {inserted}/{stats['sent']} 条，写入速率 {inserted / insert_elapsed if insert_elapsed > 0 else 0:.0f} 条/秒",
+        ]
+        self.stdout.write(self.style.SUCCESS("\n".join(lines)))
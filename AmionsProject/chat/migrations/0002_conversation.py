@@ -0,0 +1,67 @@
+# Generated by Django 5.2.9 on 2026-10-18 21:51
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_conversations(apps, schema_editor):
+    # 根据已有的聊天记录生成会话摘要，按房间和时间顺序遍历一次
+    ChatMessage = apps.get_model('chat', 'ChatMessage')
+    Conversation = apps.get_model('chat', 'Conversation')
+    summaries = {}
+    messages = ChatMessage.objects.order_by('room_name', 'created_at', 'id').values(
+        'room_name', 'sender_id', 'receiver_id', 'content', 'created_at', 'is_read')
+    for msg in messages.iterator(chunk_size=2000):
+        if msg['sender_id'] == msg['receiver_id']:
+            continue
+        summary = summaries.get(msg['room_name'])
+        if summary is None:
+            summary = summaries[msg['room_name']] = Conversation(
+                room_name=msg['room_name'],
+                user1_id=min(msg['sender_id'], msg['receiver_id']),
+                user2_id=max(msg['sender_id'], msg['receiver_id']),
+            )
+        summary.message_count += 1
+        if not msg['is_read']:
+            if msg['receiver_id'] == summary.user1_id:
+                summary.user1_unread += 1
+            else:
+                summary.user2_unread += 1
+        summary.last_message = msg['content']
+        summary.last_sender_id = msg['sender_id']
+        summary.last_time = msg['created_at']
+    Conversation.objects.bulk_create(summaries.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('room_name', models.CharField(max_length=50, unique=True, verbose_name='房间名')),
+                ('last_message', models.TextField(default='', verbose_name='最后一条消息')),
+                ('last_time', models.DateTimeField(verbose_name='最后消息时间')),
+                ('message_count', models.PositiveIntegerField(default=0, verbose_name='消息数量')),
+                ('user1_unread', models.PositiveIntegerField(default=0, verbose_name='用户1未读数')),
+                ('user2_unread', models.PositiveIntegerField(default=0, verbose_name='用户2未读数')),
+                ('last_sender', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='最后发送者')),
+                ('user1', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversations_as_user1', to=settings.AUTH_USER_MODEL, verbose_name='用户1')),
+                ('user2', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversations_as_user2', to=settings.AUTH_USER_MODEL, verbose_name='用户2')),
+            ],
+            options={
+                'verbose_name': '聊天会话',
+                'verbose_name_plural': '聊天会话',
+                'db_table': 'chat_conversations',
+                'indexes': [models.Index(fields=['user1', 'last_time'], name='idx_conv_user1_time'), models.Index(fields=['user2', 'last_time'], name='idx_conv_user2_time')],
+            },
+        ),
+        migrations.RunPython(backfill_conversations, migrations.RunPython.noop),
+    ]
@@ -50,3 +50,39 @@ class ChatMessage(models.Model):
     def receiver_nickname(self):
         """获取接收者昵称"""
         return self.receiver.nickname
+
+
+class Conversation(models.Model):
+    """
+    会话摘要（反范式）：每个房间一行，记录最后一条消息、消息数和双方的未读数，
+    与 ChatMessage 在同一个写入路径（chat/buffer.py）中更新，
+    消息列表只需要按 last_time 排序查询本表，不再扫描 chat_messages
+    user1 是房间名中较小的用户ID，user2 是较大的用户ID（与 ChatMessage.get_room_name 一致）
+    """
+
+    room_name = models.CharField(max_length=50, unique=True, verbose_name='房间名')
+    user1 = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversations_as_user1', verbose_name='用户1')
+    user2 = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversations_as_user2', verbose_name='用户2')
+    last_message = models.TextField(default='', verbose_name='最后一条消息')
+    last_sender = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name='最后发送者')
+    last_time = models.DateTimeField(verbose_name='最后消息时间')
+    message_count = models.PositiveIntegerField(default=0, verbose_name='消息数量')
+    user1_unread = models.PositiveIntegerField(default=0, verbose_name='用户1未读数')
+    user2_unread = models.PositiveIntegerField(default=0, verbose_name='用户2未读数')
+
+    class Meta:
+        db_table = 'chat_conversations'
+        verbose_name = '聊天会话'
+        verbose_name_plural = '聊天会话'
+        # 消息列表按参与者 + 最后消息时间查询
+        indexes = [
+            models.Index(fields=['user1', 'last_time'], name='idx_conv_user1_time'),
+            models.Index(fields=['user2', 'last_time'], name='idx_conv_user2_time'),
+        ]
+
+    def __str__(self):
+        return f'{self.room_name}: {self.last_message[:20]}'
+
+    def unread_count(self, user_id):
+        """指定用户在该会话中的未读消息数"""
+        return self.user1_unread if user_id == self.user1_id else self.user2_unread
@@ -0,0 +1,26 @@
+from django.core.cache import cache
+
+from trade.models import User
+
+# 聊天发送者昵称缓存：chat:nickname:{用户id}
+# 连接建立时读取一次并保存在消费者上，之后每条消息都不再查询数据库；
+# 用户修改昵称时由 profiles.views.UpdateNickname 清除
+NICKNAME_CACHE_TTL = 24 * 3600
+
+
+def _nickname_key(user_id):
+    return f'chat:nickname:{user_id}'
+
+
+def get_nickname(user_id):
+    """返回用户昵称，用户不存在时返回 None"""
+    nickname = cache.get(_nickname_key(user_id))
+    if nickname is None:
+        nickname = User.objects.filter(id=user_id).values_list('nickname', flat=True).first()
+        if nickname is not None:
+            cache.set(_nickname_key(user_id), nickname, timeout=NICKNAME_CACHE_TTL)
+    return nickname
+
+
+def invalidate_nickname(user_id):
+    cache.delete(_nickname_key(user_id))
@@ -0,0 +1,47 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django_redis import get_redis_connection
+
+# 聊天在线状态登记：chat:presence:{用户id}  有序集合，成员为连接的 channel_name，分数为该连接的过期时间
+# 连接建立时登记，之后每隔 HEARTBEAT_INTERVAL 秒续期，断开时删除；
+# 进程崩溃没有正常断开的连接在 PRESENCE_TTL 秒后自动视为离线。
+# 用户只要还有一个未过期的连接就视为在线
+
+# 连接的过期时间（秒）
+PRESENCE_TTL = getattr(settings, 'CHAT_PRESENCE_TTL', 60)
+# 心跳续期间隔（秒），需要小于 PRESENCE_TTL
+HEARTBEAT_INTERVAL = getattr(settings, 'CHAT_PRESENCE_HEARTBEAT_INTERVAL', 20)
+
+
+def _presence_key(user_id):
+    return cache.make_key(f'chat:presence:{user_id}')
+
+
+def touch(user_id, channel_name):
+    """登记或续期一个连接，同时清理已经过期的连接"""
+    key = _presence_key(user_id)
+    now = time.time()
+    pipe = get_redis_connection('default').pipeline(transaction=False)
+    pipe.zadd(key, {channel_name: now + PRESENCE_TTL})
+    pipe.zremrangebyscore(key, '-inf', now)
+    pipe.expire(key, PRESENCE_TTL)
+    pipe.execute()
+
+
+def leave(user_id, channel_name):
+    get_redis_connection('default').zrem(_presence_key(user_id), channel_name)
+
+
+def is_online(user_id):
+    return get_redis_connection('default').zcount(_presence_key(user_id), time.time(), '+inf') > 0
+
+
+def get_online_status(user_ids):
+    """一次网络请求查询多个用户的在线状态，返回 {用户id: 是否在线}"""
+    now = time.time()
+    pipe = get_redis_connection('default').pipeline(transaction=False)
+    for user_id in user_ids:
+        pipe.zcount(_presence_key(user_id), now, '+inf')
+    return {user_id: count > 0 for user_id, count in zip(user_ids, pipe.execute())}
@@ -1,3 +1,424 @@
-from django.test import TestCase
+import asyncio
+import importlib
+import json
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.apps import apps
+from django.db import IntegrityError, OperationalError, connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.tokens import AccessToken
+
+from AmionsProject.routing import websocket_urlpatterns
+from trade.authentication import revoke_user
+from trade.models import User
+from trade.testing import RedisTestCase, RedisTransactionTestCase
+
+from . import buffer, conversations
+from .buffer import MessageWriteBuffer, _bulk_insert, message_buffer
+from .conversations import mark_room_read
+from .models import ChatMessage, Conversation
+from .unread import _unread_key, get_unread
+
+application = URLRouter(websocket_urlpatterns)
+
+
+class ChatTestMixin:
+    def setUp(self):
+        super().setUp()
+        self.buyer = User.objects.create(phone='13800000201', password='x', nickname='buyer')
+        self.seller = User.objects.create(phone='13800000202', password='x', nickname='seller')
+        self.other = User.objects.create(phone='13800000203', password='x', nickname='other')
+        self.room = ChatMessage.get_room_name(self.buyer.id, self.seller.id)
+
+    def communicator(self, room, user=None, token=None):
+        path = f'/room/{room}/'
+        if user is not None:
+            token = AccessToken.for_user(user)
+        if token is not None:
+            path += f'?token={token}'
+        return WebsocketCommunicator(application, path)
+
+    def auth(self, user):
+        return {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(user)}'}
+
+    def assertUnreadConsistent(self, user, expected):
+        """Redis 未读计数、消息表和会话摘要中的未读数一致"""
+        self.assertEqual(get_unread(user.id).get(self.room, 0), expected)
+        self.assertEqual(
+            ChatMessage.objects.filter(room_name=self.room, receiver=user, is_read=False).count(), expected
+        )
+        self.assertEqual(Conversation.objects.get(room_name=self.room).unread_count(user.id), expected)
+
+
+# 聊天 WebSocket 连接认证的测试：用户身份只取自访问令牌
+class ChatConsumerAuthTests(ChatTestMixin, RedisTransactionTestCase):
+    def connects(self, room, **kwargs):
+        async def run():
+            communicator = self.communicator(room, **kwargs)
+            connected, _ = await communicator.connect()
+            if connected:
+                await communicator.disconnect()
+            return connected
+        return async_to_sync(run)()
+
+    def test_connection_requires_valid_token(self):
+        self.assertTrue(self.connects(self.room, user=self.buyer))
+        self.assertFalse(self.connects(self.room))
+        self.assertFalse(self.connects(self.room, token='invalid'))
+
+    def test_revoked_user_cannot_connect(self):
+        revoke_user(self.buyer.id)
+        self.assertFalse(self.connects(self.room, user=self.buyer))
+
+    def test_only_members_can_join_room(self):
+        self.assertTrue(self.connects(f'user_{self.buyer.id}', user=self.buyer))
+        self.assertFalse(self.connects(self.room, user=self.other))
+        self.assertFalse(self.connects(f'user_{self.seller.id}', user=self.buyer))
+        self.assertFalse(self.connects('lobby', user=self.buyer))
+
+    def test_sender_is_the_authenticated_user(self):
+        async def run():
+            buyer = self.communicator(self.room, user=self.buyer)
+            seller = self.communicator(self.room, user=self.seller)
+            for communicator in (buyer, seller):
+                connected, _ = await communicator.connect()
+                self.assertTrue(connected)
+            # 消息中伪造的 senderId 被忽略
+            await buyer.send_to(text_data=json.dumps({'type': 'message', 'content': 'hi', 'senderId': self.seller.id}))
+            message = json.loads(await seller.receive_from())
+            self.assertTrue(await buyer.receive_nothing())
+            await message_buffer.flush()
+            for communicator in (buyer, seller):
+                await communicator.disconnect()
+            return message
+
+        message = async_to_sync(run)()
+        self.assertEqual((message['senderId'], message['senderName']), (self.buyer.id, 'buyer'))
+        stored = ChatMessage.objects.get()
+        self.assertEqual((stored.sender_id, stored.receiver_id, stored.content), (self.buyer.id, self.seller.id, 'hi'))
+
+
+# 已读回执与未读计数的测试：消息写库时 HINCRBY，已读回执的 UPDATE 之后重置为剩余未读数（为 0 时 HDEL）
+class ChatUnreadTests(ChatTestMixin, RedisTestCase):
+    def send(self, sender, receiver, count):
+        _bulk_insert([
+            ChatMessage(room_name=self.room, sender=sender, receiver=receiver, content=f'hi {index}')
+            for index in range(count)
+        ])
+
+    def test_counters_follow_inserts_and_read_acks(self):
+        self.send(self.buyer, self.seller, 3)
+        self.send(self.seller, self.buyer, 1)
+        self.assertUnreadConsistent(self.seller, 3)
+        self.assertUnreadConsistent(self.buyer, 1)
+
+        first_id = ChatMessage.objects.filter(receiver=self.seller).order_by('id').first().id
+        self.assertEqual(mark_room_read(self.room, self.seller.id, first_id), (1, 2))
+        self.assertUnreadConsistent(self.seller, 2)
+
+        self.send(self.buyer, self.seller, 2)
+        self.assertUnreadConsistent(self.seller, 4)
+
+        self.assertEqual(mark_room_read(self.room, self.seller.id), (4, 0))
+        self.assertUnreadConsistent(self.seller, 0)
+        self.assertFalse(self.redis.hexists(_unread_key(self.seller.id), self.room))
+        # 只重置读者自己的未读数
+        self.assertUnreadConsistent(self.buyer, 1)
+
+    def test_unread_view_uses_token_user(self):
+        self.send(self.buyer, self.seller, 2)
+        url = '/api/chat/unread/'
+        self.assertEqual(json.loads(self.client.get(url).content)['status'], '401')
+        response = json.loads(self.client.get(url, **self.auth(self.seller)).content)
+        self.assertEqual(response['data'], {'total': 2, 'rooms': {self.room: 2}})
+        # 不能通过 user_id 参数查看其他用户的未读数
+        response = json.loads(self.client.get(url, {'user_id': self.seller.id}, **self.auth(self.buyer)).content)
+        self.assertEqual(response['status'], '403')
+
+
+# 通过 WebSocket 发送已读回执
+class ChatReadAckTests(ChatTestMixin, RedisTransactionTestCase):
+    def test_read_ack_marks_messages_and_notifies_sender(self):
+        async def run():
+            buyer = self.communicator(self.room, user=self.buyer)
+            seller = self.communicator(self.room, user=self.seller)
+            for communicator in (buyer, seller):
+                connected, _ = await communicator.connect()
+                self.assertTrue(connected)
+            for index in range(3):
+                await buyer.send_to(text_data=json.dumps({'type': 'message', 'content': f'hi {index}'}))
+                await seller.receive_from()
+            # 回执前会先把缓冲区中的消息写入数据库
+            await seller.send_to(text_data=json.dumps({'type': 'read'}))
+            receipt = json.loads(await buyer.receive_from())
+            self.assertTrue(await seller.receive_nothing())
+            for communicator in (buyer, seller):
+                await communicator.disconnect()
+            return receipt
+
+        receipt = async_to_sync(run)()
+        self.assertEqual(
+            (receipt['type'], receipt['readerId'], receipt['unread']), ('read', self.seller.id, 0)
+        )
+        self.assertEqual(ChatMessage.objects.filter(is_read=True).count(), 3)
+        self.assertUnreadConsistent(self.seller, 0)
+
+    def test_read_ack_outside_chat_room_is_rejected(self):
+        async def run():
+            personal = self.communicator(f'user_{self.seller.id}', user=self.seller)
+            connected, _ = await personal.connect()
+            self.assertTrue(connected)
+            await personal.send_to(text_data=json.dumps({'type': 'read'}))
+            response = json.loads(await personal.receive_from())
+            await personal.disconnect()
+            return response
+
+        self.assertEqual(async_to_sync(run)()['type'], 'error')
+
+
+# 聊天消息写缓冲的测试：批量写库、失败后放回缓冲区重试、违反约束时逐条写入
+class MessageWriteBufferTests(ChatTestMixin, RedisTransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.buffer = MessageWriteBuffer(max_messages=10, flush_interval=60)
+
+    def add(self, *contents, receiver_id=None):
+        async def run():
+            for content in contents:
+                await self.buffer.add(
+                    room_name=self.room, sender_id=self.buyer.id, receiver_id=receiver_id or self.seller.id,
+                    content=content, message_type='text'
+                )
+        async_to_sync(run)()
+
+    def flush(self):
+        return async_to_sync(self.buffer.flush)()
+
+    def stored(self):
+        return list(ChatMessage.objects.order_by('id').values_list('content', flat=True))
+
+    def test_messages_are_written_in_batches(self):
+        self.add('a', 'b')
+        self.assertEqual((self.stored(), self.buffer.pending_count()), ([], 2))
+        with mock.patch('chat.buffer._bulk_insert', wraps=_bulk_insert) as bulk_insert:
+            self.assertEqual(self.flush(), 2)
+        bulk_insert.assert_called_once()
+        self.assertEqual(self.stored(), ['a', 'b'])
+        self.assertEqual(self.flush(), 0)
+        # 消息和会话摘要、未读计数一起更新
+        self.assertUnreadConsistent(self.seller, 2)
+
+    def test_full_buffer_flushes_immediately(self):
+        self.buffer.max_messages = 3
+        self.add('a', 'b', 'c', 'd')
+        self.assertEqual(self.stored(), ['a', 'b', 'c'])
+        self.assertEqual(self.buffer.pending_count(), 1)
+
+    def test_background_task_flushes_on_interval(self):
+        self.buffer.flush_interval = 0.05
+
+        async def run():
+            await self.buffer.add(
+                room_name=self.room, sender_id=self.buyer.id, receiver_id=self.seller.id, content='a'
+            )
+            await asyncio.sleep(0.3)
+            return self.buffer.pending_count()
+
+        self.assertEqual(async_to_sync(run)(), 0)
+        self.assertEqual(self.stored(), ['a'])
+
+    def test_failed_write_is_requeued_in_order(self):
+        self.add('a', 'b')
+        with mock.patch('chat.buffer._bulk_insert', side_effect=OperationalError('database is down')):
+            self.assertEqual(self.flush(), 0)
+        self.assertEqual(self.buffer.pending_count(), 2)
+        self.add('c')
+        self.assertEqual(self.stored(), [])
+        self.assertEqual(self.flush(), 3)
+        self.assertEqual(self.stored(), ['a', 'b', 'c'])
+
+    def test_requeue_keeps_newest_messages_when_full(self):
+        self.add('a', 'b')
+        with mock.patch.object(buffer, 'CHAT_BUFFER_MAX_PENDING', 1), \
+                mock.patch('chat.buffer._bulk_insert', side_effect=OperationalError('database is down')):
+            self.flush()
+        self.assertEqual(self.flush(), 1)
+        self.assertEqual(self.stored(), ['b'])
+
+    def test_constraint_violation_falls_back_to_one_by_one(self):
+        # 接收者不存在的消息违反外键约束，只丢弃这一条
+        self.add('a')
+        self.add('lost', receiver_id=999999)
+        self.add('b')
+        self.assertEqual(self.flush(), 2)
+        self.assertEqual(self.stored(), ['a', 'b'])
+        self.assertEqual(self.buffer.pending_count(), 0)
+
+    def test_other_errors_during_fallback_requeue_the_rest(self):
+        def insert(messages):
+            if len(messages) > 1:
+                raise IntegrityError('constraint')
+            if messages[0].content == 'b':
+                raise OperationalError('connection lost')
+            _bulk_insert(messages)
+
+        self.add('a', 'b')
+        self.add('c')
+        with mock.patch('chat.buffer._bulk_insert', side_effect=insert):
+            self.assertEqual(self.flush(), 1)
+        self.assertEqual(self.buffer.pending_count(), 2)
+        self.assertEqual(self.flush(), 2)
+        self.assertEqual(self.stored(), ['a', 'b', 'c'])
+
+
+# 聊天记录游标分页的测试：before 向前翻页，after 增量获取，按 (created_at, id) 定位
+class ChatHistoryTests(ChatTestMixin, RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.ids = [
+            ChatMessage.objects.create(
+                room_name=self.room, sender=self.buyer, receiver=self.seller, content=f'消息 {index}'
+            ).id
+            for index in range(7)
+        ]
+        ChatMessage.objects.create(
+            room_name=ChatMessage.get_room_name(self.buyer.id, self.other.id),
+            sender=self.buyer, receiver=self.other, content='其他房间'
+        )
+
+    def history(self, **params):
+        return json.loads(self.client.get(f'/api/chat/history/{self.room}/', params).content)
+
+    def page_ids(self, page):
+        return [message['id'] for message in page['data']]
+
+    def walk_backwards(self, limit):
+        pages = []
+        page = self.history(limit=limit)
+        while True:
+            pages.append(self.page_ids(page))
+            if not page['has_more']:
+                self.assertIsNone(page['next_before'])
+                return pages
+            self.assertEqual(page['next_before'], pages[-1][0])
+            page = self.history(limit=limit, before=page['next_before'])
+
+    def test_before_pages_back_in_time(self):
+        ids = self.ids
+        self.assertEqual(self.walk_backwards(3), [ids[4:], ids[1:4], ids[:1]])
+        first = self.history(limit=3)['data'][0]
+        self.assertEqual((first['s'], first['r'], first['c']), (self.buyer.id, self.seller.id, '消息 4'))
+
+    def test_after_returns_only_new_messages(self):
+        page = self.history(after=self.ids[4])
+        self.assertEqual(self.page_ids(page), self.ids[5:])
+        self.assertEqual((page['has_more'], page['next_after']), (False, self.ids[-1]))
+
+        page = self.history(after=self.ids[-1])
+        self.assertEqual((page['data'], page['next_after']), ([], self.ids[-1]))
+
+        page = self.history(after=self.ids[0], limit=2)
+        self.assertEqual(self.page_ids(page), self.ids[1:3])
+        self.assertTrue(page['has_more'])
+        self.assertEqual(self.page_ids(self.history(after=page['next_after'], limit=10)), self.ids[3:])
+
+    def test_messages_with_same_timestamp_are_not_skipped(self):
+        created_at = ChatMessage.objects.get(id=self.ids[0]).created_at
+        ChatMessage.objects.filter(room_name=self.room).update(created_at=created_at)
+        ids = self.ids
+        self.assertEqual(self.walk_backwards(2), [ids[5:], ids[3:5], ids[1:3], ids[:1]])
+        self.assertEqual(self.page_ids(self.history(after=self.ids[2])), self.ids[3:])
+
+    def test_invalid_cursor(self):
+        other_room_id = ChatMessage.objects.exclude(room_name=self.room).get().id
+        self.assertEqual(self.history(before=other_room_id)['status'], '400')
+        self.assertEqual(self.history(after='abc')['status'], '400')
+
+    def test_full_history_without_cursor(self):
+        response = json.loads(self.client.get(f'/api/chat/history/{self.room}/').content)
+        self.assertEqual([message['content'] for message in response['data']], [f'消息 {index}' for index in range(7)])
+
+
+# 会话摘要表的测试：写缓冲按房间汇总更新，迁移 0002 根据已有消息回填
+class ConversationTests(ChatTestMixin, RedisTestCase):
+    def message(self, sender, receiver, content, **kwargs):
+        return ChatMessage(
+            room_name=ChatMessage.get_room_name(sender.id, receiver.id),
+            sender=sender, receiver=receiver, content=content, **kwargs
+        )
+
+    def summary(self, room_name):
+        return Conversation.objects.filter(room_name=room_name).values(
+            'user1_id', 'user2_id', 'last_message', 'last_sender_id', 'message_count', 'user1_unread', 'user2_unread'
+        ).get()
+
+    def test_batches_update_one_row_per_room(self):
+        _bulk_insert([
+            self.message(self.buyer, self.seller, 'a'),
+            self.message(self.seller, self.buyer, 'b'),
+            self.message(self.buyer, self.other, 'c'),
+            self.message(self.buyer, self.buyer, '自己'),
+        ])
+        _bulk_insert([self.message(self.buyer, self.seller, 'd')])
+        self.assertEqual(self.summary(self.room), {
+            'user1_id': self.buyer.id, 'user2_id': self.seller.id, 'last_message': 'd', 'last_sender_id': self.buyer.id,
+            'message_count': 3, 'user1_unread': 1, 'user2_unread': 2,
+        })
+        self.assertEqual(Conversation.objects.count(), 2)
+
+    def test_older_batch_does_not_overwrite_last_message(self):
+        # 另一个 worker 进程（时钟稍慢）较早的一批消息在之后才更新会话
+        newer = self.message(self.buyer, self.seller, '新消息')
+        _bulk_insert([newer])
+        older = self.message(self.seller, self.buyer, '旧消息', created_at=newer.created_at - timedelta(seconds=5))
+        conversations.update_conversations([older])
+        summary = self.summary(self.room)
+        self.assertEqual((summary['last_message'], summary['message_count']), ('新消息', 2))
+
+    def test_conversation_created_concurrently_is_updated(self):
+        _bulk_insert([self.message(self.buyer, self.seller, 'a')])
+        apply_summary = conversations._apply_summary
+        calls = []
+
+        def apply_after_race(room_name, summary):
+            # 第一次 UPDATE 时会话还不存在，随后其他进程创建了它
+            calls.append(room_name)
+            return 0 if len(calls) == 1 else apply_summary(room_name, summary)
+
+        with mock.patch('chat.conversations._apply_summary', side_effect=apply_after_race):
+            _bulk_insert([self.message(self.seller, self.buyer, 'b')])
+        self.assertEqual(len(calls), 2)
+        summary = self.summary(self.room)
+        self.assertEqual((summary['last_message'], summary['message_count']), ('b', 2))
+
+    def test_backfill_migration_matches_write_path(self):
+        batches = [
+            [self.message(self.buyer, self.seller, 'a'), self.message(self.seller, self.buyer, 'b')],
+            [self.message(self.buyer, self.other, 'c'), self.message(self.buyer, self.buyer, '自己')],
+            [self.message(self.buyer, self.seller, 'd')],
+        ]
+        for batch in batches:
+            _bulk_insert(batch)
+        mark_room_read(self.room, self.seller.id)
+        expected = {room_name: self.summary(room_name) for room_name in Conversation.objects.values_list('room_name', flat=True)}
+
+        Conversation.objects.all().delete()
+        migration = importlib.import_module('chat.migrations.0002_conversation')
+        migration.backfill_conversations(apps, None)
+        self.assertEqual({room_name: self.summary(room_name) for room_name in expected}, expected)
+        self.assertEqual(Conversation.objects.count(), len(expected))
+
+    def test_inbox_is_one_query_ordered_by_last_message(self):
+        _bulk_insert([self.message(self.buyer, self.seller, 'a')])
+        _bulk_insert([self.message(self.other, self.buyer, 'b')])
+        with CaptureQueriesContext(connection) as queries:
+            response = json.loads(self.client.get('/api/chat/users/', {'user_id': self.buyer.id}).content)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(
+            [(row['id'], row['last_message'], row['unread_count']) for row in response['data']],
+            [(self.other.id, 'b', 1), (self.seller.id, 'a', 0)]
+        )
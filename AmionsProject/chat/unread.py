@@ -0,0 +1,46 @@
+import logging
+
+from django.core.cache import cache
+from django_redis import get_redis_connection
+
+# 每个用户的未读消息计数器（Redis 哈希）：chat:unread:{用户id}  字段为房间名，值为该房间的未读数
+# 消息写库时 HINCRBY（chat/buffer.py），收到已读回执时重置（chat/conversations.py），
+# 角标数量只需要一次 HGETALL，不再扫描 chat_messages
+
+
+def _unread_key(user_id):
+    return cache.make_key(f'chat:unread:{user_id}')
+
+
+def incr_unread(counts):
+    """
+    批量增加未读数，一次网络请求
+    :param counts: {(接收者id, 房间名): 新增的未读数}
+    """
+    if not counts:
+        return
+    try:
+        pipe = get_redis_connection('default').pipeline(transaction=False)
+        for (user_id, room_name), count in counts.items():
+            pipe.hincrby(_unread_key(user_id), room_name, count)
+        pipe.execute()
+    except Exception as e:
+        logging.error(f"更新未读消息计数失败：{str(e)}")
+
+
+def set_unread(user_id, room_name, count):
+    """已读回执后把房间的未读数设置为剩余的数量，为 0 时删除字段"""
+    try:
+        conn = get_redis_connection('default')
+        if count:
+            conn.hset(_unread_key(user_id), room_name, count)
+        else:
+            conn.hdel(_unread_key(user_id), room_name)
+    except Exception as e:
+        logging.error(f"重置用户 {user_id} 房间 {room_name} 的未读数失败：{str(e)}")
+
+
+def get_unread(user_id):
+    """返回 {房间名: 未读数}"""
+    values = get_redis_connection('default').hgetall(_unread_key(user_id))
+    return {room_name.decode(): int(count) for room_name, count in values.items() if int(count) > 0}
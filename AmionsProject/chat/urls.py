@@ -2,9 +2,11 @@ from django.contrib import admin
 from django.urls import path, include
 
 from .consumer import ChatConsumer
-from .views import ChatUsersView, ChatHistoryView
+from .views import ChatUsersView, ChatHistoryView, ChatUnreadView, ChatPresenceView
 
 urlpatterns = [
     path('users/', ChatUsersView.as_view(), name='ChatUsersView'),
     path('history/<str:room_name>/', ChatHistoryView.as_view(), name='ChatHistoryView'),
+    path('unread/', ChatUnreadView.as_view(), name='ChatUnreadView'),
+    path('presence/', ChatPresenceView.as_view(), name='ChatPresenceView'),
 ]
@@ -1,10 +1,13 @@
 
-from django.http import JsonResponse
+from trade.authentication import jwt_required
+from trade.responses import OrjsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
+from django.db.models import Q
 from django.views import View
-from .models import ChatMessage
-from trade.models import User
+from .models import ChatMessage, Conversation
+from .presence import get_online_status
+from .unread import get_unread
 
 #获取聊天用户列表
 @method_decorator(csrf_exempt, name='dispatch')
@@ -14,7 +17,7 @@ class ChatUsersView(View):
             # 从请求中获取当前用户ID
             user_id = request.GET.get('user_id')
             if not user_id:
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '400',
                     'msg': '缺少用户ID参数',
                     'data':[]
@@ -22,156 +25,245 @@ class ChatUsersView(View):
             
             user_id = int(user_id)
             
-            # 查询该用户参与的所有聊天记录
-            sent_messages = ChatMessage.objects.filter(sender_id=user_id)
-            received_messages = ChatMessage.objects.filter(receiver_id=user_id)
-            
-            # 获取所有聊天对象的信息
-            chat_partners = self._get_chat_partners(user_id, sent_messages, received_messages)
-            
-            # 获取用户详细信息
-            partner_ids = list(chat_partners.keys())
-            users_info = self._get_users_info(partner_ids)
-            
-            # 组装最终数据
-            result_data = self._assemble_result_data(chat_partners, users_info)
-            
-            return JsonResponse({
+            # 一次查询会话摘要表，按最后消息时间倒序，同时取出对方的昵称
+            conversations = Conversation.objects.filter(
+                Q(user1_id=user_id) | Q(user2_id=user_id)
+            ).select_related('user1', 'user2').order_by('-last_time')
+
+            result_data = [self._serialize_conversation(user_id, conversation) for conversation in conversations]
+
+            return OrjsonResponse({
                 'status': '200',
                 'msg': '获取聊天用户列表成功',
                 'data': result_data,
                 'count': len(result_data)
             })
-            
+
         except ValueError:
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '400',
                 'msg': '用户ID格式错误',
                 'data':[]
             })
         except Exception as e:
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '500',
                 'msg': f'服务器内部错误: {str(e)}',
                 'data': []
             })
     
-    def _get_chat_partners(self, user_id, sent_messages, received_messages):
-        """获取聊天伙伴信息"""
-        chat_partners = {}
-        
-        # 处理发送的消息
-        for msg in sent_messages:
-            partner_id = msg.receiver_id
-            if partner_id != user_id:
-                if partner_id not in chat_partners:
-                    chat_partners[partner_id] = {
-                        'id': partner_id,
-                        'last_message': msg.content,
-                        'last_time': msg.created_at,
-                        'message_count': 0
-                    }
-                # 更新为最新的消息
-                if msg.created_at > chat_partners[partner_id]['last_time']:
-                    chat_partners[partner_id]['last_message'] = msg.content
-                    chat_partners[partner_id]['last_time'] = msg.created_at
-                chat_partners[partner_id]['message_count'] += 1
-        
-        # 处理接收的消息
-        for msg in received_messages:
-            partner_id = msg.sender_id
-            if partner_id != user_id:
-                if partner_id not in chat_partners:
-                    chat_partners[partner_id] = {
-                        'id': partner_id,
-                        'last_message': msg.content,
-                        'last_time': msg.created_at,
-                        'message_count': 0
-                    }
-                # 更新为最新的消息
-                if msg.created_at > chat_partners[partner_id]['last_time']:
-                    chat_partners[partner_id]['last_message'] = msg.content
-                    chat_partners[partner_id]['last_time'] = msg.created_at
-                chat_partners[partner_id]['message_count'] += 1
-        
-        return chat_partners
-    
-    def _get_users_info(self, user_ids):
-        """获取用户详细信息"""
-        users_info = {}
-        if user_ids:
-            users = User.objects.filter(id__in=user_ids)
-            for user in users:
-                users_info[user.id] = {
-                    'id': user.id,
-                    'nickname': user.nickname,
-                }
-        return users_info
-    
-    def _assemble_result_data(self, chat_partners, users_info):
-        """组装最终返回的数据"""
-        result_data = []
-        for partner_id, partner_data in chat_partners.items():
-            if partner_id in users_info:
-                user_info = users_info[partner_id]
-                result_data.append({
-                    'id': user_info['id'],
-                    'name': user_info['nickname'],
-                    'nickname': user_info['nickname'],
-                    'last_message': partner_data['last_message'][:50] + '...' if len(partner_data['last_message']) > 50 else partner_data['last_message'],
-                    'last_time': partner_data['last_time'].isoformat(),
-                    'unread_count': 0,
-                    'message_count': partner_data['message_count']
-                })
-        
-        # 按最后消息时间排序
-        result_data.sort(key=lambda x: x['last_time'], reverse=True)
-        return result_data
+    def _serialize_conversation(self, user_id, conversation):
+        """组装单个会话的返回数据"""
+        partner = conversation.user2 if user_id == conversation.user1_id else conversation.user1
+        last_message = conversation.last_message
+        return {
+            'id': partner.id,
+            'name': partner.nickname,
+            'nickname': partner.nickname,
+            'last_message': last_message[:50] + '...' if len(last_message) > 50 else last_message,
+            'last_time': conversation.last_time.isoformat(),
+            'unread_count': conversation.unread_count(user_id),
+            'message_count': conversation.message_count
+        }
+
+#获取未读消息角标：总未读数和每个房间的未读数，直接读取 Redis 计数器，不查询数据库
+#需要登录，只能查询令牌中用户自己的未读数
+@method_decorator(csrf_exempt, name='dispatch')
+class ChatUnreadView(View):
+    @method_decorator(jwt_required)
+    def get(self, request):
+        # 兼容前端传来的 user_id，但必须与登录用户一致
+        user_id = request.GET.get('user_id')
+        if user_id and str(user_id) != str(request.auth_user_id):
+            return OrjsonResponse({
+                'status': '403',
+                'msg': '只能查看自己的未读消息',
+                'data': {}
+            })
+
+        try:
+            rooms = get_unread(request.auth_user_id)
+        except Exception as e:
+            return OrjsonResponse({
+                'status': '500',
+                'msg': f'服务器内部错误: {str(e)}',
+                'data': {}
+            })
+
+        return OrjsonResponse({
+            'status': '200',
+            'msg': '获取未读消息数成功',
+            'data': {
+                'total': sum(rooms.values()),
+                'rooms': rooms
+            }
+        })
+
+#查询用户在线状态：?user_ids=1,2,3，一次 Redis 管道查询全部用户，用于消息列表显示在线标记
+PRESENCE_QUERY_MAX_USERS = 200
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ChatPresenceView(View):
+    def get(self, request):
+        try:
+            user_ids = [int(user_id) for user_id in request.GET.get('user_ids', '').split(',') if user_id]
+        except ValueError:
+            return OrjsonResponse({
+                'status': '400',
+                'msg': '用户ID格式错误',
+                'data': {}
+            })
+        if len(user_ids) > PRESENCE_QUERY_MAX_USERS:
+            return OrjsonResponse({
+                'status': '400',
+                'msg': f'一次最多查询{PRESENCE_QUERY_MAX_USERS}个用户',
+                'data': {}
+            })
+
+        try:
+            status = get_online_status(user_ids)
+        except Exception as e:
+            return OrjsonResponse({
+                'status': '500',
+                'msg': f'服务器内部错误: {str(e)}',
+                'data': {}
+            })
+
+        return OrjsonResponse({
+            'status': '200',
+            'msg': '获取在线状态成功',
+            'data': status
+        })
+
+#聊天记录分页：每页默认/最大返回数量
+CHAT_HISTORY_DEFAULT_LIMIT = 50
+CHAT_HISTORY_MAX_LIMIT = 200
+
+#分页模式下使用的紧凑字段名
+#  id: 消息id  s: 发送者id  r: 接收者id  c: 内容  t: 发送时间（毫秒时间戳）  mt: 消息类型  rd: 是否已读
+CHAT_HISTORY_FIELDS = ('id', 'sender_id', 'receiver_id', 'content', 'created_at', 'message_type', 'is_read')
+
+
+def _compact_message(row):
+    return {
+        'id': row['id'],
+        's': row['sender_id'],
+        'r': row['receiver_id'],
+        'c': row['content'],
+        't': int(row['created_at'].timestamp() * 1000),
+        'mt': row['message_type'],
+        'rd': row['is_read'],
+    }
+
 
 #获取历史聊天记录
+#支持两种模式：
+#  1. 不带参数：按时间升序返回房间内全部消息（兼容旧版前端）
+#  2. 游标分页：?limit=50 返回最新一页；?before=<消息id> 向前翻页（加载更早的消息）；
+#     ?after=<消息id> 增量获取该消息之后的新消息。按 (created_at, id) 做游标，
+#     查询走 idx_room_time(room_name, created_at) 索引的范围扫描，每页代价与会话长度无关
 @method_decorator(csrf_exempt, name='dispatch')
 class ChatHistoryView(View):
     def get(self, request, room_name):
         try:
             # 验证房间名格式
             if not room_name or not room_name.startswith('room_'):
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '400',
                     'msg': '房间名格式错误',
                     'data':[]
                 })
-            
+
+            if any(param in request.GET for param in ('before', 'after', 'limit')):
+                return self._paginate(request, room_name)
+
             # 查询该房间的所有聊天记录，按时间升序排列
             messages = ChatMessage.objects.filter(
                 room_name=room_name
-            ).select_related('sender', 'receiver').order_by('created_at')
-            
+            ).order_by('created_at', 'id').values(*CHAT_HISTORY_FIELDS)
+
             # 转换为前端需要的格式
             history_data = []
             for msg in messages:
                 history_data.append({
-                    'sender_id': msg.sender.id,
-                    'receiver_id': msg.receiver.id,
-                    'content': msg.content,
-                    'created_at': msg.created_at.isoformat(),
-                    'timestamp': msg.created_at.timestamp(),
-                    'message_type': msg.message_type,
-                    'is_read': msg.is_read
+                    'sender_id': msg['sender_id'],
+                    'receiver_id': msg['receiver_id'],
+                    'content': msg['content'],
+                    'created_at': msg['created_at'].isoformat(),
+                    'timestamp': msg['created_at'].timestamp(),
+                    'message_type': msg['message_type'],
+                    'is_read': msg['is_read']
                 })
-            
-            return JsonResponse({
+
+            return OrjsonResponse({
                 'status': '200',
                 'msg': '获取聊天历史成功',
                 'data': history_data,
                 'count': len(history_data)
             })
-            
+
         except Exception as e:
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '500',
                 'msg': f'服务器内部错误: {str(e)}',
                 'data': []
             })
 
+    def _paginate(self, request, room_name):
+        try:
+            limit = int(request.GET.get('limit', CHAT_HISTORY_DEFAULT_LIMIT))
+            before = request.GET.get('before')
+            after = request.GET.get('after')
+            before = int(before) if before else None
+            after = int(after) if after else None
+        except ValueError:
+            return OrjsonResponse({
+                'status': '400',
+                'msg': 'before/after/limit必须是数字',
+                'data': []
+            })
+        limit = max(1, min(limit, CHAT_HISTORY_MAX_LIMIT))
+
+        messages = ChatMessage.objects.filter(room_name=room_name)
+        cursor_id = after if after is not None else before
+        if cursor_id is not None:
+            # 根据游标消息的发送时间定位，(created_at, id) 组合保证同一时刻的消息也不会重复或遗漏
+            cursor_time = messages.filter(id=cursor_id).values_list('created_at', flat=True).first()
+            if cursor_time is None:
+                return OrjsonResponse({
+                    'status': '400',
+                    'msg': '游标消息不存在',
+                    'data': []
+                })
+            if after is not None:
+                messages = messages.filter(
+                    Q(created_at__gt=cursor_time) | Q(created_at=cursor_time, id__gt=cursor_id)
+                ).order_by('created_at', 'id')
+            else:
+                messages = messages.filter(
+                    Q(created_at__lt=cursor_time) | Q(created_at=cursor_time, id__lt=cursor_id)
+                ).order_by('-created_at', '-id')
+        else:
+            # 没有游标时返回最新一页
+            messages = messages.order_by('-created_at', '-id')
 
+        # 多取一条用来判断是否还有更多
+        rows = list(messages.values(*CHAT_HISTORY_FIELDS)[:limit + 1])
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if after is None:
+            # 倒序查询的结果翻转成时间升序，前端直接追加到列表顶部
+            rows.reverse()
 
+        data = [_compact_message(row) for row in rows]
+        return OrjsonResponse({
+            'status': '200',
+            'msg': '获取聊天历史成功',
+            'data': data,
+            'count': len(data),
+            'has_more': has_more,
+            # 向前翻页时下一页的 before 游标，增量获取时下一次的 after 游标
+            'next_before': data[0]['id'] if data and after is None and has_more else None,
+            'next_after': data[-1]['id'] if data else after
+        })
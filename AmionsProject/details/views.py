@@ -1,8 +1,10 @@
 import logging
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse
+from trade.responses import OrjsonResponse
 from django.views import View
 from trade.models import Goods
 from trade.models import UserWish, User, Goods
+from trade.views import get_goods_from_local_cache
 class userDetails(View):
     def get(self,request,id):
 
@@ -10,36 +12,38 @@ class userDetails(View):
         logger.info("进入details的get请求")
 
         try:
-            # 使用JOIN查询获取商品信息和关联的发布者信息
-            goods = Goods.objects.select_related('publisher').get(id=id)
+            # 商品详情是最热的读取路径：优先读进程内缓存，其次是带防击穿保护的 Redis 缓存，最后才回源数据库
+            goods = get_goods_from_local_cache(id)
+            if goods is None:
+                raise Goods.DoesNotExist
 
             # 构造响应数据
             goods_detail_data = {
-                'id': goods.id,
-                'title': goods.title,
-                'price': float(goods.price),
-                'image': goods.image.url if goods.image else '',
-                'status': goods.status,
-                'create_time': goods.create_time.strftime('%Y-%m-%d %H:%M') if hasattr(goods, 'create_time') else '',
-                'details': goods.details or '',
-                'publisher_id': goods.publisher_id,
-                'publisher_nickname': goods.publisher.nickname if goods.publisher else '未知用户'
+                'id': goods['id'],
+                'title': goods['title'],
+                'price': goods['price'],
+                'image': goods['image'],
+                'status': goods['status'],
+                'create_time': goods['create_time'][:16],
+                'details': goods['details'] or '',
+                'publisher_id': goods['publisher_id'],
+                'publisher_nickname': goods['publisher_nickname'] or '未知用户'
             }
 
             print("用户正在查看商品详情")
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '200',
                 'msg': '获取商品详情成功',
                 'goods_detail': goods_detail_data
             })
 
         except Goods.DoesNotExist:
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '400',
                 'msg': '商品不存在'
             })
         except Exception as e:
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '500',
                 'msg': f'服务器错误: {str(e)}'
             })
@@ -52,7 +56,7 @@ class CheckIsWished(View):
         try:
             # 验证参数
             if not user_id or not goods_id:
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '400',
                     'msg': '缺少必要参数',
                     'is_favorited': False
@@ -60,16 +64,16 @@ class CheckIsWished(View):
             
             # 尝试查询用户是否收藏了该商品
             try:
-                user = User.objects.get(id=int(user_id))
-                goods = Goods.objects.get(id=int(goods_id))
+                user = request.loaders.users.get(user_id)
+                goods = request.loaders.goods.get(goods_id)
             except (User.DoesNotExist, Goods.DoesNotExist):
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '404',
                     'msg': '用户或商品不存在',
                     'is_favorited': False
                 })
             except ValueError:
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '400',
                     'msg': '参数格式错误',
                     'is_favorited': False
@@ -84,7 +88,7 @@ class CheckIsWished(View):
                 is_favorited = False
                 msg = '商品未收藏'
             
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '200',
                 'msg': msg,
                 'is_favorited': is_favorited
@@ -93,7 +97,7 @@ class CheckIsWished(View):
         except Exception as e:
             logger = logging.getLogger(__name__)
             logger.error(f"检查收藏状态时发生错误: {str(e)}")
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '500',
                 'msg': f'服务器内部错误: {str(e)}',
                 'is_favorited': False
@@ -111,36 +115,36 @@ class AddUserWish(View):
             
             # 验证必要参数
             if not user_id or not goods_id:
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '400',
                     'msg': '缺少必要参数'
                 })
             
             # 验证用户和商品是否存在
             try:
-                user = User.objects.get(id=int(user_id))
-                goods = Goods.objects.get(id=int(goods_id))
+                user = request.loaders.users.get(user_id)
+                goods = request.loaders.goods.get(goods_id)
             except (User.DoesNotExist, Goods.DoesNotExist):
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '404',
                     'msg': '用户或商品不存在'
                 })
             except ValueError:
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '400',
                     'msg': '参数格式错误'
                 })
             
             # 检查用户是否试图收藏自己的商品
             if goods.publisher_id == user.id:
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '400',
                     'msg': '不能收藏自己发布的商品'
                 })
             
             # 检查是否已经收藏
             if UserWish.objects.filter(user=user, goods=goods).exists():
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '409',
                     'msg': '该商品已在您的收藏中'
                 })
@@ -155,7 +159,7 @@ class AddUserWish(View):
                 logger = logging.getLogger(__name__)
                 logger.info(f"用户 {user.nickname} 收藏了商品 {goods.title}")
                 
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '201',
                     'msg': '收藏成功',
                     'data': {
@@ -169,7 +173,7 @@ class AddUserWish(View):
             except Exception as e:
                 logger = logging.getLogger(__name__)
                 logger.error(f"创建收藏记录时发生错误: {str(e)}")
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '500',
                     'msg': f'服务器内部错误: {str(e)}'
                 })
@@ -177,7 +181,7 @@ class AddUserWish(View):
         except Exception as e:
             logger = logging.getLogger(__name__)
             logger.error(f"添加收藏时发生错误: {str(e)}")
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '500',
                 'msg': f'服务器内部错误: {str(e)}'
             })
\ No newline at end of file
@@ -1,6 +1,5 @@
 # api/views.py
 import logging
-from django.core.cache import cache
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
@@ -58,8 +57,7 @@ class LoginView(APIView):
             logger.info(f"jwt访问令牌：{refresh.access_token}")
             logger.info(f"jwt刷新令牌：{refresh}")
 
-            # 使用用户ID作为键的一部分，存储访问令牌，将JWT存储到Redis中
-            cache.set(f'jwt_token_{user.id}', str(refresh.access_token), timeout=1800)  # 30分钟
+            # 访问令牌由 trade.authentication.JWTAuthenticationMiddleware 在本地校验签名，不需要再存入Redis
             print(f"用户{user.nickname}登录成功")
 
             return Response({
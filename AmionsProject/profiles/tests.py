@@ -1,3 +1,70 @@
-from django.test import TestCase
+import json
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from trade.models import Goods, User
+from trade.testing import RedisTestCase
+
+from .views import TakeDownOrPutUpView
+
+
+# 商品上下架的测试：状态用带条件的 UPDATE 修改，检查之后商品被买家预订时不会覆盖预订状态
+class TakeDownOrPutUpTests(RedisTestCase):
+    url = '/api/user/profiles/takedown_or_putup/'
+
+    def setUp(self):
+        super().setUp()
+        self.seller = User.objects.create(phone='13800000301', password='x', nickname='seller')
+        self.admin = User.objects.create(phone='13800000302', password='x', nickname='admin', role=User.ROLE_ADMIN)
+        self.goods = Goods.objects.create(
+            title='二手自行车', category_id=1, price=Decimal('99.50'), quality=8, publisher=self.seller
+        )
+
+    def post(self, user, current_status):
+        return json.loads(self.client.post(self.url, {
+            'user_id': user.id, 'goods_id': self.goods.id, 'current_status': current_status
+        }).content)
+
+    def assertGoodsStatus(self, status):
+        self.goods.refresh_from_db()
+        self.assertEqual(self.goods.status, status)
+
+    def test_take_down_and_put_up(self):
+        with mock.patch('profiles.views.send_goods_changed') as goods_changed:
+            response = self.post(self.seller, Goods.STATUS_ON)
+            self.assertEqual((response['status'], response['data']['new_status']), ('200', Goods.STATUS_OFF))
+            self.assertGoodsStatus(Goods.STATUS_OFF)
+
+            response = self.post(self.seller, Goods.STATUS_OFF)
+            self.assertEqual((response['status'], response['data']['new_status']), ('200', Goods.STATUS_ON))
+            self.assertGoodsStatus(Goods.STATUS_ON)
+        # 条件更新不触发 post_save，每次修改都手动通知缓存和索引
+        self.assertEqual(goods_changed.call_args_list, [mock.call(self.goods.id)] * 2)
+
+    def test_admin_take_down_is_forced(self):
+        response = self.post(self.admin, Goods.STATUS_ON)
+        self.assertEqual(response['data']['new_status'], Goods.STATUS_FORCE_OFF)
+        self.assertGoodsStatus(Goods.STATUS_FORCE_OFF)
+        self.assertEqual(self.post(self.seller, Goods.STATUS_OFF)['status'], '403')
+        self.assertGoodsStatus(Goods.STATUS_FORCE_OFF)
+
+    def test_reservation_after_check_is_a_conflict(self):
+        take_down = TakeDownOrPutUpView._take_down_goods
+
+        def reserve_then_take_down(view, user, goods):
+            # 视图读取商品之后、更新之前，买家下单预订了该商品
+            Goods.objects.filter(id=goods.id).update(status=Goods.STATUS_RESERVED)
+            return take_down(view, user, goods)
+
+        with mock.patch.object(TakeDownOrPutUpView, '_take_down_goods', reserve_then_take_down), \
+                mock.patch('profiles.views.send_goods_changed') as goods_changed:
+            response = self.post(self.seller, Goods.STATUS_ON)
+        self.assertEqual(response['status'], '409')
+        self.assertGoodsStatus(Goods.STATUS_RESERVED)
+        goods_changed.assert_not_called()
+
+    def test_sold_goods_cannot_be_taken_down(self):
+        Goods.objects.filter(id=self.goods.id).update(status=Goods.STATUS_SOLD)
+        # 前端传来的 current_status 已经过期
+        self.assertEqual(self.post(self.seller, Goods.STATUS_ON)['status'], '409')
+        self.assertGoodsStatus(Goods.STATUS_SOLD)
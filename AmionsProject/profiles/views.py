@@ -1,107 +1,43 @@
-import json
 import logging
 
 from django.contrib.auth.hashers import check_password, make_password
-from django.core.cache import cache
 from django.db import connection
-from django.db.models import Subquery, OuterRef, Exists
-from django.http import HttpResponse, JsonResponse
+from django.db.models import Subquery, OuterRef, Exists, F
+from django.http import HttpResponse
+from trade.responses import OrjsonResponse
+from django.utils.decorators import method_decorator
 from django.views import View
 from trade.models import Goods, User, Order, UserWish  # 导入Goods和User模型
 from django.conf import settings
+from chat.nicknames import invalidate_nickname
+from trade.authentication import jwt_required
+from trade.conditional import TABLE_GOODS, TABLE_USER, TABLE_USER_WISH, etag_by_tables
+from trade.serializers import GOODS_LIST_FIELDS, serialize_goods_queryset
+from settlement.settle import send_goods_changed
 
-#获取我发布的商品
+#获取我发布的商品（需要登录，令牌由 trade.authentication.JWTAuthenticationMiddleware 校验）
 class publishedGoods(View):
+    @method_decorator(jwt_required)
     def get(self,request):
         logger = logging.getLogger(__name__)
         logger.info("个人信息页显示已发布的信息，进入后端get请求中")
         user_id = request.GET.get('user_id')
         logger.info(f"user_id为{user_id}")
 
-        # 从请求头获取token并验证格式
-        auth_header = request.META.get('HTTP_AUTHORIZATION', '')
-        print(f"请求头中获取的token:{auth_header}")
-
-        # 1. 检查认证头格式
-        if not auth_header.startswith('Bearer '):
-            return JsonResponse({
-                'status': '401',
-                'msg': '认证失败: 无效的认证头格式'
-            })
-        # 提取token
-        token = auth_header[7:]  # 移除'Bearer '
-        print(f"提取的JWT令牌: {token[:20]}...")
-
-        # 如果Redis中没有找到对应的令牌键，返回401
-        if not cache.get(f"jwt_token_{user_id}"):
-            print(f"❌ Redis中未找到对应的jwt_token_{{用户ID}}键，认证失败")
-            return JsonResponse({
-                'status': '401',
-                'msg': '认证失败: 令牌无效或已过期'
-            })
-
-        print(f"✅ 认证通过：JWT格式正确且Redis中存在对应令牌键")
-        
-        # 检查是否提供了user_id
-        if not user_id:
+        # 兼容旧版前端传来的 user_id，但只能查看登录用户自己发布的商品
+        if user_id and str(user_id) != str(request.auth_user_id):
             results_json = {
-                "status": "400",
-                "msg": "缺少用户ID参数1",
+                "status": "403",
+                "msg": "只能查看自己发布的商品",
                 "goods_list": []
             }
-            return HttpResponse(
-                json.dumps(results_json, indent=4, ensure_ascii=False),
-                content_type="application/json; charset=utf-8"
-            )
-        
+            return OrjsonResponse(results_json)
+
         try:
-            # 验证用户是否存在
-            user = User.objects.get(id=int(user_id))
-        except User.DoesNotExist:
-            results_json = {
-                "status": "404",
-                "msg": "用户不存在",
-                "goods_list": []
-            }
-            return HttpResponse(
-                json.dumps(results_json, indent=4, ensure_ascii=False),
-                content_type="application/json; charset=utf-8"
+            # 查询该用户发布的所有商品，一条查询完成序列化
+            goods_list = serialize_goods_queryset(
+                Goods.objects.filter(publisher_id=request.auth_user_id, status=Goods.STATUS_ON)
             )
-        except ValueError:
-            results_json = {
-                "status": "400",
-                "msg": "用户ID必须是数字",
-                "goods_list": []
-            }
-            return HttpResponse(
-                json.dumps(results_json, indent=4, ensure_ascii=False),
-                content_type="application/json; charset=utf-8"
-            )
-        
-        try:
-            # 查询该用户发布的所有商品
-            user_goods = Goods.objects.filter(publisher=user,status=Goods.STATUS_ON)
-            
-            # 序列化商品数据
-            goods_list = []
-            for goods in user_goods:
-                # 构造完整的图片URL
-                image_url = ""
-                if goods.image:
-                    image_url = f"{settings.MEDIA_URL}{goods.image}".replace("\\", "/")
-                
-                goods_list.append({
-                    "id": goods.id,
-                    "title": goods.title,
-                    "category_id": goods.category_id,
-                    "price": float(goods.price),
-                    "quality": goods.quality,
-                    "status": goods.status,
-                    "create_time": goods.create_time.strftime("%Y-%m-%d %H:%M:%S"),
-                    "image": image_url,  # 返回完整的图片URL
-                    "publisher_id": goods.publisher.id,
-                    "publisher_nickname": goods.publisher.nickname  # 添加发布者昵称
-                })
 
             print("用户正在查看个人信息页")
             results_json = {
@@ -111,10 +47,7 @@ class publishedGoods(View):
                 "goods_list": goods_list
             }
             
-            return HttpResponse(
-                json.dumps(results_json, indent=4, ensure_ascii=False),
-                content_type="application/json; charset=utf-8"
-            )
+            return OrjsonResponse(results_json)
             
         except Exception as e:
             logger.error(f"查询用户商品时发生错误: {str(e)}")
@@ -123,10 +56,7 @@ class publishedGoods(View):
                 "msg": "服务器内部错误",
                 "goods_list": []
             }
-            return HttpResponse(
-                json.dumps(results_json, indent=4, ensure_ascii=False),
-                content_type="application/json; charset=utf-8"
-            )
+            return OrjsonResponse(results_json)
 
 
     def post(self,request):
@@ -139,7 +69,7 @@ class UpdateNickname(View):
         new_nickname = request.GET.get('new_nickname')
         
         if not user_id:
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '400',
                 'msg': '缺少用户ID参数2',
                 'nickname': '',
@@ -152,7 +82,7 @@ class UpdateNickname(View):
             # 如果提供了新昵称，检查是否与当前昵称相同
             if new_nickname is not None:
                 is_same = user.nickname.strip() == new_nickname.strip()
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '200',
                     'msg': '检查昵称完成',
                     'nickname': user.nickname,
@@ -160,21 +90,21 @@ class UpdateNickname(View):
                 })
             else:
                 # 获取当前昵称
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '200',
                     'msg': '获取用户昵称成功',
                     'nickname': user.nickname,
                     'is_same': False
                 })
         except User.DoesNotExist:
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '404',
                 'msg': '用户不存在',
                 'nickname': '',
                 'is_same': False
             })
         except ValueError:
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '400',
                 'msg': '用户ID必须是数字',
                 'nickname': '',
@@ -190,7 +120,7 @@ class UpdateNickname(View):
         
         # 验证参数
         if not user_id or not new_nickname:
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '400',
                 'msg': '缺少必要参数（用户ID或新昵称）'
             })
@@ -198,20 +128,20 @@ class UpdateNickname(View):
         try:
             user_id = int(user_id)
         except ValueError:
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '400',
                 'msg': '用户ID必须是数字'
             })
         
         # 检查新昵称长度
         if len(new_nickname.strip()) == 0:
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '400',
                 'msg': '昵称不能为空'
             })
         
         if len(new_nickname) > 32:  # 根据User模型中nickname字段的最大长度
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '400',
                 'msg': '昵称长度不能超过32个字符'
             })
@@ -222,7 +152,7 @@ class UpdateNickname(View):
             
             # 检查新昵称是否与当前昵称相同
             if user.nickname.strip() == new_nickname.strip():
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '400',
                     'msg': '新昵称与当前昵称相同，请输入不同的昵称'
                 })
@@ -231,10 +161,12 @@ class UpdateNickname(View):
             old_nickname = user.nickname
             user.nickname = new_nickname.strip()
             user.save()
+            # 清除聊天中使用的昵称缓存
+            invalidate_nickname(user_id)
             
             print(f"用户昵称已从 '{old_nickname}' 更新为 '{new_nickname}'")
             
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '200',
                 'msg': '昵称更新成功',
                 'old_nickname': old_nickname,
@@ -242,13 +174,13 @@ class UpdateNickname(View):
             })
             
         except User.DoesNotExist:
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '404',
                 'msg': '用户不存在'
             })
         except Exception as e:
             logger.error(f"更新用户昵称时发生错误: {str(e)}")
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '500',
                 'msg': '服务器内部错误'
             })
@@ -267,10 +199,7 @@ class BoughtView(View):
                 "msg": "缺少买家ID参数",
                 "data": []
             }
-            return HttpResponse(
-                json.dumps(results_json, indent=4, ensure_ascii=False),
-                content_type="application/json; charset=utf-8"
-            )
+            return OrjsonResponse(results_json)
 
         try:
             # 验证用户是否存在
@@ -281,20 +210,14 @@ class BoughtView(View):
                 "msg": "买家不存在",
                 "data": []
             }
-            return HttpResponse(
-                json.dumps(results_json, indent=4, ensure_ascii=False),
-                content_type="application/json; charset=utf-8"
-            )
+            return OrjsonResponse(results_json)
         except ValueError:
             results_json = {
                 "status": "400",
                 "msg": "买家ID必须是数字",
                 "data": []
             }
-            return HttpResponse(
-                json.dumps(results_json, indent=4, ensure_ascii=False),
-                content_type="application/json; charset=utf-8"
-            )
+            return OrjsonResponse(results_json)
 
         try:
 
@@ -303,56 +226,18 @@ class BoughtView(View):
                 buyer_id=int(buyer_id),
                 status=Order.STATUS_PAY
             ).values_list('goods_id', flat=True)
-            goods_list = Goods.objects.filter(id__in=goods_ids)
-
-            # 使用更安全的方式打印结果
-            if goods_list.exists():
-                print(f"用户查询到购买了 {goods_list.count()} 个商品")
-                for idx, goods in enumerate(goods_list):
-                    print(f"商品 {idx + 1}: ID={goods.id}, 标题={goods.title},卖家ID:{goods.publisher_id}",)
-            else:
-                print("用户未查询到商品")
-
-
-            # 序列化商品数据
-            bought_goods_list = []
-            for goods in goods_list:
-                # 构造完整的图片URL
-                image_url = ""
-                if goods.image:
-                    image_url = f"{settings.MEDIA_URL}{goods.image}".replace("\\", "/")
-
-
-                    # 安全地获取发布者信息
-                publisher_id = goods.publisher.id if goods.publisher else None
-                publisher_nickname = goods.publisher.nickname if goods.publisher else "未知发布者"
-
-
-                bought_goods_list.append({
-                    "id": goods.id,
-                    "title": goods.title,
-                    "category_id": goods.category_id,
-                    "price": float(goods.price),
-                    "quality": goods.quality,
-                    "status": goods.status,
-                    "create_time": goods.create_time.strftime("%Y-%m-%d %H:%M:%S"),
-                    "image": image_url,  # 返回完整的图片URL
-                    "publisher_id": publisher_id,
-                    "publisher_nickname": publisher_nickname  # 添加发布者昵称
-                })
+            bought_goods_list = serialize_goods_queryset(Goods.objects.filter(id__in=goods_ids))
+            print(f"用户查询到购买了 {len(bought_goods_list)} 个商品")
 
             print("用户正在查看购买到的商品")
             results_json = {
                 "status": "200",
                 "msg": "获取用户购买的商品列表成功",
-                "goods_count": len(goods_list),  # 添加商品数量
+                "goods_count": len(bought_goods_list),  # 添加商品数量
                 "data": bought_goods_list
             }
 
-            return HttpResponse(
-                json.dumps(results_json, indent=4, ensure_ascii=False),
-                content_type="application/json; charset=utf-8"
-            )
+            return OrjsonResponse(results_json)
 
         except Exception as e:
             results_json = {
@@ -360,10 +245,7 @@ class BoughtView(View):
                 "msg": e,
                 "data": []
             }
-            return HttpResponse(
-                json.dumps(results_json, indent=4, ensure_ascii=False),
-                content_type="application/json; charset=utf-8"
-            )
+            return OrjsonResponse(results_json)
 #获取已卖出的的商品
 class SoldView(View):
     def get(self, request):
@@ -378,10 +260,7 @@ class SoldView(View):
                 "msg": "缺少卖家ID参数",
                 "data": []
             }
-            return HttpResponse(
-                json.dumps(results_json, indent=4, ensure_ascii=False),
-                content_type="application/json; charset=utf-8"
-            )
+            return OrjsonResponse(results_json)
 
         try:
             # 验证用户是否存在
@@ -392,20 +271,14 @@ class SoldView(View):
                 "msg": "卖家不存在",
                 "data": []
             }
-            return HttpResponse(
-                json.dumps(results_json, indent=4, ensure_ascii=False),
-                content_type="application/json; charset=utf-8"
-            )
+            return OrjsonResponse(results_json)
         except ValueError:
             results_json = {
                 "status": "400",
                 "msg": "卖家ID必须是数字",
                 "data": []
             }
-            return HttpResponse(
-                json.dumps(results_json, indent=4, ensure_ascii=False),
-                content_type="application/json; charset=utf-8"
-            )
+            return OrjsonResponse(results_json)
 
         try:
 
@@ -414,50 +287,21 @@ class SoldView(View):
                 seller_id=int(seller_id),
                 status=Order.STATUS_PAY
             ).values_list('goods_id', flat=True)
-            goods_list = Goods.objects.filter(id__in=goods_ids)
-
-            # 使用更安全的方式打印结果
-            if goods_list.exists():
-                print(f"用户查询到购买了 {goods_list.count()} 个商品")
-                for idx, goods in enumerate(goods_list):
-                    print(f"商品 {idx + 1}: ID={goods.id}, 标题={goods.title}")
-            else:
-                print("用户未查询到商品")
-
-
-            # 序列化商品数据
-            sold_goods_list = []
-            for goods in goods_list:
-                # 构造完整的图片URL
-                image_url = ""
-                if goods.image:
-                    image_url = f"{settings.MEDIA_URL}{goods.image}".replace("\\", "/")
-
-                # 安全地获取发布者信息
-                sold_goods_list.append({
-                    "id": goods.id,
-                    "title": goods.title,
-                    "category_id": goods.category_id,
-                    "price": float(goods.price),
-                    "quality": goods.quality,
-                    "status": goods.status,
-                    "create_time": goods.create_time.strftime("%Y-%m-%d %H:%M:%S"),
-                    "image": image_url,  # 返回完整的图片URL
-
-                })
+            sold_goods_list = serialize_goods_queryset(
+                Goods.objects.filter(id__in=goods_ids),
+                fields=("id", "title", "category_id", "price", "quality", "status", "create_time", "image")
+            )
+            print(f"用户查询到卖出了 {len(sold_goods_list)} 个商品")
 
             print("用户正在查询售卖的商品")
             results_json = {
                 "status": "200",
                 "msg": "获取卖家售卖的商品列表成功",
-                "goods_count": len(goods_list),  # 添加商品数量
+                "goods_count": len(sold_goods_list),  # 添加商品数量
                 "data": sold_goods_list
             }
 
-            return HttpResponse(
-                json.dumps(results_json, indent=4, ensure_ascii=False),
-                content_type="application/json; charset=utf-8"
-            )
+            return OrjsonResponse(results_json)
 
         except Exception as e:
             results_json = {
@@ -465,10 +309,7 @@ class SoldView(View):
                 "msg": e,
                 "bought_goods_list": []
             }
-            return HttpResponse(
-                json.dumps(results_json, indent=4, ensure_ascii=False),
-                content_type="application/json; charset=utf-8"
-            )
+            return OrjsonResponse(results_json)
 
 class ChangePassword(View):
 
@@ -479,21 +320,21 @@ class ChangePassword(View):
 
         # 验证参数
         if not phone or not current_password or not new_password:
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '400',
                 'msg': '缺少必要参数'
             })
 
         # 验证手机号格式
         if len(phone) != 11 or not phone.isdigit():
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '400',
                 'msg': '手机号格式不正确'
             })
 
         # 检查新密码长度
         if len(new_password) < 6 or len(new_password) > 20:
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '400',
                 'msg': '新密码长度应在6-20位之间'
             })
@@ -502,21 +343,21 @@ class ChangePassword(View):
             # 查找用户
             user = User.objects.get(phone=phone)
         except User.DoesNotExist:
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '404',
                 'msg': '用户不存在'
             })
 
         # 验证当前密码是否正确
         if not check_password(current_password,user.password):
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '400',
                 'msg': '当前密码错误'
             })
 
         # 检查新密码是否与当前密码相同
         if new_password==user.password:
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '400',
                 'msg': '新密码不能与当前密码相同'
             })
@@ -527,7 +368,7 @@ class ChangePassword(View):
 
         print(f"用户 {user.nickname} 密码修改成功")
         
-        return JsonResponse({
+        return OrjsonResponse({
             'status': '200',
             'msg': '密码修改成功'
         })
@@ -559,33 +400,14 @@ class OffShelfView(View):
         
         try:
             # 查询该用户已下架的所有商品（status=3和4）
-            off_shelf_goods = Goods.objects.filter(
-                publisher=user,
-                status__in=[Goods.STATUS_OFF, Goods.STATUS_FORCE_OFF]
+            goods_list = serialize_goods_queryset(
+                Goods.objects.filter(
+                    publisher=user,
+                    status__in=[Goods.STATUS_OFF, Goods.STATUS_FORCE_OFF]
+                ),
+                fields=GOODS_LIST_FIELDS + ("details",)
             )
 
-            # 序列化商品数据
-            goods_list = []
-            for goods in off_shelf_goods:
-                # 构造完整的图片URL
-                image_url = ""
-                if goods.image:
-                    image_url = f"{settings.MEDIA_URL}{goods.image}".replace("\\", "/")
-
-                goods_list.append({
-                    "id": goods.id,
-                    "title": goods.title,
-                    "category_id": goods.category_id,
-                    "price": float(goods.price),
-                    "quality": goods.quality,
-                    "status": goods.status,
-                    "create_time": goods.create_time.strftime("%Y-%m-%d %H:%M:%S"),
-                    "image": image_url,  # 返回完整的图片URL
-                    "publisher_id": goods.publisher.id,
-                    "publisher_nickname": goods.publisher.nickname,  # 添加发布者昵称
-                    "details": goods.details
-                })
-
             print(f"用户 {user.nickname} 查询到 {len(goods_list)} 个已下架商品")
             results_json = {
                 "status": "200",
@@ -594,10 +416,7 @@ class OffShelfView(View):
                 "data": goods_list
             }
 
-            return HttpResponse(
-                json.dumps(results_json, indent=4, ensure_ascii=False),
-                content_type="application/json; charset=utf-8"
-            )
+            return OrjsonResponse(results_json)
 
         except Exception as e:
             return HttpResponse({
@@ -611,6 +430,7 @@ class OffShelfView(View):
         return HttpResponse({'error':'请用get请求访问'},status=405)
 
 #获取我想要的商品
+@method_decorator(etag_by_tables(TABLE_USER_WISH, TABLE_GOODS, TABLE_USER), name='get')
 class WishGoodsView(View):
     def get(self, request, user_id):
         logger = logging.getLogger(__name__)
@@ -619,7 +439,7 @@ class WishGoodsView(View):
 
         # 检查是否提供了user_id
         if not user_id:
-            return JsonResponse({
+            return OrjsonResponse({
                 "status": "400",
                 "msg": "缺少用户ID参数",
                 "data": []
@@ -629,48 +449,26 @@ class WishGoodsView(View):
             # 验证用户是否存在
             user = User.objects.get(id=int(user_id))
         except User.DoesNotExist:
-            return JsonResponse({
+            return OrjsonResponse({
                 "status": "404",
                 "msg": "用户不存在",
                 "data": []
             })
         except ValueError:
-            return JsonResponse({
+            return OrjsonResponse({
                 "status": "400",
                 "msg": "用户ID必须是数字",
                 "data": []
             })
 
         try:
-            # 查询该用户收藏夹的所有商品，使用select_related优化查询
-            wish_items = UserWish.objects.select_related('goods', 'goods__publisher').filter(
-                user=user,
+            # 查询该用户收藏夹的所有商品，收藏时间通过同一个 JOIN 一并取回
+            goods_list = serialize_goods_queryset(
+                Goods.objects.filter(userwish__user=user).order_by('userwish__id'),
+                fields=GOODS_LIST_FIELDS + ("details",),
+                extra={"wish_time": F('userwish__create_time')}
             )
 
-            # 序列化商品数据
-            goods_list = []
-            for wish_item in wish_items:
-                goods = wish_item.goods
-                # 构造完整的图片URL
-                image_url = ""
-                if goods.image:
-                    image_url = f"{settings.MEDIA_URL}{goods.image}".replace("\\", "/")
-
-                goods_list.append({
-                    "id": goods.id,
-                    "title": goods.title,
-                    "category_id": goods.category_id,
-                    "price": float(goods.price),
-                    "quality": goods.quality,
-                    "status": goods.status,
-                    "create_time": goods.create_time.strftime("%Y-%m-%d %H:%M:%S"),
-                    "image": image_url,  # 返回完整的图片URL
-                    "publisher_id": goods.publisher.id,
-                    "publisher_nickname": goods.publisher.nickname,  # 添加发布者昵称
-                    "details": goods.details,
-                    "wish_time": wish_item.create_time.strftime("%Y-%m-%d %H:%M:%S")  # 收藏时间
-                })
-
             print(f"用户 {user.nickname} 查询到收藏夹中 {len(goods_list)} 个商品")
             results_json = {
                 "status": "200",
@@ -679,14 +477,11 @@ class WishGoodsView(View):
                 "data": goods_list
             }
 
-            return HttpResponse(
-                json.dumps(results_json, indent=4, ensure_ascii=False),
-                content_type="application/json; charset=utf-8"
-            )
+            return OrjsonResponse(results_json)
 
         except Exception as e:
             logger.error(f"查询用户收藏夹商品时发生错误: {str(e)}")
-            return JsonResponse({
+            return OrjsonResponse({
                 "status": "500",
                 "msg": "服务器内部错误",
                 "data": []
@@ -704,25 +499,27 @@ class TakeDownOrPutUpView(View):
 
         try:
             if not user_id or not goods_id or not current_status:
-                return JsonResponse({
+                return OrjsonResponse({
                     'status':'400',
                     'msg':'缺少必要参数',
                     'data':[]
                 })
 
             try:
-                # 验证用户和商品是否存在
-                user = User.objects.get(id=int(user_id))
-                goods = Goods.objects.get(id=int(goods_id))
+                # 验证用户和商品是否存在，操作者和商品发布者合并成一条查询（见 trade/loaders.py）
+                goods = request.loaders.goods.get(goods_id)
+                user = request.loaders.attach_publishers([goods], user_id)[int(user_id)]
+                if user is None:
+                    raise User.DoesNotExist
                 current_status = int(current_status)
             except (User.DoesNotExist, Goods.DoesNotExist):
-                return JsonResponse({
+                return OrjsonResponse({
                     "status": "404",
                     "msg": "用户或商品不存在",
                     "data": []
                 })
             except ValueError:
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '400',
                     'msg': '参数格式错误',
                     'data': []
@@ -734,19 +531,19 @@ class TakeDownOrPutUpView(View):
             elif current_status == Goods.STATUS_OFF:  # 已下架状态(3) - 执行上架
                 return self._put_up_goods(user, goods)
             elif current_status == Goods.STATUS_FORCE_OFF:  # 强制下架状态(4) - 无法上架
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '400',
                     'msg': '该商品已被强制下架，请联系管理员',
                     'data': []
                 })
             elif current_status == Goods.STATUS_SOLD:  # 已卖出状态(2) - 无法操作
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '400',
                     'msg': '商品已卖出',
                     'data': []
                 })
             else:
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '400',
                     'msg': '未知的商品状态',
                     'data': []
@@ -755,45 +552,78 @@ class TakeDownOrPutUpView(View):
         except Exception as e:
             logger = logging.getLogger(__name__)
             logger.error(f"商品上下架操作时发生错误: {str(e)}")
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '500',
                 'msg': f'服务器内部错误: {str(e)}',
                 'data': []
             })
 
+    @staticmethod
+    def _change_status(goods, from_status, to_status):
+        """条件更新商品状态，商品已不是 from_status 时不更新并返回 False"""
+        updated = Goods.objects.filter(id=goods.id, status=from_status).update(status=to_status)
+        if not updated:
+            return False
+        goods.status = to_status
+        # queryset.update() 不触发 post_save，手动通知商品缓存、索引和表版本号
+        send_goods_changed(goods.id)
+        return True
+
+    @staticmethod
+    def _status_conflict():
+        return OrjsonResponse({
+            'status': '409',
+            'msg': '商品状态已发生变化，请刷新后重试',
+            'data': []
+        })
+
     def _take_down_goods(self, user, goods):
         """执行下架操作"""
         # 检查商品是否已经是下架状态
         if goods.status in [Goods.STATUS_OFF, Goods.STATUS_FORCE_OFF]:
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '400',
                 'msg': '商品已经处于下架状态',
                 'data': []
             })
 
+        # 已被买家下单预订的商品等待付款或预订超时，不能下架
+        if goods.status == Goods.STATUS_RESERVED:
+            return OrjsonResponse({
+                'status': '400',
+                'msg': '商品已被买家预订，等待付款中',
+                'data': []
+            })
+
         # 检查用户是否有权限操作该商品
         is_self_operation = goods.publisher.id == user.id
 
         if not is_self_operation:
             # 检查操作者角色是否高于发布者
             if user.role <= goods.publisher.role:
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '403',
                     'msg': '权限不足',
                     'data': []
                 })
 
             # 高权限用户下架 - 设置为强制下架
-            goods.status = Goods.STATUS_FORCE_OFF
-            print(f"管理员 {user.nickname}(角色:{user.get_role_display()}) 强制下架了用户 {goods.publisher.nickname} 的商品: {goods.title}")
+            new_status = Goods.STATUS_FORCE_OFF
         else:
             # 用户自己下架 - 设置为普通下架
-            goods.status = Goods.STATUS_OFF
-            print(f"用户 {user.nickname} 自行下架了自己的商品: {goods.title}")
+            new_status = Goods.STATUS_OFF
+
+        # 带条件的 UPDATE：检查之后商品可能刚被买家下单预订，只有仍然在售时才下架，
+        # 不用 save() 整行写回，避免覆盖预订状态
+        if not self._change_status(goods, Goods.STATUS_ON, new_status):
+            return self._status_conflict()
 
-        goods.save()
+        if is_self_operation:
+            print(f"用户 {user.nickname} 自行下架了自己的商品: {goods.title}")
+        else:
+            print(f"管理员 {user.nickname}(角色:{user.get_role_display()}) 强制下架了用户 {goods.publisher.nickname} 的商品: {goods.title}")
 
-        return JsonResponse({
+        return OrjsonResponse({
             'status': '200',
             'msg': '商品下架成功',
             'data': {
@@ -810,7 +640,7 @@ class TakeDownOrPutUpView(View):
         """执行上架操作"""
         # 检查商品是否已经是上架状态
         if goods.status == Goods.STATUS_ON:
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '400',
                 'msg': '商品已经处于在售状态',
                 'data': []
@@ -818,27 +648,35 @@ class TakeDownOrPutUpView(View):
 
         # 检查是否为强制下架状态
         if goods.status == Goods.STATUS_FORCE_OFF:
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '403',
                 'msg': '该商品已被强制下架，请联系管理员',
                 'data': []
             })
 
+        # 已被买家预订的商品由预订超时释放恢复在售
+        if goods.status == Goods.STATUS_RESERVED:
+            return OrjsonResponse({
+                'status': '400',
+                'msg': '商品已被买家预订，等待付款中',
+                'data': []
+            })
+
         # 只有商品发布者可以将自己下架的商品重新上架
         if goods.publisher.id != user.id:
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '403',
                 'msg': '只有商品发布者才能上架自己下架的商品',
                 'data': []
             })
 
-        # 执行上架操作
-        goods.status = Goods.STATUS_ON
-        goods.save()
+        # 执行上架操作，只有仍然是自行下架状态时才上架
+        if not self._change_status(goods, Goods.STATUS_OFF, Goods.STATUS_ON):
+            return self._status_conflict()
 
         print(f"用户 {user.nickname} 上架了自己之前下架的商品: {goods.title}")
 
-        return JsonResponse({
+        return OrjsonResponse({
             'status': '200',
             'msg': '商品上架成功',
             'data': {
@@ -851,4 +689,4 @@ class TakeDownOrPutUpView(View):
         })
     
     def get(self, request):
-        return JsonResponse({'error': '请用post请求访问'}, status=405)
+        return OrjsonResponse({'error': '请用post请求访问'}, status=405)
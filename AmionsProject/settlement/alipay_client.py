@@ -0,0 +1,94 @@
+import logging
+import re
+import threading
+
+from alipay import AliPay
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+# 进程内共享的支付宝客户端
+# 原来每次发起支付、每次支付宝回调都要重新读取 PEM 文件、执行 clean_key 正则并解析 RSA 密钥，
+# 现在使用 settings.py 启动时已经读取好的密钥，在第一次使用时构建一次 AliPay 对象，之后所有请求复用。
+# AliPay 对象只在签名/验签时读取密钥，可以在多个线程之间共享。
+# 更换密钥后调用 reload_alipay_client() 重新从 settlement/keys 读取密钥文件并重建客户端
+
+_client = None
+_lock = threading.Lock()
+
+
+def clean_key(raw_key: str, key_type: str = "PRIVATE") -> str:
+    """
+    将原始密钥字符串格式化为符合SDK源码正则要求的PEM格式
+    :param raw_key: 原始密钥字符串（你的应用私钥/支付宝公钥）
+    :param key_type: 密钥类型，PRIVATE（私钥）或 PUBLIC（公钥）
+    :return: 符合正则要求的合法PEM格式字符串
+    """
+    # 1. 清理所有无关字符（换行、空格、回车、隐藏字符）
+    clean_key = re.sub(r'-----BEGIN.*-----|-----END.*-----|\r|\n|\s+', '', raw_key)
+
+    # 2. 按源码正则要求组装标准PEM格式：
+    #    - BEGIN行：开头可选空白 + -----BEGIN xxx----- + 至少一个空白（换行）
+    #    - END行：-----END xxx----- + 结尾可选空白，且BEGIN/END的marker必须一致
+    begin_line = f"-----BEGIN {key_type} KEY-----\n"  # \n满足\s+要求
+    end_line = f"\n-----END {key_type} KEY-----"  # 结尾无多余空格，满足\s*$要求
+    # 3. 拼接最终合法格式
+    valid_pem = begin_line + clean_key + end_line
+    return valid_pem
+
+
+def _build_client(app_private_key, alipay_public_key):
+    return AliPay(
+        appid=settings.ALIPAY_APPID,
+        app_notify_url=settings.ALIPAY_NOTIFY_URL,
+        app_private_key_string=clean_key(app_private_key, key_type="PRIVATE"),
+        alipay_public_key_string=clean_key(alipay_public_key, key_type="PUBLIC"),
+        sign_type="RSA2",
+        debug=settings.ALIPAY_DEBUG
+    )
+
+
+def get_alipay_client():
+    """返回共享的支付宝客户端，第一次调用时构建"""
+    global _client
+    client = _client
+    if client is None:
+        with _lock:
+            if _client is None:
+                _client = _build_client(settings.APP_PRIVATE_KEY, settings.ALIPAY_PUBLIC_KEY)
+            client = _client
+    return client
+
+
+def _read_key_files():
+    with open(settings.KEYS_DIR / 'app_private_key.pem', 'r', encoding='utf-8') as f:
+        app_private_key = f.read()
+    with open(settings.KEYS_DIR / 'alipay_public_key.pem', 'r', encoding='utf-8') as f:
+        alipay_public_key = f.read()
+    return app_private_key, alipay_public_key
+
+
+def reload_alipay_client(app_private_key=None, alipay_public_key=None):
+    """
+    更换密钥后重建客户端，不传参数时重新读取 settlement/keys 下的密钥文件
+    新客户端构建成功后才替换旧客户端，密钥有误时抛出异常并继续使用旧客户端
+    """
+    global _client
+    if app_private_key is None or alipay_public_key is None:
+        file_private_key, file_public_key = _read_key_files()
+        app_private_key = app_private_key or file_private_key
+        alipay_public_key = alipay_public_key or file_public_key
+    client = _build_client(app_private_key, alipay_public_key)
+    with _lock:
+        _client = client
+    logging.info("支付宝客户端已使用新的密钥重建")
+    return client
+
+
+@receiver(setting_changed)
+def _reset_client_on_setting_changed(setting, **kwargs):
+    # 测试中通过 override_settings 修改支付宝配置时丢弃旧客户端
+    global _client
+    if setting.startswith('ALIPAY_') or setting == 'APP_PRIVATE_KEY':
+        with _lock:
+            _client = None
@@ -0,0 +1,49 @@
+import time
+
+from alipay import AliPay
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from settlement.alipay_client import _read_key_files, clean_key, get_alipay_client
+
+
+#对比每次请求重新构建支付宝客户端与复用共享客户端的耗时：python manage.py bench_alipay_client [--rounds 200]
+class Command(BaseCommand):
+    help = "对比支付请求中“读取密钥文件 + 解析密钥 + 构建 AliPay”与复用共享客户端的单次耗时"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rounds', type=int, default=200, help="每种方式重复的次数")
+
+    def handle(self, *args, **options):
+        rounds = max(1, options['rounds'])
+
+        def per_request_client():
+            # 原来 PaySuccess / SettlementSuccessView 每次请求的做法
+            app_private_key, alipay_public_key = _read_key_files()
+            return AliPay(
+                appid=settings.ALIPAY_APPID,
+                app_notify_url=None,
+                app_private_key_string=clean_key(app_private_key, key_type="PRIVATE"),
+                alipay_public_key_string=clean_key(alipay_public_key, key_type="PUBLIC"),
+                sign_type="RSA2",
+                debug=settings.ALIPAY_DEBUG
+            )
+
+        def page_pay(client):
+            return client.api_alipay_trade_page_pay(
+                out_trade_no="1", total_amount="1.00", subject="benchmark", return_url=settings.ALIPAY_RETURN_URL
+            )
+
+        cases = (
+            ("每次构建客户端", per_request_client),
+            ("共享客户端", get_alipay_client),
+            ("每次构建客户端 + 签名", lambda: page_pay(per_request_client())),
+            ("共享客户端 + 签名", lambda: page_pay(get_alipay_client())),
+        )
+        for name, run in cases:
+            run()
+            start = time.perf_counter()
+            for _ in range(rounds):
+                run()
+            per_call = (time.perf_counter() - start) / rounds * 1000
+            self.stdout.write(f"{name:<16} 每次 {per_call:8.3f} ms")
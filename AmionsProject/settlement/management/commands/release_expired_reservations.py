@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from settlement.reservation import release_expired_reservations
+
+
+#关闭预订超时未付款的订单并恢复商品在售，建议由定时任务每分钟执行一次：python manage.py release_expired_reservations
+class Command(BaseCommand):
+    help = "关闭预订超时未付款的订单，对应商品恢复在售"
+
+    def handle(self, *args, **options):
+        count = release_expired_reservations()
+        self.stdout.write(self.style.SUCCESS(f"已释放 {count} 件预订超时的商品"))
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.9 on 2026-10-18 22:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlipayNotification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('out_trade_no', models.CharField(max_length=64, unique=True, verbose_name='商户订单号')),
+                ('trade_no', models.CharField(max_length=64, verbose_name='支付宝交易号')),
+                ('trade_status', models.CharField(max_length=32, verbose_name='交易状态')),
+                ('total_amount', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='订单金额')),
+                ('notify_id', models.CharField(blank=True, default='', max_length=128, verbose_name='通知ID')),
+                ('create_time', models.DateTimeField(auto_now_add=True, verbose_name='接收时间')),
+            ],
+            options={
+                'verbose_name': '支付宝异步通知',
+                'verbose_name_plural': '支付宝异步通知',
+                'db_table': 'alipay_notification',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.9 on 2026-10-18 22:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('settlement', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='alipaynotification',
+            name='refund_required',
+            field=models.BooleanField(db_index=True, default=False, verbose_name='需要退款'),
+        ),
+    ]
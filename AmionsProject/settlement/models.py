@@ -0,0 +1,23 @@
+from django.db import models
+
+
+# 支付宝异步通知记录表（幂等表）
+# 每个订单号只会成功插入一次，插入和订单结算在同一个事务中完成，
+# 支付宝重复发送的通知因为唯一索引冲突直接返回 success，不会重复结算；
+# 订单已关闭（预订超时）后才收到的支付成功通知同样记录在这里，并标记为需要退款
+class AlipayNotification(models.Model):
+    out_trade_no = models.CharField(max_length=64, unique=True, verbose_name="商户订单号")
+    trade_no = models.CharField(max_length=64, verbose_name="支付宝交易号")
+    trade_status = models.CharField(max_length=32, verbose_name="交易状态")
+    total_amount = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="订单金额")
+    notify_id = models.CharField(max_length=128, blank=True, default='', verbose_name="通知ID")
+    refund_required = models.BooleanField(default=False, db_index=True, verbose_name="需要退款")
+    create_time = models.DateTimeField(auto_now_add=True, verbose_name="接收时间")
+
+    class Meta:
+        db_table = "alipay_notification"
+        verbose_name = "支付宝异步通知"
+        verbose_name_plural = verbose_name
+
+    def __str__(self):
+        return f"{self.out_trade_no} {self.trade_status}"
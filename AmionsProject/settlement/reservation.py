@@ -0,0 +1,100 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from trade.conditional import TABLE_ORDER, bump_table_version
+from trade.models import Goods, Order
+
+from .settle import send_goods_changed
+
+# 下单时预订商品，防止多个买家同时为同一件商品创建订单
+# 1. Redis 预订键 goods:reserve:{商品id}（SET NX，过期时间与预订时长相同），
+#    抢不到的请求直接返回“已被预订”，不访问 MySQL
+# 2. 抢到预订键的请求在一个事务中执行
+#    UPDATE goods SET status=已预订, reserve_expire_time=? WHERE id=? AND status=在售
+#    更新成功才插入订单；Redis 不可用或预订键过期时由这条条件更新保证只有一个买家成功
+# 3. 超时未付款的预订由 release_expired_reservations 命令关闭订单并恢复在售
+
+
+def _reserve_key(goods_id):
+    return cache.make_key(f'goods:reserve:{goods_id}')
+
+
+def acquire_reserve_key(goods_id, buyer_id):
+    """
+    抢占商品的 Redis 预订键
+    :return: False 表示商品已被其他买家预订；Redis 不可用时返回 True，交给数据库的条件更新判断
+    """
+    try:
+        redis_conn = get_redis_connection('default')
+        return bool(redis_conn.set(_reserve_key(goods_id), buyer_id, nx=True, ex=settings.GOODS_RESERVE_TIMEOUT))
+    except Exception as e:
+        logging.error(f"抢占商品 ID: {goods_id} 的预订键失败：{str(e)}")
+        return True
+
+
+def release_reserve_key(goods_id):
+    try:
+        get_redis_connection('default').delete(_reserve_key(goods_id))
+    except Exception as e:
+        logging.error(f"删除商品 ID: {goods_id} 的预订键失败：{str(e)}")
+
+
+def reserve_goods(goods_id, buyer_id, seller_id, price):
+    """
+    在一个事务中把在售商品改为已预订并创建未支付订单
+    :return: 订单对象，商品已不是在售状态时返回 None
+    """
+    expire_time = timezone.now() + timedelta(seconds=settings.GOODS_RESERVE_TIMEOUT)
+    with transaction.atomic():
+        reserved = Goods.objects.filter(id=goods_id, status=Goods.STATUS_ON).update(
+            status=Goods.STATUS_RESERVED, reserve_expire_time=expire_time
+        )
+        if not reserved:
+            return None
+        order = Order.objects.create(
+            goods_id=goods_id,
+            buyer_id=buyer_id,
+            seller_id=seller_id,
+            price=price,
+            status=Order.STATUS_UNPAY
+        )
+        transaction.on_commit(lambda: send_goods_changed(goods_id))
+    return order
+
+
+def release_expired_reservations(now=None):
+    """
+    关闭预订超时的未支付订单，商品恢复在售
+    :return: 恢复在售的商品数量
+    """
+    now = now or timezone.now()
+    goods_ids = list(
+        Goods.objects.filter(status=Goods.STATUS_RESERVED, reserve_expire_time__lt=now).values_list('id', flat=True)
+    )
+    released_ids = []
+    for goods_id in goods_ids:
+        with transaction.atomic():
+            # 先更新订单再更新商品，与结算（settle_order）的加锁顺序一致，避免两者并发时死锁
+            Order.objects.filter(goods_id=goods_id, status=Order.STATUS_UNPAY).update(status=Order.STATUS_CLOSED)
+            released = Goods.objects.filter(
+                id=goods_id, status=Goods.STATUS_RESERVED, reserve_expire_time__lt=now
+            ).update(status=Goods.STATUS_ON, reserve_expire_time=None)
+            if not released:
+                # 商品在此期间已经付款结算，撤销对订单的关闭
+                transaction.set_rollback(True)
+                continue
+        released_ids.append(goods_id)
+
+    for goods_id in released_ids:
+        release_reserve_key(goods_id)
+        send_goods_changed(goods_id)
+    if released_ids:
+        bump_table_version(TABLE_ORDER)
+        logging.info(f"已释放 {len(released_ids)} 件预订超时的商品：{released_ids}")
+    return len(released_ids)
@@ -0,0 +1,71 @@
+import logging
+
+from django.db import IntegrityError, transaction
+from django.db.models.signals import post_save
+
+from trade.conditional import TABLE_ORDER, bump_table_version
+from trade.models import Goods, Order
+
+from .models import AlipayNotification
+
+# 订单结算：由支付宝异步通知（AlipayNotifyView）调用，不再依赖用户浏览器的同步跳转
+# 结算只使用带条件的 UPDATE ... WHERE status=未支付，不先读取再保存，多个通知并发到达时也只会结算一次：
+#   1. 插入 alipay_notification 记录，out_trade_no 唯一，重复通知在这里因唯一索引冲突直接结束
+#   2. UPDATE order SET status=已支付 WHERE id=? AND status=未支付
+#   3. UPDATE goods SET status=已卖出 WHERE id=? AND status<>已卖出（下单时商品已是已预订状态）
+# 三步在同一个事务中，任意一步失败整体回滚，支付宝会重新发送通知；
+# 第 2 步没有更新到订单（预订超时订单已关闭后买家才付款）时，把通知记录标记为需要退款，由人工退款
+
+# 表示支付成功的交易状态，其他状态（等待付款、交易关闭）只回复 success，不结算
+SETTLED_TRADE_STATUSES = ('TRADE_SUCCESS', 'TRADE_FINISHED')
+
+
+def send_goods_changed(goods_id, update_fields=('status',)):
+    """
+    queryset.update() 不会触发 post_save，条件更新商品状态后手动发送商品的 post_save 信号，
+    由原来的信号处理函数清除商品缓存、更新分类索引和搜索索引
+    """
+    goods = Goods.objects.filter(id=goods_id).first()
+    if goods is not None:
+        post_save.send(
+            sender=Goods, instance=goods, created=False, update_fields=set(update_fields), raw=False, using='default'
+        )
+
+
+def _after_settled(goods_id):
+    # 事务提交后再清除缓存，订单表版本号单独递增
+    bump_table_version(TABLE_ORDER)
+    send_goods_changed(goods_id)
+
+
+def settle_order(order_id, goods_id, params):
+    """
+    根据支付宝异步通知结算订单
+    :param params: 已经验签的通知参数
+    :return: True 表示本次通知完成了结算，False 表示重复通知或订单已不是未支付状态
+    """
+    try:
+        with transaction.atomic():
+            notification = AlipayNotification.objects.create(
+                out_trade_no=params['out_trade_no'],
+                trade_no=params.get('trade_no', ''),
+                trade_status=params['trade_status'],
+                total_amount=params['total_amount'],
+                notify_id=params.get('notify_id', ''),
+            )
+            paid = Order.objects.filter(id=order_id, status=Order.STATUS_UNPAY).update(status=Order.STATUS_PAY)
+            if paid:
+                Goods.objects.filter(id=goods_id).exclude(status=Goods.STATUS_SOLD).update(
+                    status=Goods.STATUS_SOLD, reserve_expire_time=None
+                )
+                transaction.on_commit(lambda: _after_settled(goods_id))
+            else:
+                notification.refund_required = True
+                notification.save(update_fields=['refund_required'])
+    except IntegrityError:
+        logging.info(f"订单 {order_id} 的支付宝通知已经处理过，忽略重复通知")
+        return False
+
+    if not paid:
+        logging.error(f"订单 {order_id} 收到支付成功通知，但订单已不是未支付状态，已记录为需要退款")
+    return bool(paid)
@@ -0,0 +1,64 @@
+from base64 import decodebytes, encodebytes
+from urllib.parse import parse_qsl, urlsplit
+
+from Cryptodome.Hash import SHA256
+from Cryptodome.PublicKey import RSA
+from Cryptodome.Signature import PKCS1_v1_5
+
+# 本地的支付宝网关替身，测试和压测时使用，不访问真实的支付宝
+# 生成两对 RSA 密钥：应用密钥（项目用私钥签名请求）和网关密钥（替身用私钥签名回调，项目用公钥验签）。
+# 用法：
+#   gateway = StubAlipayGateway()
+#   with override_settings(**gateway.settings()):
+#       params = gateway.parse_pay_url(alipay_url)                       # 校验项目生成的支付链接签名
+#       callback = gateway.sign_callback({'out_trade_no': '1', ...})     # 模拟支付宝回调参数
+
+STUB_APPID = '2021000000000000'
+STUB_GATEWAY_URL = 'https://alipay.stub/gateway.do'
+
+
+def _sign(private_key, message):
+    signature = PKCS1_v1_5.new(private_key).sign(SHA256.new(message.encode()))
+    return encodebytes(signature).decode().replace("\n", "")
+
+
+def _verify(public_key, message, signature):
+    return PKCS1_v1_5.new(public_key).verify(SHA256.new(message.encode()), decodebytes(signature.encode()))
+
+
+def _unsigned_string(params, exclude):
+    return "&".join(f"{key}={value}" for key, value in sorted(params.items()) if key not in exclude)
+
+
+class StubAlipayGateway:
+    def __init__(self, key_size=2048):
+        self.app_key = RSA.generate(key_size)
+        self.gateway_key = RSA.generate(key_size)
+
+    def settings(self):
+        """override_settings 使用的配置：项目持有应用私钥和网关公钥"""
+        return {
+            'ALIPAY_APPID': STUB_APPID,
+            'ALIPAY_URL': STUB_GATEWAY_URL,
+            'ALIPAY_DEBUG': True,
+            'APP_PRIVATE_KEY': self.app_key.export_key(pkcs=8).decode(),
+            'ALIPAY_PUBLIC_KEY': self.gateway_key.publickey().export_key().decode(),
+        }
+
+    def parse_pay_url(self, url):
+        """
+        解析项目生成的支付链接并用应用公钥校验签名（与支付宝网关的校验方式相同），
+        签名错误时抛出 ValueError
+        """
+        params = dict(parse_qsl(urlsplit(url).query, keep_blank_values=True))
+        signature = params.get('sign')
+        if not signature or not _verify(self.app_key.publickey(), _unsigned_string(params, {'sign'}), signature):
+            raise ValueError("支付请求签名校验失败")
+        return params
+
+    def sign_callback(self, params):
+        """用网关私钥给回调参数签名，返回带 sign 和 sign_type 的参数（同步跳转和异步通知格式相同）"""
+        params = {key: str(value) for key, value in params.items()}
+        params['sign_type'] = 'RSA2'
+        params['sign'] = _sign(self.gateway_key, _unsigned_string(params, {'sign', 'sign_type'}))
+        return params
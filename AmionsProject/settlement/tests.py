@@ -1,3 +1,356 @@
-from django.test import TestCase
+import json
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.db import connection
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from trade.models import Goods, Order, User
+
+from .alipay_client import _build_client, get_alipay_client, reload_alipay_client
+from .models import AlipayNotification
+from .reservation import release_expired_reservations, release_reserve_key
+from .settle import settle_order
+from .stub_gateway import StubAlipayGateway
+
+
+# 支付宝相关接口的测试，使用本地的支付宝网关替身（settlement/stub_gateway.py），不访问真实的支付宝
+class AlipayTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # 生成 RSA 密钥比较慢，整个测试类共用一个网关替身
+        cls.gateway = StubAlipayGateway()
+        cls.settings_override = override_settings(**cls.gateway.settings())
+        cls.settings_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings_override.disable()
+        super().tearDownClass()
+
+    def setUp(self):
+        # 每个测试都从使用网关替身密钥的客户端开始，避免测试之间互相影响
+        reload_alipay_client(self.gateway.settings()['APP_PRIVATE_KEY'], self.gateway.settings()['ALIPAY_PUBLIC_KEY'])
+        self.seller = User.objects.create(phone='13800000001', password='x', nickname='seller')
+        self.buyer = User.objects.create(phone='13800000002', password='x', nickname='buyer')
+        self.goods = Goods.objects.create(
+            title='二手自行车', category_id=1, price=Decimal('99.50'), quality=8, publisher=self.seller
+        )
+        self.order = Order.objects.create(
+            goods=self.goods, buyer=self.buyer, seller=self.seller, price=self.goods.price
+        )
+
+    def paid_callback(self, **overrides):
+        params = {
+            'out_trade_no': self.order.id,
+            'total_amount': '99.50',
+            'trade_no': '2026101822001400000000000001',
+            'app_id': self.gateway.settings()['ALIPAY_APPID'],
+        }
+        params.update(overrides)
+        return self.gateway.sign_callback(params)
+
+
+class AlipayClientTests(AlipayTestCase):
+    def test_client_is_built_once(self):
+        with mock.patch('settlement.alipay_client._build_client', wraps=_build_client) as build_client:
+            # 修改支付宝配置会丢弃旧客户端，之后第一次使用时重新构建
+            with override_settings(ALIPAY_APPID='2021000000000001'):
+                first = get_alipay_client()
+                second = get_alipay_client()
+        self.assertIs(first, second)
+        self.assertEqual(first.appid, '2021000000000001')
+        self.assertEqual(build_client.call_count, 1)
+
+    def test_reload_replaces_keys(self):
+        old_client = get_alipay_client()
+        rotated = StubAlipayGateway()
+        new_client = reload_alipay_client(
+            rotated.settings()['APP_PRIVATE_KEY'], rotated.settings()['ALIPAY_PUBLIC_KEY']
+        )
+        self.assertIsNot(old_client, new_client)
+        self.assertIs(get_alipay_client(), new_client)
+
+        # 新客户端只信任新网关的签名
+        params = rotated.sign_callback({'out_trade_no': '1'})
+        signature = params.pop('sign')
+        self.assertTrue(new_client.verify(params, signature))
+
+    def test_reload_with_invalid_key_keeps_old_client(self):
+        old_client = get_alipay_client()
+        with self.assertRaises(Exception):
+            reload_alipay_client('not a key', 'not a key')
+        self.assertIs(get_alipay_client(), old_client)
+
+
+class PaySuccessTests(AlipayTestCase):
+    def test_pay_url_is_signed_with_app_key(self):
+        response = self.client.get('/api/settlement/paysuccess/', {'order_id': self.order.id})
+        data = json.loads(response.content)
+        self.assertEqual(data['status'], '200')
+
+        params = self.gateway.parse_pay_url(data['alipay_url'])
+        biz_content = json.loads(params['biz_content'])
+        self.assertEqual(biz_content['out_trade_no'], str(self.order.id))
+        self.assertEqual(biz_content['total_amount'], '99.50')
+
+    def test_pay_url_expires_with_reservation(self):
+        expire_time = (timezone.now() + timedelta(minutes=10)).replace(microsecond=0)
+        Goods.objects.filter(id=self.goods.id).update(status=Goods.STATUS_RESERVED, reserve_expire_time=expire_time)
+        response = self.client.get('/api/settlement/paysuccess/', {'order_id': self.order.id})
+        params = self.gateway.parse_pay_url(json.loads(response.content)['alipay_url'])
+        biz_content = json.loads(params['biz_content'])
+        self.assertEqual(biz_content['time_expire'], expire_time.strftime('%Y-%m-%d %H:%M:%S'))
+
+    def test_expired_reservation_cannot_be_paid(self):
+        Goods.objects.filter(id=self.goods.id).update(
+            status=Goods.STATUS_RESERVED, reserve_expire_time=timezone.now() - timedelta(seconds=1)
+        )
+        response = self.client.get('/api/settlement/paysuccess/', {'order_id': self.order.id})
+        self.assertEqual(json.loads(response.content)['msg'], '订单已超时，请重新下单')
+
+    def test_paid_order_cannot_be_paid_again(self):
+        Order.objects.filter(id=self.order.id).update(status=Order.STATUS_PAY)
+        response = self.client.get('/api/settlement/paysuccess/', {'order_id': self.order.id})
+        self.assertEqual(json.loads(response.content)['status'], '400')
+
+
+class SettlementSuccessTests(AlipayTestCase):
+    def test_redirect_only_reads_order_status(self):
+        response = self.client.get('/api/settlement/settlementSuccess/', self.paid_callback())
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('/paysuccess?', response['Location'])
+        self.assertIn('paid=0', response['Location'])
+
+        # 同步跳转不再结算订单
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.STATUS_UNPAY)
+
+    def test_redirect_after_notify_reports_paid(self):
+        self.client.post('/api/settlement/alipayNotify/', self.paid_callback(trade_status='TRADE_SUCCESS'))
+        response = self.client.get('/api/settlement/settlementSuccess/', self.paid_callback())
+        self.assertIn('paid=1', response['Location'])
+
+    def test_tampered_callback_is_rejected(self):
+        params = self.paid_callback()
+        params['total_amount'] = '0.01'
+        response = self.client.get('/api/settlement/settlementSuccess/', params)
+        self.assertEqual(json.loads(response.content)['status'], '400')
+
+
+class AlipayNotifyTests(AlipayTestCase):
+    def notify(self, **overrides):
+        overrides.setdefault('trade_status', 'TRADE_SUCCESS')
+        return self.client.post('/api/settlement/alipayNotify/', self.paid_callback(**overrides))
+
+    def test_notify_settles_order_and_goods(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            response = self.notify()
+        self.assertEqual(response.content, b'success')
+        self.assertEqual(len(callbacks), 1)
+
+        self.order.refresh_from_db()
+        self.goods.refresh_from_db()
+        self.assertEqual(self.order.status, Order.STATUS_PAY)
+        self.assertEqual(self.goods.status, Goods.STATUS_SOLD)
+        self.assertEqual(AlipayNotification.objects.get().out_trade_no, str(self.order.id))
+
+    def test_duplicate_notify_is_idempotent(self):
+        self.assertEqual(self.notify().content, b'success')
+        with CaptureQueriesContext(connection) as queries:
+            # 重复通知在插入幂等记录时就结束，不会再执行订单的 UPDATE
+            self.assertEqual(self.notify(notify_id='retry').content, b'success')
+        self.assertFalse([q for q in queries.captured_queries if q['sql'].startswith('UPDATE')])
+        self.assertEqual(AlipayNotification.objects.count(), 1)
+
+    def test_late_payment_is_recorded_for_refund(self):
+        # 预订超时订单已关闭后才收到支付成功通知：不再结算，记录为需要退款，并回复 success 让支付宝停止重发
+        Order.objects.filter(id=self.order.id).update(status=Order.STATUS_CLOSED)
+        self.assertEqual(self.notify().content, b'success')
+
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.STATUS_CLOSED)
+        notification = AlipayNotification.objects.get()
+        self.assertTrue(notification.refund_required)
+        # 重复通知不会再次记录
+        self.assertEqual(self.notify(notify_id='retry').content, b'success')
+        self.assertEqual(AlipayNotification.objects.count(), 1)
+
+    def test_settled_notify_is_not_marked_for_refund(self):
+        self.notify()
+        self.assertFalse(AlipayNotification.objects.get().refund_required)
+
+    def test_pay_url_carries_notify_url(self):
+        response = self.client.get('/api/settlement/paysuccess/', {'order_id': self.order.id})
+        params = self.gateway.parse_pay_url(json.loads(response.content)['alipay_url'])
+        self.assertEqual(params['notify_url'], settings.ALIPAY_NOTIFY_URL)
+
+    def test_unpaid_trade_status_is_acknowledged_without_settling(self):
+        self.assertEqual(self.notify(trade_status='WAIT_BUYER_PAY').content, b'success')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.STATUS_UNPAY)
+        self.assertFalse(AlipayNotification.objects.exists())
+
+    def test_tampered_notify_is_rejected(self):
+        params = self.paid_callback(trade_status='TRADE_SUCCESS')
+        params['total_amount'] = '0.01'
+        response = self.client.post('/api/settlement/alipayNotify/', params)
+        self.assertEqual(response.content, b'failure')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.STATUS_UNPAY)
+
+    def test_amount_mismatch_is_rejected(self):
+        # 签名正确但金额与订单不一致
+        self.assertEqual(self.notify(total_amount='0.01').content, b'failure')
+        self.assertFalse(AlipayNotification.objects.exists())
+
+    def test_other_app_id_is_rejected(self):
+        self.assertEqual(self.notify(app_id='2021999999999999').content, b'failure')
+
+
+# 下单（预订商品）的测试
+class CheckoutTestMixin:
+    def create_goods(self, seller):
+        goods = Goods.objects.create(
+            title='二手相机', category_id=1, price=Decimal('1200.00'), quality=9, publisher=seller
+        )
+        # 测试之间商品ID可能重复，清理遗留的 Redis 预订键
+        release_reserve_key(goods.id)
+        self.addCleanup(release_reserve_key, goods.id)
+        return goods
+
+    def checkout(self, buyer, goods, client=None, price=None):
+        return (client or self.client).post('/api/settlement/', {
+            'goods_id': goods.id,
+            'buyer_id': buyer.id,
+            'seller_id': goods.publisher_id,
+            'price': price or str(goods.price),
+            'image': '',
+            'title': goods.title,
+        })
+
+
+class CheckoutTests(CheckoutTestMixin, TestCase):
+    def setUp(self):
+        self.seller = User.objects.create(phone='13800000011', password='x', nickname='seller')
+        self.buyer = User.objects.create(phone='13800000012', password='x', nickname='buyer')
+        self.other_buyer = User.objects.create(phone='13800000013', password='x', nickname='other')
+        self.goods = self.create_goods(self.seller)
+
+    def test_checkout_reserves_goods(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.checkout(self.buyer, self.goods)
+        self.assertEqual(json.loads(response.content)['status'], '200')
+
+        self.goods.refresh_from_db()
+        self.assertEqual(self.goods.status, Goods.STATUS_RESERVED)
+        self.assertIsNotNone(self.goods.reserve_expire_time)
+        order = Order.objects.get(goods=self.goods)
+        self.assertEqual(order.buyer_id, self.buyer.id)
+        self.assertEqual(order.status, Order.STATUS_UNPAY)
+
+    def test_reserved_goods_is_rejected_before_database(self):
+        self.checkout(self.buyer, self.goods)
+        with self.assertNumQueries(0):
+            response = self.checkout(self.other_buyer, self.goods)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Order.objects.filter(goods=self.goods).count(), 1)
+
+    def test_failed_checkout_releases_reservation(self):
+        response = self.checkout(self.buyer, self.goods, price='1.00')
+        self.assertEqual(json.loads(response.content)['msg'], '价格不匹配')
+        self.assertEqual(json.loads(self.checkout(self.other_buyer, self.goods).content)['status'], '200')
+
+    def test_database_rejects_when_reservation_key_is_missing(self):
+        self.checkout(self.buyer, self.goods)
+        # Redis 预订键丢失（过期或 Redis 重启）时由数据库的条件更新拒绝第二个买家
+        release_reserve_key(self.goods.id)
+        response = self.checkout(self.other_buyer, self.goods)
+        self.assertEqual(json.loads(response.content)['msg'], '商品当前不可购买')
+        self.assertEqual(Order.objects.filter(goods=self.goods).count(), 1)
+
+    def test_expired_reservation_is_released(self):
+        self.checkout(self.buyer, self.goods)
+        order = Order.objects.get(goods=self.goods)
+
+        self.assertEqual(release_expired_reservations(), 0)
+        later = timezone.now() + timedelta(seconds=settings.GOODS_RESERVE_TIMEOUT + 1)
+        self.assertEqual(release_expired_reservations(now=later), 1)
+
+        self.goods.refresh_from_db()
+        order.refresh_from_db()
+        self.assertEqual(self.goods.status, Goods.STATUS_ON)
+        self.assertIsNone(self.goods.reserve_expire_time)
+        self.assertEqual(order.status, Order.STATUS_CLOSED)
+        # 释放后其他买家可以重新下单
+        self.assertEqual(json.loads(self.checkout(self.other_buyer, self.goods).content)['status'], '200')
+
+    def test_paid_reservation_is_not_released(self):
+        self.checkout(self.buyer, self.goods)
+        order = Order.objects.get(goods=self.goods)
+        settle_order(order.id, self.goods.id, {
+            'out_trade_no': str(order.id), 'trade_status': 'TRADE_SUCCESS', 'total_amount': '1200.00'
+        })
+
+        later = timezone.now() + timedelta(seconds=settings.GOODS_RESERVE_TIMEOUT + 1)
+        self.assertEqual(release_expired_reservations(now=later), 0)
+        self.goods.refresh_from_db()
+        order.refresh_from_db()
+        self.assertEqual(self.goods.status, Goods.STATUS_SOLD)
+        self.assertEqual(order.status, Order.STATUS_PAY)
+
+
+# 多个买家同时购买同一件商品，只有一个买家下单成功
+class ConcurrentCheckoutTests(CheckoutTestMixin, TransactionTestCase):
+    buyers = 8
+
+    def setUp(self):
+        self.seller = User.objects.create(phone='13800000021', password='x', nickname='seller')
+        self.buyer_list = [
+            User.objects.create(phone=f'139000000{i:02d}', password='x', nickname=f'buyer{i}')
+            for i in range(self.buyers)
+        ]
+        self.goods = self.create_goods(self.seller)
+
+    def run_buyers(self):
+        barrier = threading.Barrier(self.buyers)
+        statuses = []
+
+        def buy(buyer):
+            try:
+                client = Client()
+                barrier.wait()
+                statuses.append(json.loads(self.checkout(buyer, self.goods, client=client).content)['status'])
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buy, args=(buyer,)) for buyer in self.buyer_list]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return statuses
+
+    def assert_single_winner(self, statuses):
+        self.assertEqual(len(statuses), self.buyers)
+        self.assertEqual(statuses.count('200'), 1)
+        self.assertEqual(Order.objects.filter(goods=self.goods).count(), 1)
+        self.goods.refresh_from_db()
+        self.assertEqual(self.goods.status, Goods.STATUS_RESERVED)
+
+    def test_parallel_buyers_single_winner(self):
+        statuses = self.run_buyers()
+        self.assert_single_winner(statuses)
+        self.assertEqual(statuses.count('409'), self.buyers - 1)
+
+    def test_parallel_buyers_single_winner_without_redis(self):
+        # Redis 不可用时所有请求都会进入数据库，由条件更新保证只有一个买家成功
+        with mock.patch('settlement.views.acquire_reserve_key', return_value=True):
+            statuses = self.run_buyers()
+        self.assert_single_winner(statuses)
@@ -1,10 +1,11 @@
 from django.contrib import admin
 from django.urls import path
-from settlement.views import SettlementView, PaySuccess, SettlementSuccessView
+from settlement.views import SettlementView, PaySuccess, SettlementSuccessView, AlipayNotifyView
 
 urlpatterns = [
     path('', SettlementView.as_view(), name='SettlementView'),
     path('paysuccess/', PaySuccess.as_view(), name='PaySuccess'),
     path('settlementSuccess/', SettlementSuccessView.as_view(), name='SettlementSuccessView'),
+    path('alipayNotify/', AlipayNotifyView.as_view(), name='AlipayNotifyView'),
 
 ]
\ No newline at end of file
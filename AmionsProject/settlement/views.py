@@ -1,44 +1,28 @@
 import json
 import logging
-import os
-import re
+from datetime import timedelta
+from decimal import Decimal
 from urllib.parse import urlencode
 
-from Cryptodome.PublicKey import RSA
 from django import http
 from django.conf import settings
-from django.http import JsonResponse, HttpResponseForbidden, HttpResponseRedirect, HttpResponse
+from django.http import HttpResponseForbidden, HttpResponseRedirect, HttpResponse
+from trade.responses import OrjsonResponse
 from django.shortcuts import render
+from django.utils import timezone
 from django.views import View
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 
 from trade.models import User, Goods, Order
-from alipay import AliPay
-
-
-def clean_key(raw_key: str, key_type: str = "PRIVATE") -> str:
-    """
-    将原始密钥字符串格式化为符合SDK源码正则要求的PEM格式
-    :param raw_key: 原始密钥字符串（你的应用私钥/支付宝公钥）
-    :param key_type: 密钥类型，PRIVATE（私钥）或 PUBLIC（公钥）
-    :return: 符合正则要求的合法PEM格式字符串
-    """
-    # 1. 清理所有无关字符（换行、空格、回车、隐藏字符）
-    clean_key = re.sub(r'-----BEGIN.*-----|-----END.*-----|\r|\n|\s+', '', raw_key)
-
-    # 2. 按源码正则要求组装标准PEM格式：
-    #    - BEGIN行：开头可选空白 + -----BEGIN xxx----- + 至少一个空白（换行）
-    #    - END行：-----END xxx----- + 结尾可选空白，且BEGIN/END的marker必须一致
-    begin_line = f"-----BEGIN {key_type} KEY-----\n"  # \n满足\s+要求
-    end_line = f"\n-----END {key_type} KEY-----"  # 结尾无多余空格，满足\s*$要求
-    # 3. 拼接最终合法格式
-    valid_pem = begin_line + clean_key + end_line
-    return valid_pem
+from .alipay_client import get_alipay_client
+from .reservation import acquire_reserve_key, release_reserve_key, reserve_goods
+from .settle import SETTLED_TRADE_STATUSES, settle_order
+
 
 class SettlementView(View):
     def get(self, request):
-        return JsonResponse({"error": "请用post请求访问!"}, status=405)
+        return OrjsonResponse({"error": "请用post请求访问!"}, status=405)
 
     def post(self, request):
         try:
@@ -51,12 +35,9 @@ class SettlementView(View):
             title = request.POST.get('title')
 
 
-            # 设置订单状态为0（订单发起中）
-            order_status = 0
-
             # 数据验证
             if not all([price, goods_id, buyer_id, seller_id]):
-                return JsonResponse({
+                return OrjsonResponse({
                     "status": "400",
                     "msg": "缺少必要参数"
                 }, status=400)
@@ -70,64 +51,38 @@ class SettlementView(View):
                 image=str(image)
                 title=str(title)
             except ValueError:
-                return JsonResponse({
+                return OrjsonResponse({
                     "status": "400",
                     "msg": "参数类型错误"
                 }, status=400)
 
-            # 验证用户是否存在
-            try:
-                buyer = User.objects.get(id=buyer_id)
-                seller = User.objects.get(id=seller_id)
-            except User.DoesNotExist:
-                return JsonResponse({
-                    "status": "400",
-                    "msg": "买家或卖家不存在"
-                }, status=400)
-
-            # 验证商品是否存在
-            try:
-                goods = Goods.objects.get(id=goods_id)
-            except Goods.DoesNotExist:
-                return JsonResponse({
-                    "status": "400",
-                    "msg": "商品不存在"
-                }, status=400)
-
-            # 验证商品状态是否允许购买
-            if goods.status != Goods.STATUS_ON:
-                return JsonResponse({
-                    "status": "400",
-                    "msg": "商品当前不可购买"
-                }, status=400)
-
-            # 验证价格是否一致
-            if float(goods.price) != price:
-                return JsonResponse({
-                    "status": "400",
-                    "msg": "价格不匹配"
-                }, status=400)
-
             # 验证卖家不是买家本人
             if buyer_id == seller_id:
-                return JsonResponse({
+                return OrjsonResponse({
                     "status": "400",
                     "msg": "不能购买自己的商品"
                 }, status=400)
 
-            # 创建订单记录 - 使用前端传递的数据
-            # create_time会由Django模型自动设置为当前时间
-            order = Order.objects.create(
-                goods_id=goods_id,
-                buyer_id=buyer_id,
-                seller_id=seller_id,
-                price=price,
-                status=order_status  # 使用正确的变量名
-            )
+            # 先抢占 Redis 预订键，同一件商品已被其他买家下单时直接返回，不访问数据库（见 settlement/reservation.py）
+            if not acquire_reserve_key(goods_id, buyer_id):
+                return OrjsonResponse({
+                    "status": "409",
+                    "msg": "商品已被其他买家预订"
+                }, status=409)
+
+            # 下单失败时释放预订键，让其他买家可以继续购买
+            try:
+                order = self._reserve(request, goods_id, buyer_id, seller_id, price)
+            except Exception:
+                release_reserve_key(goods_id)
+                raise
+            if not isinstance(order, Order):
+                release_reserve_key(goods_id)
+                return order
 
             # 打印生成的订单内容
             print(f"用户提交了订单。。。。:")
-            return JsonResponse({
+            return OrjsonResponse({
                 "status": "200",
                 "msg": "购买请求已提交！",
                 "order_id": order.id,
@@ -145,19 +100,75 @@ class SettlementView(View):
             })
 
         except json.JSONDecodeError:
-            return JsonResponse({
+            return OrjsonResponse({
                 "status": "400",
                 "msg": "JSON解析错误"
             }, status=400)
         except Exception as e:
-            return JsonResponse({
+            return OrjsonResponse({
                 "status": "500",
                 "msg": f"服务器内部错误: {str(e)}"
             }, status=500)
 
+    def _reserve(self, request, goods_id, buyer_id, seller_id, price):
+        """校验买家、卖家和商品后预订商品并创建订单，校验失败时返回错误响应"""
+        # 验证用户是否存在，买家和卖家一条查询
+        try:
+            request.loaders.users.get_many([buyer_id, seller_id])
+        except User.DoesNotExist:
+            return OrjsonResponse({
+                "status": "400",
+                "msg": "买家或卖家不存在"
+            }, status=400)
+
+        # 验证商品是否存在
+        try:
+            goods = request.loaders.goods.get(goods_id)
+        except Goods.DoesNotExist:
+            return OrjsonResponse({
+                "status": "400",
+                "msg": "商品不存在"
+            }, status=400)
+
+        # 验证商品状态是否允许购买
+        if goods.status != Goods.STATUS_ON:
+            return OrjsonResponse({
+                "status": "400",
+                "msg": "商品当前不可购买"
+            }, status=400)
+
+        # 验证价格是否一致
+        if float(goods.price) != price:
+            return OrjsonResponse({
+                "status": "400",
+                "msg": "价格不匹配"
+            }, status=400)
+
+        # 在一个事务中把商品从在售改为已预订并创建订单，商品已不是在售状态时条件更新不会生效
+        order = reserve_goods(goods_id, buyer_id, seller_id, goods.price)
+        if order is None:
+            return OrjsonResponse({
+                "status": "400",
+                "msg": "商品当前不可购买"
+            }, status=400)
+        return order
+
 
 
 
+
+# 支付宝交易的最晚付款时间格式（北京时间）
+ALIPAY_TIME_EXPIRE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def _order_pay_deadline(order):
+    """订单的最晚付款时间：商品的预订过期时间，商品已不是预订状态时按下单时间加预订时长计算"""
+    goods = Goods.objects.filter(id=order.goods_id).values('status', 'reserve_expire_time').first()
+    if goods and goods['status'] == Goods.STATUS_RESERVED and goods['reserve_expire_time']:
+        return goods['reserve_expire_time']
+    return order.create_time + timedelta(seconds=settings.GOODS_RESERVE_TIMEOUT)
+
+
 #支付宝付款
 class PaySuccess(View):
     def get(self, request):
@@ -166,40 +177,27 @@ class PaySuccess(View):
 
         # 如果没有order_id参数，返回错误
         if not order_id:
-            return JsonResponse({'status': '400', 'msg': '订单ID不能为空'})
+            return OrjsonResponse({'status': '400', 'msg': '订单ID不能为空'})
 
         # 检查order_id是否为数字
         try:
             order_id = int(order_id)
         except ValueError:
-            return JsonResponse({'status': '400', 'msg': '订单ID格式错误'})
+            return OrjsonResponse({'status': '400', 'msg': '订单ID格式错误'})
 
         # 订单校验
         try:
             order = Order.objects.get(id=order_id, status=Order.STATUS_UNPAY)
         except Order.DoesNotExist:
-            return JsonResponse({'status': '400', 'msg': '订单信息错误'})
-
-        BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        APP_PRIVATE_KEY_PATH = os.path.join(BASE_DIR, "settlement/keys/app_private_key.pem")
-        ALIPAY_PUBLIC_KEY_PATH = os.path.join(BASE_DIR, "settlement/keys/alipay_public_key.pem")
-
-        # 读取密钥文件内容
-        with open(APP_PRIVATE_KEY_PATH, 'r', encoding='utf-8') as f:
-            app_private_key_string = f.read()
-
-        with open(ALIPAY_PUBLIC_KEY_PATH, 'r', encoding='utf-8') as f:
-            alipay_public_key_string = f.read()
-
-        # 创建alipay对象
-        alipay = AliPay(
-            appid=settings.ALIPAY_APPID,
-            app_notify_url=settings.ALIPAY_NOTIFY_URL if hasattr(settings, 'ALIPAY_NOTIFY_URL') else None,
-            app_private_key_string=app_private_key_string,
-            alipay_public_key_string=alipay_public_key_string,
-            sign_type="RSA2",
-            debug=settings.ALIPAY_DEBUG
-        )
+            return OrjsonResponse({'status': '400', 'msg': '订单信息错误'})
+
+        # 支付宝交易与商品预订同时过期，预订超时释放商品之后买家不能再付款
+        deadline = _order_pay_deadline(order)
+        if deadline <= timezone.now():
+            return OrjsonResponse({'status': '400', 'msg': '订单已超时，请重新下单'})
+
+        # 使用进程内共享的支付宝客户端，不再为每次支付读取和解析密钥
+        alipay = get_alipay_client()
 
         # 调用支付宝接口，获取支付页面
         order_string = alipay.api_alipay_trade_page_pay(
@@ -207,11 +205,12 @@ class PaySuccess(View):
             total_amount=str(order.price),
             subject="阿烽二手优品%s" % order_id,
             return_url=settings.ALIPAY_RETURN_URL,
+            time_expire=deadline.strftime(ALIPAY_TIME_EXPIRE_FORMAT),
         )
 
         # 返回支付链接的JSON
         alipay_url =settings.ALIPAY_URL+'?'+order_string
-        return JsonResponse({
+        return OrjsonResponse({
             'status': '200',
             'msg': '获取支付链接成功',
             'alipay_url': alipay_url,
@@ -221,7 +220,7 @@ class PaySuccess(View):
     def post(self, request):
         return HttpResponse('post')
 
-#支付宝回调
+#支付宝同步跳转（return_url）：只负责把用户带回前端支付结果页，订单结算由异步通知 AlipayNotifyView 完成
 class SettlementSuccessView(View):
 
     def dispatch(self, request, *args, **kwargs):
@@ -229,95 +228,108 @@ class SettlementSuccessView(View):
         return super().dispatch(request, *args, **kwargs)
 
     def get(self, request):
-        params=dict(request.GET)
+        params = request.GET.dict()
         logger = logging.getLogger(__name__)
         logger.info(f"支付宝回传的所有参数param:{params}")
 
-        # 遍历所有参数，取列表第一个元素转为字符串
-        for key, value in params.items():
-            if isinstance(value, list) and len(value) > 0:
-                params[key] = value[0]
-            # 提取签名并从参数中移除（验签需要）
+        # 提取签名并从参数中移除（验签需要）
         signature = params.pop('sign', None)
         if not signature:
-            return JsonResponse({'status': '400', 'msg': '签名缺失'})
+            return OrjsonResponse({'status': '400', 'msg': '签名缺失'})
+
+        # 验证支付宝签名以确保安全性，使用进程内共享的支付宝客户端
+        try:
+            verify_result = get_alipay_client().verify(params, signature)
+        except Exception as e:
+            # 验签过程出现异常
+            logger.error(f"验签过程出错: {str(e)}")
+            return OrjsonResponse({
+                'status': '500',
+                'msg': f'验签过程出错: {str(e)}'
+            })
+        if not verify_result:
+            # 签名验证失败
+            return OrjsonResponse({
+                'status': '400',
+                'msg': '签名验证失败'
+            })
+
+        try:
+            order_id = int(params.get('out_trade_no'))
+        except (TypeError, ValueError):
+            return OrjsonResponse({
+                'status': '400',
+                'msg': '非法请求'
+            })
 
-        # 验证支付宝签名以确保安全性
-        BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        ALIPAY_PUBLIC_KEY_PATH = os.path.join(BASE_DIR, "settlement/keys/alipay_public_key.pem")
-        APP_PRIVATE_KEY = os.path.join(BASE_DIR, "settlement/keys/app_private_key.pem")
+        # 只读取订单状态，不在用户的跳转请求中修改订单
+        order = Order.objects.filter(id=order_id).values('price', 'status', 'create_time').first()
+        if order is None:
+            return OrjsonResponse({
+                'status': '400',
+                'msg': '订单信息错误'
+            })
 
-        with open(ALIPAY_PUBLIC_KEY_PATH, 'r', encoding='utf-8') as f:
-            alipay_public_key_string = f.read()
+        #响应成功跳转回前端支付成功页面
+        # 构建查询参数，paid 表示异步通知是否已经完成结算（通知可能比跳转晚到）
+        context = {
+            'order_id': order_id,
+            'price': str(order['price']),  # 转换为字符串
+            'time': order['create_time'].strftime('%Y-%m-%d %H:%M:%S'),  # 格式化时间
+            'paid': 1 if order['status'] == Order.STATUS_PAY else 0
+        }
+
+        # 编码查询参数
+        query_string = urlencode(context)
+        #http://69mdjw853446.vicp.fun/paysuccess
+        return HttpResponseRedirect(f"{settings.FRONTEND_BASE_URL}/paysuccess?{query_string}")
+
+
+#支付宝异步通知（notify_url）：支付宝服务器直接调用，用户关闭页面也能完成结算
+#按支付宝的约定，处理成功（包括重复通知）返回纯文本 success，否则返回 failure，支付宝会在之后重新发送
+@method_decorator(csrf_exempt, name='dispatch')
+class AlipayNotifyView(View):
+    def post(self, request):
+        params = request.POST.dict()
+        logger = logging.getLogger(__name__)
+        logger.info(f"支付宝异步通知参数param:{params}")
 
-        with open(APP_PRIVATE_KEY, 'r', encoding='utf-8') as f:
-            app_private_key_string = f.read()
+        signature = params.pop('sign', None)
+        if not signature:
+            return HttpResponse('failure')
+        try:
+            verify_result = get_alipay_client().verify(params, signature)
+        except Exception as e:
+            logger.error(f"异步通知验签过程出错: {str(e)}")
+            return HttpResponse('failure')
+        if not verify_result:
+            logger.warning(f"异步通知签名验证失败：{params.get('out_trade_no')}")
+            return HttpResponse('failure')
 
+        # 通知必须是发给本应用的
+        if params.get('app_id') != settings.ALIPAY_APPID:
+            logger.warning(f"异步通知的 app_id 不匹配：{params.get('app_id')}")
+            return HttpResponse('failure')
 
-        # 创建alipay对象用于验签，验证支付宝回调签名时只需支付宝公钥
-        alipay = AliPay(
-            appid=settings.ALIPAY_APPID,
-            app_notify_url=None,
-            app_private_key_string=clean_key(app_private_key_string, key_type="PRIVATE"),
-            alipay_public_key_string=clean_key(alipay_public_key_string, key_type="PUBLIC"),
-            sign_type='RSA2',
-            debug=settings.ALIPAY_DEBUG
-        )
+        # 等待付款、交易关闭等状态不需要处理
+        if params.get('trade_status') not in SETTLED_TRADE_STATUSES:
+            return HttpResponse('success')
+
+        try:
+            order_id = int(params.get('out_trade_no'))
+            total_amount = Decimal(params.get('total_amount'))
+        except (TypeError, ValueError, ArithmeticError):
+            return HttpResponse('failure')
+
+        order = Order.objects.filter(id=order_id).values('goods_id', 'price').first()
+        if order is None or order['price'] != total_amount:
+            logger.warning(f"异步通知的订单不存在或金额不一致：{order_id} {total_amount}")
+            return HttpResponse('failure')
 
-        # 验证签名
         try:
-            verify_result = alipay.verify(params, signature)
-            if verify_result:
-                # 签名验证成功，处理支付结果
-                out_trade_no = params.get('out_trade_no') #订单号
-
-                if out_trade_no:
-                    try:
-                        order_id=int(params.get('out_trade_no'))
-                        order = Order.objects.get(id=order_id)
-
-                            # 检查当前订单状态，避免重复更新
-                        if order.status == Order.STATUS_UNPAY:
-                            order.status = Order.STATUS_PAY
-                            order.save()
-
-                            # 同时更新对应商品的状态为已售出
-                            if order.goods.status != Goods.STATUS_SOLD:  # 避免重复更新
-                                order.goods.status = Goods.STATUS_SOLD
-                                order.goods.save()
-                        #响应成功跳转回前端支付成功页面
-                        # 构建查询参数
-                        context = {
-                            'order_id': order_id,
-                            'price': str(order.price),  # 转换为字符串
-                            'time': order.create_time.strftime('%Y-%m-%d %H:%M:%S')  # 格式化时间
-                        }
-
-                        # 编码查询参数
-                        query_string = urlencode(context)
-                        print("用户付款成功")
-                        #http://69mdjw853446.vicp.fun/paysuccess
-                        return HttpResponseRedirect(f"{settings.FRONTEND_BASE_URL}/paysuccess?{query_string}")
-                    except (Order.DoesNotExist, ValueError):
-                        return JsonResponse({
-                            'status': '400',
-                            'msg': '订单信息错误'
-                        })
-                else:
-                    return JsonResponse({
-                        'status': '400',
-                        'msg': '非法请求'
-                    })
-            else:
-                # 签名验证失败
-                return JsonResponse({
-                    'status': '400',
-                    'msg': '签名验证失败'
-                })
+            if settle_order(order_id, order['goods_id'], params):
+                logger.info(f"订单 {order_id} 已通过支付宝异步通知完成结算")
         except Exception as e:
-            # 验签过程出现异常
-            print(f"验签过程出错: {str(e)}")  # 添加调试信息
-            return JsonResponse({
-                'status': '500',
-                'msg': f'验签过程出错: {str(e)}'
-            })
+            logger.error(f"订单 {order_id} 结算失败：{str(e)}")
+            return HttpResponse('failure')
+        return HttpResponse('success')
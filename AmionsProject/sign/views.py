@@ -1,7 +1,8 @@
 import logging
 
 from django.contrib.auth.hashers import make_password
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse
+from trade.responses import OrjsonResponse
 from django.views import View
 from trade.models import User
 
@@ -18,7 +19,7 @@ class userSign(View):
         password=request.POST.get('password')
 
         if not all([phone, password, nickname]):
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '400',
                 'msg': '缺少必要参数'
             })
@@ -31,7 +32,7 @@ class userSign(View):
             user_status='1'
             role='1'
         except ValueError:
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '400',
                 'msg': '参数类型错误'
             })
@@ -41,7 +42,7 @@ class userSign(View):
         try:
             User.objects.get(phone=phone_str)
             # 如果找到用户，说明手机号已被注册
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '400',
                 'msg': '手机号已被注册'
             })
@@ -60,7 +61,7 @@ class userSign(View):
         user.save()
 
         print(f"用户注册成功:  手机号:{phone_str}, 密码:{password},加密后的密码:{make_password(password)},昵称： {nickname}")
-        return JsonResponse({
+        return OrjsonResponse({
             'status': '200',
             'msg': '注册成功'
         })
\ No newline at end of file
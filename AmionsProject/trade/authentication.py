@@ -0,0 +1,126 @@
+import logging
+from functools import wraps
+
+from django.core.cache import cache
+from django.utils.functional import SimpleLazyObject
+from django_redis import get_redis_connection
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from trade import local_cache
+from trade.models import User
+from trade.responses import OrjsonResponse
+
+# JWT 认证中间件：在本地校验访问令牌的 HS256 签名和过期时间，用户ID取自令牌的声明，
+# 不再相信前端传来的 user_id，也不再为每个请求读取 Redis 中的 jwt_token_{用户id}。
+# 被封禁的用户记录在 Redis 集合 jwt:revoked_users 中（由 BanUserView 维护），
+# 集合在进程内缓存，封禁/解封时通过 local_cache 的失效消息通知所有进程。
+# 认证结果挂在 request 上：
+#   request.auth_user_id  令牌中的用户ID，未登录或令牌无效时为 None
+#   request.auth_error    认证失败的原因
+#   request.auth_user     用户对象，第一次访问时才查询数据库
+
+REVOKED_USERS_KEY = 'jwt:revoked_users'
+# 集合中固定保留的占位成员，用来区分“没有被封禁的用户”和“集合还没有初始化”
+REVOKED_USERS_SENTINEL = 0
+# 进程内缓存的过期时间（秒），封禁/解封会立即失效，这里只是兜底
+REVOKED_USERS_LOCAL_TTL = 60
+
+
+def _revoked_users_key():
+    return cache.make_key(REVOKED_USERS_KEY)
+
+
+def _load_revoked_users():
+    redis_conn = get_redis_connection('default')
+    members = redis_conn.smembers(_revoked_users_key())
+    if not members:
+        # 集合不存在（首次部署或 Redis 数据丢失）时根据数据库中被禁用的用户重建
+        user_ids = list(User.objects.filter(status=User.STATUS_DISABLE).values_list('id', flat=True))
+        redis_conn.sadd(_revoked_users_key(), REVOKED_USERS_SENTINEL, *user_ids)
+        return frozenset(user_ids)
+    return frozenset(int(member) for member in members) - {REVOKED_USERS_SENTINEL}
+
+
+def get_revoked_users():
+    """返回被封禁的用户ID集合"""
+    return local_cache.get_or_load(REVOKED_USERS_KEY, _load_revoked_users, REVOKED_USERS_LOCAL_TTL)
+
+
+def revoke_user(user_id):
+    """封禁用户：该用户已签发的令牌全部失效"""
+    get_redis_connection('default').sadd(_revoked_users_key(), REVOKED_USERS_SENTINEL, int(user_id))
+    local_cache.invalidate(REVOKED_USERS_KEY)
+
+
+def restore_user(user_id):
+    """解封用户"""
+    get_redis_connection('default').srem(_revoked_users_key(), int(user_id))
+    local_cache.invalidate(REVOKED_USERS_KEY)
+
+
+def authenticate_token(token):
+    """
+    校验访问令牌
+    :return: (用户ID, 错误信息)，校验通过时错误信息为 None
+    """
+    try:
+        user_id = int(AccessToken(token)[api_settings.USER_ID_CLAIM])
+    except (TokenError, KeyError, TypeError, ValueError):
+        return None, '令牌无效或已过期'
+
+    try:
+        revoked = user_id in get_revoked_users()
+    except Exception as e:
+        # Redis 不可用时不阻断正常用户的请求
+        logging.error(f"读取封禁用户集合失败：{str(e)}")
+        revoked = False
+    if revoked:
+        return None, '账号已被禁用'
+    return user_id, None
+
+
+class JWTAuthenticationMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.auth_user_id = None
+        request.auth_error = None
+        auth_header = request.META.get('HTTP_AUTHORIZATION', '')
+        if auth_header.startswith('Bearer '):
+            request.auth_user_id, request.auth_error = authenticate_token(auth_header[7:])
+        elif auth_header:
+            request.auth_error = '无效的认证头格式'
+        else:
+            request.auth_error = '缺少认证令牌'
+
+        request.auth_user = SimpleLazyObject(lambda: self._load_user(request))
+        return self.get_response(request)
+
+    @staticmethod
+    def _load_user(request):
+        if request.auth_user_id is None:
+            return None
+        # 与视图共用请求内的身份映射（trade.loaders），同一个用户在一个请求中只查询一次
+        loaders = getattr(request, 'loaders', None)
+        if loaders is not None:
+            return loaders.users.load(request.auth_user_id)
+        return User.objects.filter(id=request.auth_user_id).first()
+
+
+def jwt_required(view_func):
+    """
+    视图装饰器：请求没有携带有效的访问令牌时返回 401
+    用法：@method_decorator(jwt_required, name='post')
+    """
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if request.auth_user_id is None:
+            return OrjsonResponse({
+                'status': '401',
+                'msg': f'认证失败: {request.auth_error}'
+            })
+        return view_func(request, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,122 @@
+import logging
+import time
+
+from django.core.cache import cache
+from django_redis import get_redis_connection
+
+from trade import local_cache
+from trade.models import GoodsCategory
+from trade.responses import dumps
+
+# 商品分类缓存：分类数据很少变化，但首页、商品列表、统计等接口每次请求都要用到，
+# 因此放在两级缓存中（进程内 + Redis），分类新增/修改/删除时通过信号统一失效
+#   goods_category:list:{版本号}  分类列表
+#   goods_category:menu:{版本号}  首页分类菜单的响应体（已序列化好的 bytes）及其版本号
+#   goods_category:version  分类版本号，每次分类变更加 1，用作首页分类菜单的 ETag
+
+CATEGORY_LIST_CACHE_KEY = 'goods_category:list'
+CATEGORY_MENU_CACHE_KEY = 'goods_category:menu'
+CATEGORY_VERSION_KEY = 'goods_category:version'
+# Redis 中分类缓存的过期时间（秒），主要依靠版本号和信号失效，过期时间只是兜底
+CATEGORY_CACHE_TTL = 10 * 60
+
+
+def _category_list_key(version):
+    return f'{CATEGORY_LIST_CACHE_KEY}:{version}'
+
+
+def _load_category_list(version=None):
+    # Redis 中的分类列表按版本号存放：读取方未命中、查询到旧数据后，如果分类恰好发生变更，
+    # 旧数据只会写入已经过期的版本的键，不会覆盖新版本的缓存
+    if version is None:
+        version = _category_version()
+    categories = cache.get(_category_list_key(version))
+    if categories is None:
+        logging.info("分类缓存未命中，从数据库查询")
+        categories = list(GoodsCategory.objects.order_by('id').values('id', 'name', 'parent_id'))
+        cache.set(_category_list_key(version), categories, timeout=CATEGORY_CACHE_TTL)
+    return categories
+
+
+def get_category_list():
+    """返回所有分类 [{"id", "name", "parent_id"}, ...]，按 id 升序"""
+    return local_cache.get_or_load(CATEGORY_LIST_CACHE_KEY, _load_category_list)
+
+
+def get_category_name_map():
+    """返回 {分类id: 分类名称}"""
+    return {category['id']: category['name'] for category in get_category_list()}
+
+
+def build_category_tree(categories):
+    """
+    根据 parent_id 把扁平的分类列表组装成树，parent_id 为 0 或父分类不存在的作为一级分类
+    :return: [{"id", "name", "parent_id", "children": [...]}, ...]
+    """
+    nodes = {category['id']: {**category, "children": []} for category in categories}
+    tree = []
+    for node in nodes.values():
+        parent = nodes.get(node['parent_id'])
+        if parent is not None and parent is not node:
+            parent['children'].append(node)
+        else:
+            tree.append(node)
+    return tree
+
+
+def _category_version():
+    redis_conn = get_redis_connection('default')
+    version = redis_conn.get(cache.make_key(CATEGORY_VERSION_KEY))
+    if version is None:
+        # 版本号不存在（首次使用或 Redis 被清空）时用当前时间戳初始化，避免与客户端缓存的旧 ETag 重复，
+        # SETNX 保证多个进程拿到同一个值
+        redis_conn.setnx(cache.make_key(CATEGORY_VERSION_KEY), int(time.time()))
+        version = redis_conn.get(cache.make_key(CATEGORY_VERSION_KEY))
+    return int(version)
+
+
+def _category_version_after_incr():
+    # 版本号不存在时先用时间戳初始化再递增，与 _category_version 的初始化方式一致
+    _category_version()
+    return int(get_redis_connection('default').incr(cache.make_key(CATEGORY_VERSION_KEY)))
+
+
+def category_menu_etag(version):
+    return f'"goods-category-{version}"'
+
+
+def _category_menu_key(version):
+    return f'{CATEGORY_MENU_CACHE_KEY}:{version}'
+
+
+def _load_category_menu():
+    # 先读版本号，再用同一个版本号读取分类列表和菜单缓存：菜单的版本号（ETag）和内容来自同一个版本，
+    # 分类变更后旧版本的菜单只会留在已经过期的版本的键中
+    version = _category_version()
+    menu = cache.get(_category_menu_key(version))
+    if menu is None:
+        categories = _load_category_list(version)
+        body = dumps({
+            "status": "200",
+            "version": version,
+            "goods_category": categories,
+            "category_tree": build_category_tree(categories)
+        })
+        menu = {"version": version, "etag": category_menu_etag(version), "body": body}
+        cache.set(_category_menu_key(version), menu, timeout=CATEGORY_CACHE_TTL)
+    return menu
+
+
+def get_category_menu():
+    """
+    返回首页分类菜单 {"version", "etag", "body"}，body 是已经序列化好的 JSON bytes，
+    包含扁平的分类列表（兼容旧前端）和按 parent_id 组装的分类树
+    """
+    return local_cache.get_or_load(CATEGORY_MENU_CACHE_KEY, _load_category_menu)
+
+
+def invalidate_categories():
+    """分类变更后递增版本号，并清除 Redis 和所有进程内的分类缓存"""
+    version = _category_version_after_incr()
+    cache.delete_many([_category_list_key(version - 1), _category_menu_key(version - 1)])
+    local_cache.invalidate(CATEGORY_LIST_CACHE_KEY, CATEGORY_MENU_CACHE_KEY)
@@ -0,0 +1,106 @@
+import hashlib
+import logging
+import time
+from functools import wraps
+
+from django.core.cache import cache
+from django.http import HttpResponseNotModified
+from django_redis import get_redis_connection
+
+# 基于数据表版本号的条件请求（ETag / If-None-Match）
+#   table_version:{表名}  每张表一个递增的版本号，由模型的 save/delete 信号递增，不存在时用时间戳初始化
+# 列表接口的 ETag 由请求地址和它所依赖的表的版本号计算得出，只需要一次 Redis MGET，
+# 客户端带上相同的 If-None-Match 时直接返回 304，不执行视图，也不查询数据库
+
+TABLE_GOODS = 'goods'
+TABLE_GOODS_CATEGORY = 'goods_category'
+TABLE_ORDER = 'order'
+TABLE_USER = 'user'
+TABLE_USER_WISH = 'user_wish'
+
+
+def _version_key(table):
+    return cache.make_key(f'table_version:{table}')
+
+
+def _initial_version():
+    # 版本号不存在（首次使用、Redis 被清空或键被淘汰）时用微秒时间戳初始化，而不是从 0 开始，
+    # 否则重新计数后会与客户端手中旧的 ETag 重复，返回错误的 304。
+    # 使用微秒：只要平均每微秒递增不到一次，新的初始值就一定大于旧版本号曾经到达的值
+    return time.time_ns() // 1000
+
+
+def bump_table_version(*tables):
+    """数据表发生变化后递增版本号，使依赖该表的 ETag 全部失效"""
+    try:
+        pipe = get_redis_connection('default').pipeline(transaction=False)
+        initial = _initial_version()
+        for table in tables:
+            pipe.set(_version_key(table), initial, nx=True)
+            pipe.incr(_version_key(table))
+        pipe.execute()
+    except Exception as e:
+        logging.error(f"递增数据表版本号 {tables} 失败：{str(e)}")
+
+
+def get_table_versions(tables):
+    """一次网络请求读取多张表的版本号，版本号不存在时先初始化（SETNX 保证多个进程拿到同一个值）"""
+    redis_conn = get_redis_connection('default')
+    keys = [_version_key(table) for table in tables]
+    values = redis_conn.mget(keys)
+    missing = [key for key, value in zip(keys, values) if value is None]
+    if missing:
+        initial = _initial_version()
+        pipe = redis_conn.pipeline(transaction=False)
+        for key in missing:
+            pipe.set(key, initial, nx=True)
+        pipe.mget(keys)
+        values = pipe.execute()[-1]
+    return [int(value) for value in values]
+
+
+def compute_etag(request, tables):
+    versions = get_table_versions(tables)
+    source = f"{request.get_full_path()}|" + "|".join(f"{table}:{version}" for table, version in zip(tables, versions))
+    return f'"{hashlib.sha1(source.encode()).hexdigest()}"'
+
+
+def _etag_matches(if_none_match, etag):
+    # 经过 gzip 压缩的响应 ETag 会被标记为弱 ETag（W/ 前缀），比较时忽略
+    candidates = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+    return etag in candidates or '*' in candidates
+
+
+def etag_by_tables(*tables):
+    """
+    视图装饰器：根据依赖的数据表版本号生成强 ETag，If-None-Match 匹配时直接返回 304
+    用法：@method_decorator(etag_by_tables(TABLE_GOODS, TABLE_USER), name='get')
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view_func(request, *args, **kwargs)
+
+            try:
+                etag = compute_etag(request, tables)
+            except Exception as e:
+                # Redis 不可用时退化为普通请求
+                logging.error(f"计算 ETag 失败：{str(e)}")
+                return view_func(request, *args, **kwargs)
+
+            if_none_match = request.headers.get('If-None-Match')
+            if if_none_match and _etag_matches(if_none_match, etag):
+                response = HttpResponseNotModified()
+                response['ETag'] = etag
+                return response
+
+            response = view_func(request, *args, **kwargs)
+            # 视图内部出错时 HTTP 状态码仍是 200，响应体中的 status 为 '500'，这种响应不能被客户端缓存
+            data = getattr(response, 'data', None)
+            failed = isinstance(data, dict) and data.get('status') == '500'
+            if response.status_code == 200 and not failed and not response.has_header('ETag'):
+                response['ETag'] = etag
+            return response
+        return wrapper
+    return decorator
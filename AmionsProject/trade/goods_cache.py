@@ -0,0 +1,153 @@
+import logging
+import math
+import random
+import time
+
+from django.core.cache import cache
+from django_redis import get_redis_connection
+
+from trade.locks import acquire_lock, release_lock
+
+# 单个商品缓存的防击穿（缓存雪崩/惊群）工具
+#   goods:{商品id}          商品数据（与批量读取、分类页共用，格式不变）
+#   goods_meta:{商品id}     {"delta": 回源耗时, "expiry": 过期时间戳}，用于 XFetch 概率提前刷新
+#   goods_lock:{商品id}     回源锁（SET NX EX），同一时刻只有一个请求查询数据库
+#   goods_cache:metrics     哈希，记录 回源/等待/提前刷新 等次数，供监控接口读取
+# 热门商品的缓存过期时，只有拿到锁的请求回源数据库，其余请求短暂等待缓存被回填；
+# 另外在缓存快过期时按 XFetch 算法以一定概率提前刷新，尽量让缓存在真正过期之前就被续上
+
+# 商品缓存随机过期时间（秒），防止缓存雪崩
+GOODS_CACHE_TTL_MIN = 7200
+GOODS_CACHE_TTL_MAX = 14400
+# 不存在的商品缓存空值的时间（秒），防止缓存穿透
+GOODS_NOT_FOUND_TTL = 120
+# 回源锁的过期时间（秒），持锁请求异常退出时锁会自动释放
+GOODS_LOCK_TIMEOUT = 5
+# 未拿到锁的请求最多等待的时间和轮询间隔（秒），超时后自行回源
+GOODS_LOCK_WAIT = 1.0
+GOODS_LOCK_POLL_INTERVAL = 0.02
+# XFetch 的 beta 参数，越大越倾向于提前刷新
+GOODS_XFETCH_BETA = 1.0
+
+GOODS_CACHE_METRICS = ('miss', 'refill', 'wait', 'wait_timeout', 'early_refresh')
+
+# 区分"缓存了空值"和"缓存不存在"
+MISSING = object()
+
+
+def goods_cache_key(goods_id):
+    return f'goods:{goods_id}'
+
+
+def goods_meta_key(goods_id):
+    return f'goods_meta:{goods_id}'
+
+
+def goods_lock_key(goods_id):
+    return f'goods_lock:{goods_id}'
+
+
+def _metrics_key():
+    return cache.make_key('goods_cache:metrics')
+
+
+def random_goods_ttl():
+    return random.randint(GOODS_CACHE_TTL_MIN, GOODS_CACHE_TTL_MAX)
+
+
+def incr_metric(name, amount=1):
+    """累加缓存指标，统计失败不影响正常请求"""
+    try:
+        get_redis_connection('default').hincrby(_metrics_key(), name, amount)
+    except Exception as e:
+        logging.error(f"记录商品缓存指标 {name} 失败：{str(e)}")
+
+
+def get_metrics():
+    """返回所有缓存指标 {指标名: 次数}"""
+    raw = get_redis_connection('default').hgetall(_metrics_key())
+    metrics = {name: 0 for name in GOODS_CACHE_METRICS}
+    metrics.update({name.decode(): int(value) for name, value in raw.items()})
+    return metrics
+
+
+def reset_metrics():
+    get_redis_connection('default').delete(_metrics_key())
+
+
+def read_goods_entry(goods_id):
+    """一次网络请求同时读取商品数据和 XFetch 元数据，返回 (数据或 MISSING, 元数据或 None)"""
+    cached = cache.get_many([goods_cache_key(goods_id), goods_meta_key(goods_id)])
+    return cached.get(goods_cache_key(goods_id), MISSING), cached.get(goods_meta_key(goods_id))
+
+
+def write_goods_entry(goods_id, goods_data, delta, timeout=None):
+    """写入商品数据及其元数据，两者过期时间一致"""
+    timeout = timeout or random_goods_ttl()
+    meta = {"delta": delta, "expiry": time.time() + timeout}
+    cache.set_many({goods_cache_key(goods_id): goods_data, goods_meta_key(goods_id): meta}, timeout=timeout)
+    return timeout
+
+
+def write_goods_entries(entries):
+    """
+    批量写入商品数据及元数据：用一个 Redis pipeline 为每个商品执行 SETEX，每个商品单独随机过期时间，
+    写入 N 个商品只需要一次网络往返（cache.set_many 只能使用同一个过期时间，容易集中过期）
+    :param entries: {商品id: (商品数据, 回源耗时)}
+    """
+    if not entries:
+        return
+    client = cache.client.get_client(write=True)
+    pipe = client.pipeline(transaction=False)
+    now = time.time()
+    for goods_id, (goods_data, delta) in entries.items():
+        timeout = random_goods_ttl()
+        meta = {"delta": delta, "expiry": now + timeout}
+        pipe.setex(cache.make_key(goods_cache_key(goods_id)), timeout, cache.client.encode(goods_data))
+        pipe.setex(cache.make_key(goods_meta_key(goods_id)), timeout, cache.client.encode(meta))
+    pipe.execute()
+
+
+def write_goods_not_found(goods_id):
+    cache.set(goods_cache_key(goods_id), None, timeout=GOODS_NOT_FOUND_TTL)
+
+
+def delete_goods_entry(goods_id):
+    cache.delete_many([goods_cache_key(goods_id), goods_meta_key(goods_id)])
+
+
+def should_refresh_early(meta, beta=GOODS_XFETCH_BETA):
+    """
+    XFetch：now - delta * beta * ln(rand()) >= expiry 时提前刷新
+    回源越慢（delta 越大）、离过期越近，提前刷新的概率越高
+    """
+    if not meta:
+        return False
+    try:
+        delta = float(meta["delta"])
+        expiry = float(meta["expiry"])
+    except (KeyError, TypeError, ValueError):
+        return False
+    # random.random() 可能返回 0，ln(0) 无意义
+    return time.time() - delta * beta * math.log(random.random() or 1e-12) >= expiry
+
+
+def acquire_refill_lock(goods_id):
+    """尝试获取回源锁，成功返回锁的令牌，失败返回 None"""
+    return acquire_lock(goods_lock_key(goods_id), GOODS_LOCK_TIMEOUT)
+
+
+def release_refill_lock(goods_id, token):
+    """只释放自己持有的锁，避免锁超时后误删其他请求的锁"""
+    release_lock(goods_lock_key(goods_id), token)
+
+
+def wait_for_refill(goods_id):
+    """等待持锁请求回填缓存，返回缓存中的数据，超时返回 MISSING"""
+    deadline = time.monotonic() + GOODS_LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(GOODS_LOCK_POLL_INTERVAL)
+        cached = cache.get(goods_cache_key(goods_id), MISSING)
+        if cached is not MISSING:
+            return cached
+    return MISSING
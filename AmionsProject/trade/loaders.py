@@ -0,0 +1,89 @@
+from django.conf import settings
+
+from trade.models import Goods, GoodsCategory, User
+
+# 请求内的身份映射 / 批量加载器（DataLoader）
+# 同一个请求中按主键读取 User、Goods、GoodsCategory 时先查本请求已经加载过的对象，
+# 多个主键合并成一条 IN 查询，同一个主键在一个请求中只查询一次。
+# 由 RequestLoaderMiddleware 为每个请求创建 request.loaders，请求结束后丢弃，不存在跨请求的数据过期问题
+# 用法：
+#   buyer, seller = request.loaders.users.get_many([buyer_id, seller_id])
+#   goods = request.loaders.goods.get(goods_id)      # 不存在时抛出 Goods.DoesNotExist
+#   request.loaders.attach_publishers([goods])         # 批量加载发布者，之后访问 goods.publisher 不再查询
+
+
+class ModelLoader:
+    """单个模型的按主键加载器"""
+
+    def __init__(self, model):
+        self.model = model
+        self._objects = {}
+        self.lookups = 0  # 调用方请求加载的对象次数
+        self.queries = 0  # 实际执行的查询次数
+
+    def load_many(self, ids):
+        """返回 {主键: 对象}，不存在的主键对应 None，未加载过的主键合并成一条查询"""
+        ids = [int(pk) for pk in ids]
+        self.lookups += len(ids)
+        missing = {pk for pk in ids if pk not in self._objects}
+        if missing:
+            self.queries += 1
+            found = self.model.objects.in_bulk(missing)
+            for pk in missing:
+                self._objects[pk] = found.get(pk)
+        return {pk: self._objects[pk] for pk in ids}
+
+    def load(self, pk):
+        """返回对象，不存在时返回 None"""
+        return self.load_many([pk])[int(pk)]
+
+    def get_many(self, ids):
+        """按传入顺序返回对象列表，任意一个不存在时抛出 DoesNotExist"""
+        objects = self.load_many(ids)
+        if any(obj is None for obj in objects.values()):
+            raise self.model.DoesNotExist(f"{self.model.__name__} matching query does not exist.")
+        return [objects[int(pk)] for pk in ids]
+
+    def get(self, pk):
+        """与 Model.objects.get(id=pk) 相同，不存在时抛出 DoesNotExist"""
+        return self.get_many([pk])[0]
+
+    def prime(self, obj):
+        """把其他途径查询到的对象放入身份映射"""
+        self._objects[obj.pk] = obj
+
+
+class RequestLoaders:
+    def __init__(self):
+        self.users = ModelLoader(User)
+        self.goods = ModelLoader(Goods)
+        self.categories = ModelLoader(GoodsCategory)
+
+    def attach_publishers(self, goods_list, *extra_user_ids):
+        """
+        一条查询加载商品的发布者（可以顺带加载其他用户），赋值给 goods.publisher，之后访问不再查询
+        :return: {用户ID: 用户对象}
+        """
+        users = self.users.load_many([goods.publisher_id for goods in goods_list] + list(extra_user_ids))
+        for goods in goods_list:
+            if users[goods.publisher_id] is not None:
+                goods.publisher = users[goods.publisher_id]
+        return users
+
+    def queries_saved(self):
+        """与每次都单独查询数据库相比节省的查询次数"""
+        return sum(loader.lookups - loader.queries for loader in (self.users, self.goods, self.categories))
+
+
+class RequestLoaderMiddleware:
+    """为每个请求创建 request.loaders，调试模式下通过 X-Queries-Saved 响应头输出节省的查询次数"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.loaders = RequestLoaders()
+        response = self.get_response(request)
+        if settings.DEBUG:
+            response['X-Queries-Saved'] = str(request.loaders.queries_saved())
+        return response
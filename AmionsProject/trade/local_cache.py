@@ -0,0 +1,174 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django_redis import get_redis_connection
+
+# 两级缓存：进程内 LRU/TTL 缓存（一级） + django-redis（二级）
+# 热点数据（分类列表、商品详情）直接从进程内存返回，不需要任何网络往返；
+# 多个 worker 进程之间通过 Redis 发布/订阅广播失效消息保持一致：
+#   local_cache:invalidate  频道，消息体为需要失效的缓存键列表（JSON）
+# 订阅线程在第一次使用本地缓存时才启动；订阅断开期间依靠较短的本地 TTL 兜底
+# 回源加载期间收到失效消息时，加载结果可能已经是旧数据：每个正在加载的键记录一个代数，
+# 失效时代数递增，加载完成时代数已经变化的结果只返回给本次调用方，不写入本地缓存
+
+# 本地缓存最多保存的条目数，超过后淘汰最久未使用的条目
+LOCAL_CACHE_MAX_ENTRIES = getattr(settings, 'LOCAL_CACHE_MAX_ENTRIES', 2048)
+# 本地缓存默认过期时间（秒），即使错过失效消息，数据最多也只会旧这么久
+LOCAL_CACHE_DEFAULT_TTL = getattr(settings, 'LOCAL_CACHE_DEFAULT_TTL', 60)
+# 订阅断开后的重连间隔（秒）
+SUBSCRIBER_RETRY_INTERVAL = 5
+
+MISSING = object()
+
+
+class LocalCache:
+    """线程安全的进程内 LRU 缓存，条目数有上限，每个条目有独立的过期时间"""
+
+    def __init__(self, max_entries=LOCAL_CACHE_MAX_ENTRIES, default_ttl=LOCAL_CACHE_DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._data = OrderedDict()
+        # 正在回源加载的键 -> [代数, 正在加载的调用数]，只在加载期间保存
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=MISSING):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, expire_at = entry
+            if expire_at <= time.monotonic():
+                del self._data[key]
+                return default
+            # 最近使用的条目移到末尾
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._set(key, value, ttl)
+
+    def _set(self, key, value, ttl):
+        self._data[key] = (value, time.monotonic() + (ttl or self.default_ttl))
+        self._data.move_to_end(key)
+        # 超过容量时从头部淘汰最久未使用的条目
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def begin_load(self, key):
+        """回源加载前调用，返回该键当前的代数"""
+        with self._lock:
+            loading = self._loading.setdefault(key, [0, 0])
+            loading[1] += 1
+            return loading[0]
+
+    def finish_load(self, key, generation, value=MISSING, ttl=None):
+        """
+        回源加载结束后调用（加载失败时不传 value）
+        :return: 是否写入了本地缓存，加载期间键已经失效时丢弃加载结果，返回 False
+        """
+        with self._lock:
+            loading = self._loading[key]
+            loading[1] -= 1
+            if not loading[1]:
+                del self._loading[key]
+            if value is MISSING or loading[0] != generation:
+                return False
+            self._set(key, value, ttl)
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+                if key in self._loading:
+                    self._loading[key][0] += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            for loading in self._loading.values():
+                loading[0] += 1
+
+    def __len__(self):
+        return len(self._data)
+
+
+local_cache = LocalCache()
+
+_subscriber_lock = threading.Lock()
+_subscriber_thread = None
+
+
+def _channel():
+    return cache.make_key('local_cache:invalidate')
+
+
+def _listen():
+    while True:
+        try:
+            pubsub = get_redis_connection('default').pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(_channel())
+            # 订阅期间可能错过了失效消息，重新订阅后清空本地缓存
+            local_cache.clear()
+            for message in pubsub.listen():
+                if message.get('type') != 'message':
+                    continue
+                try:
+                    keys = json.loads(message['data'])
+                except (TypeError, ValueError):
+                    continue
+                local_cache.delete(*keys)
+        except Exception as e:
+            logging.error(f"本地缓存失效订阅中断，{SUBSCRIBER_RETRY_INTERVAL} 秒后重连：{str(e)}")
+            local_cache.clear()
+            time.sleep(SUBSCRIBER_RETRY_INTERVAL)
+
+
+def ensure_subscriber():
+    """懒启动失效消息订阅线程（每个进程只启动一个）"""
+    global _subscriber_thread
+    if _subscriber_thread is not None and _subscriber_thread.is_alive():
+        return
+    with _subscriber_lock:
+        if _subscriber_thread is not None and _subscriber_thread.is_alive():
+            return
+        _subscriber_thread = threading.Thread(target=_listen, name='local-cache-invalidator', daemon=True)
+        _subscriber_thread.start()
+
+
+def get_or_load(key, loader, ttl=None):
+    """
+    先读进程内缓存，未命中再调用 loader（loader 内部负责读写 Redis 和数据库），结果写回进程内缓存
+    :param key: 缓存键，与失效消息中的键一致
+    :param loader: 无参函数，返回需要缓存的数据
+    :param ttl: 进程内缓存的过期时间（秒）
+    """
+    ensure_subscriber()
+    value = local_cache.get(key)
+    if value is not MISSING:
+        return value
+    generation = local_cache.begin_load(key)
+    try:
+        value = loader()
+    except Exception:
+        local_cache.finish_load(key, generation)
+        raise
+    if not local_cache.finish_load(key, generation, value, ttl):
+        logging.info(f"本地缓存 {key} 在加载期间已失效，丢弃本次加载结果")
+    return value
+
+
+def invalidate(*keys):
+    """删除本进程的缓存，并通知其他进程删除"""
+    local_cache.delete(*keys)
+    try:
+        get_redis_connection('default').publish(_channel(), json.dumps(list(keys)))
+    except Exception as e:
+        logging.error(f"发布本地缓存失效消息失败：{str(e)}")
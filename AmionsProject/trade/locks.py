@@ -0,0 +1,35 @@
+import uuid
+
+from django.core.cache import cache
+from django_redis import get_redis_connection
+
+# Redis 互斥锁（用于缓存回源、索引重建等只允许一个请求执行的操作）
+# 加锁：SET 锁键 随机令牌 NX EX 过期时间，持锁请求异常退出时锁会自动过期
+# 释放：Lua 脚本比较令牌后删除，比较和删除在 Redis 中一次完成；
+#       持锁请求执行超时、锁已过期并被其他请求拿到时，不会误删别人的锁
+
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def acquire_lock(name, timeout):
+    """
+    尝试加锁
+    :param name: 锁名（不带缓存前缀）
+    :param timeout: 锁的过期时间（秒）
+    :return: 成功返回锁的令牌，锁已被其他请求持有时返回 None
+    """
+    token = uuid.uuid4().hex
+    if get_redis_connection('default').set(cache.make_key(name), token, nx=True, ex=timeout):
+        return token
+    return None
+
+
+def release_lock(name, token):
+    """只释放自己持有的锁，返回是否删除了锁"""
+    redis_conn = get_redis_connection('default')
+    return bool(redis_conn.register_script(_RELEASE_SCRIPT)(keys=[cache.make_key(name)], args=[token]))
@@ -0,0 +1,61 @@
+import json
+import time
+from datetime import datetime
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from trade.responses import dumps
+
+
+#对比商品列表响应的 JSON 渲染耗时和体积：python manage.py bench_json_render [--items 1000] [--rounds 50]
+class Command(BaseCommand):
+    help = "对比 json.dumps(indent=4) 与 orjson 渲染商品列表响应的耗时和响应体大小"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=1000, help="响应中的商品数量")
+        parser.add_argument('--rounds', type=int, default=50, help="每种方式重复渲染的次数")
+
+    def handle(self, *args, **options):
+        items, rounds = options['items'], options['rounds']
+        # 构造与 GoodsListView 相同结构的响应数据
+        payload = {
+            "status": "200",
+            "msg": "success",
+            "data": [
+                {
+                    "id": i,
+                    "title": f"九成新二手手机 iPhone {i}",
+                    "category_id": i % 20,
+                    "category_name": "数码产品",
+                    "price": float(Decimal("1999.00") + i),
+                    "quality": 9,
+                    "status": 1,
+                    "create_time": datetime(2024, 1, 1, 12, 0, 0).strftime("%Y-%m-%d %H:%M:%S"),
+                    "image": f"/media/product_images/20240101_120000_{i}.jpg",
+                    "publisher_id": i % 100,
+                    "publisher_nickname": f"用户{i % 100}",
+                }
+                for i in range(items)
+            ],
+            "count": items,
+        }
+
+        renderers = (
+            ("json.dumps(indent=4)", lambda: json.dumps(payload, indent=4, ensure_ascii=False).encode('utf-8')),
+            ("json.dumps(紧凑)", lambda: json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')),
+            ("orjson", lambda: dumps(payload)),
+        )
+
+        baseline = None
+        for name, render in renderers:
+            body = render()
+            start = time.perf_counter()
+            for _ in range(rounds):
+                render()
+            per_render = (time.perf_counter() - start) / rounds * 1000
+            baseline = baseline or (per_render, len(body))
+            self.stdout.write(
+                f"{name:<22} 每次 {per_render:8.3f} ms  响应体 {len(body) / 1024:8.1f} KB  "
+                f"(耗时为基准的 {per_render / baseline[0]:.0%}，体积为基准的 {len(body) / baseline[1]:.0%})"
+            )
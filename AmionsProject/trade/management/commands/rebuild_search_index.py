@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from trade.search_index import rebuild_search_index
+
+
+#全量重建商品搜索倒排索引：python manage.py rebuild_search_index
+class Command(BaseCommand):
+    help = "从数据库全量重建 Redis 中的商品搜索倒排索引"
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        count = rebuild_search_index()
+        if count is None:
+            self.stdout.write(self.style.WARNING("搜索索引正在由其他请求或进程重建，请稍后再试"))
+            return
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(f"搜索索引重建完成：{count} 个在售商品，耗时 {elapsed:.2f} 秒"))
@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+
+try:
+    import brotli
+except ImportError:  # brotli 为可选依赖，未安装时只使用 gzip
+    brotli = None
+
+re_accepts_brotli = _lazy_re_compile(r"\bbr\b")
+
+# 小于该大小（字节）的响应不压缩，压缩收益抵不上 CPU 开销
+COMPRESSION_MIN_SIZE = getattr(settings, 'RESPONSE_COMPRESSION_MIN_SIZE', 1024)
+# brotli 压缩级别（0-11），在线压缩使用中等级别兼顾速度和压缩率
+BROTLI_QUALITY = getattr(settings, 'RESPONSE_BROTLI_QUALITY', 5)
+
+
+#响应压缩：客户端支持 br 且安装了 brotli 时使用 brotli，否则使用 gzip，流式响应（NDJSON）只使用 gzip
+class CompressionMiddleware(GZipMiddleware):
+
+    def process_response(self, request, response):
+        if not response.streaming and len(response.content) < COMPRESSION_MIN_SIZE:
+            return response
+
+        if response.has_header("Content-Encoding"):
+            return response
+
+        accept_encoding = request.META.get("HTTP_ACCEPT_ENCODING", "")
+        if brotli is None or response.streaming or not re_accepts_brotli.search(accept_encoding):
+            return super().process_response(request, response)
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        compressed_content = brotli.compress(response.content, quality=BROTLI_QUALITY)
+        if len(compressed_content) >= len(response.content):
+            return response
+        response.content = compressed_content
+        response.headers["Content-Length"] = str(len(response.content))
+
+        # 与 GZipMiddleware 一致：压缩后的响应使用弱 ETag
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = "W/" + etag
+        response.headers["Content-Encoding"] = "br"
+        return response
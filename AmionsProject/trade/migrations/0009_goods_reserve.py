@@ -0,0 +1,28 @@
+# Generated by Django 5.2.9 on 2026-10-18 22:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trade', '0008_alter_goods_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='goods',
+            name='reserve_expire_time',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='预订过期时间'),
+        ),
+        migrations.AlterField(
+            model_name='goods',
+            name='status',
+            field=models.SmallIntegerField(choices=[(1, '在售'), (2, '已卖出'), (3, '已下架'), (4, '强制下架'), (5, '已预订')], default=1, verbose_name='状态'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='status',
+            field=models.SmallIntegerField(choices=[(0, '未支付'), (1, '已支付'), (2, '已关闭')], default=0, verbose_name='状态'),
+        ),
+    ]
@@ -64,11 +64,13 @@ class Goods(models.Model):
     STATUS_SOLD = 2
     STATUS_OFF = 3
     STATUS_FORCE_OFF = 4  #强制下架状态
+    STATUS_RESERVED = 5  #已被买家下单预订，等待付款，超时后恢复在售
     STATUS_CHOICES = (
         (STATUS_ON, "在售"),
         (STATUS_SOLD, "已卖出"),
         (STATUS_OFF, "已下架"),
         (STATUS_FORCE_OFF, "强制下架"),
+        (STATUS_RESERVED, "已预订"),
     )
 
     title = models.CharField(max_length=128, verbose_name="商品标题")
@@ -80,6 +82,7 @@ class Goods(models.Model):
     create_time = models.DateTimeField(auto_now_add=True, verbose_name="发布时间")
     image=models.ImageField(upload_to='product_images/', db_column="image",verbose_name="商品图片")
     details = models.CharField(max_length=800,default="卖家啥也没写。。。。。。",verbose_name="商品详情")
+    reserve_expire_time = models.DateTimeField(null=True, blank=True, verbose_name="预订过期时间")
 
     #序列化成json格式
     def __str__(self):
@@ -107,9 +110,11 @@ class Order(models.Model):
 
     STATUS_UNPAY = 0
     STATUS_PAY = 1
+    STATUS_CLOSED = 2  #预订超时未付款，订单关闭
     STATUS_CHOICES = (
         (STATUS_UNPAY, "未支付"),
         (STATUS_PAY, "已支付"),
+        (STATUS_CLOSED, "已关闭"),
     )
 
     goods = models.ForeignKey(Goods, on_delete=models.PROTECT, db_column="goods_id", verbose_name="商品")
@@ -1,4 +1,4 @@
-from django.http import JsonResponse
+from trade.responses import OrjsonResponse
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import api_view, permission_classes, authentication_classes
@@ -18,7 +18,7 @@ def user_profile(request):
     获取用户个人信息 - 需要JWT认证
     """
     user = request.user
-    return JsonResponse({
+    return OrjsonResponse({
         'id': user.id,
         'phone': user.phone,
         'nickname': user.nickname,
@@ -49,7 +49,7 @@ def add_goods(request):
         # ... 其他字段
     )
     
-    return JsonResponse({
+    return OrjsonResponse({
         'message': '商品发布成功',
         'goods_id': goods.id
     })
@@ -68,7 +68,7 @@ class UserProfileView(APIView):
     
     def get(self, request):
         user = request.user
-        return JsonResponse({
+        return OrjsonResponse({
             'id': user.id,
             'phone': user.phone,
             'nickname': user.nickname,
@@ -83,7 +83,7 @@ class UserProfileView(APIView):
             user.nickname = nickname
             user.save()
         
-        return JsonResponse({
+        return OrjsonResponse({
             'message': '用户信息更新成功',
             'user': {
                 'id': user.id,
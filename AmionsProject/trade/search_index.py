@@ -0,0 +1,303 @@
+import logging
+import re
+import threading
+import uuid
+from collections import Counter
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Q
+from django_redis import get_redis_connection
+
+from trade.locks import acquire_lock, release_lock
+from trade.models import Goods
+from trade.serializers import GOODS_SEARCH_FIELDS, serialize_goods_queryset
+
+# 商品搜索倒排索引（基于 Redis）
+#   search:term:{词项}  有序集合，成员为商品 id，分数为该词项在商品中的权重
+#   search:doc:{商品id}  集合，记录该商品被索引的所有词项，用于更新/删除时清理
+#   search:built:{版本}  标记当前版本的索引已经从数据库完整构建过，切分规则变化时递增版本
+# 中文按单字 + 相邻二字切分（二元语法），英文/数字串索引其所有子串，
+# 查询时对所有词项求交集，按权重之和排序，替代原来全表扫描的 LIKE '%关键词%'
+# 与 LIKE 的区别：
+#   - 英文/数字与原来一样可以在任意位置匹配（"phone" 能搜到 "iPhone"，"13" 能搜到 "iphone13"），
+#     但多个词之间不要求相邻，"iphone 13" 会搜到同时包含 iphone 和 13 的商品
+#   - 中文多字关键词要求所有相邻二字都出现，同样不要求整体连续
+#   - 只包含标点符号，或者英文/数字串超过 MAX_SUBSTRING_LENGTH 个字符的关键词，索引无法回答，改用 LIKE 查询数据库
+# 索引还没有建立时（Redis 数据丢失或刚升级切分规则）搜索请求使用 LIKE 查询，并在后台线程中重建索引
+
+# 标题中的词项权重高于详情
+TITLE_WEIGHT = 3
+DETAILS_WEIGHT = 1
+# 英文/数字串索引的最长子串长度，更长的查询词改用 LIKE
+MAX_SUBSTRING_LENGTH = 20
+# 索引格式版本，切分规则变化后递增，部署后旧版本的索引视为未建立并在后台重建
+INDEX_VERSION = 2
+# 求交集时临时结果的过期时间（秒）
+TMP_RESULT_TTL = 30
+REBUILD_CHUNK_SIZE = 500
+# 全量重建锁的过期时间（秒），同一时间只有一个请求或进程重建索引
+REBUILD_LOCK_TIMEOUT = 600
+
+_TOKEN_PATTERN = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff]+|[a-z0-9]+')
+
+
+def _is_cjk(text):
+    return '\u3400' <= text[0] <= '\u9fff'
+
+
+def _term_key(term):
+    return cache.make_key(f'search:term:{term}')
+
+
+def _doc_key(goods_id):
+    return cache.make_key(f'search:doc:{goods_id}')
+
+
+def _built_key():
+    return cache.make_key(f'search:built:{INDEX_VERSION}')
+
+
+def _substrings(run):
+    """英文/数字串的所有子串（每个子串只计一次，最长 MAX_SUBSTRING_LENGTH 个字符）"""
+    return {
+        run[start:end]
+        for start in range(len(run))
+        for end in range(start + 1, min(len(run), start + MAX_SUBSTRING_LENGTH) + 1)
+    }
+
+
+def tokenize_for_index(text):
+    """把商品文本切分成需要写入索引的词项（可重复，重复次数即词频）"""
+    terms = []
+    for run in _TOKEN_PATTERN.findall((text or '').lower()):
+        if _is_cjk(run):
+            terms.extend(run)
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            terms.extend(_substrings(run))
+            # 完整的单词再计一次，整词匹配排在子串匹配前面
+            if len(run) <= MAX_SUBSTRING_LENGTH:
+                terms.append(run)
+    return terms
+
+
+def tokenize_for_query(keyword):
+    """把搜索关键词切分成查询词项，所有词项都命中的商品才算匹配"""
+    terms = []
+    for run in _TOKEN_PATTERN.findall((keyword or '').lower()):
+        if _is_cjk(run) and len(run) > 1:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            terms.append(run)
+    # 去重并保持顺序
+    return list(dict.fromkeys(terms))
+
+
+def _goods_term_weights(title, details):
+    weights = Counter()
+    for term in tokenize_for_index(title):
+        weights[term] += TITLE_WEIGHT
+    for term in tokenize_for_index(details):
+        weights[term] += DETAILS_WEIGHT
+    return weights
+
+
+def _write_goods(pipe, goods_id, weights, old_terms=()):
+    for term in set(old_terms) - set(weights):
+        pipe.zrem(_term_key(term), goods_id)
+    pipe.delete(_doc_key(goods_id))
+    for term, weight in weights.items():
+        pipe.zadd(_term_key(term), {goods_id: weight})
+    if weights:
+        pipe.sadd(_doc_key(goods_id), *weights.keys())
+
+
+def index_goods(goods):
+    """商品新增或修改时更新索引，只有在售商品会被索引"""
+    try:
+        if goods.status != Goods.STATUS_ON:
+            remove_goods(goods.id)
+            return
+
+        redis_conn = get_redis_connection('default')
+        old_terms = [term.decode() for term in redis_conn.smembers(_doc_key(goods.id))]
+        pipe = redis_conn.pipeline()
+        _write_goods(pipe, goods.id, _goods_term_weights(goods.title, goods.details), old_terms)
+        pipe.execute()
+    except Exception as e:
+        logging.error(f"更新商品 ID: {goods.id} 的搜索索引失败：{str(e)}")
+
+
+def remove_goods(goods_id):
+    """商品删除或下架时从索引中移除"""
+    try:
+        redis_conn = get_redis_connection('default')
+        old_terms = [term.decode() for term in redis_conn.smembers(_doc_key(goods_id))]
+        if not old_terms:
+            return
+        pipe = redis_conn.pipeline()
+        for term in old_terms:
+            pipe.zrem(_term_key(term), goods_id)
+        pipe.delete(_doc_key(goods_id))
+        pipe.execute()
+    except Exception as e:
+        logging.error(f"移除商品 ID: {goods_id} 的搜索索引失败：{str(e)}")
+
+
+def _rebuild_lock_key():
+    return 'search:rebuild_lock'
+
+
+def rebuild_search_index():
+    """
+    从数据库全量重建搜索索引，返回被索引的商品数量；其他请求或进程正在重建时返回 None
+    不再先删除整个索引：逐个覆盖在售商品的词项，最后移除已经不在售的商品，
+    重建期间搜索照常使用旧索引，post_save 刚写入的词项也不会被清掉
+    """
+    token = acquire_lock(_rebuild_lock_key(), REBUILD_LOCK_TIMEOUT)
+    if token is None:
+        logging.info("搜索索引正在由其他请求或进程重建，跳过")
+        return None
+
+    try:
+        redis_conn = get_redis_connection('default')
+        indexed_ids = set()
+        goods_values = Goods.objects.filter(status=Goods.STATUS_ON).values_list('id', 'title', 'details')
+        chunk = []
+        for row in goods_values.iterator(chunk_size=REBUILD_CHUNK_SIZE):
+            chunk.append(row)
+            if len(chunk) == REBUILD_CHUNK_SIZE:
+                _rebuild_chunk(redis_conn, chunk)
+                indexed_ids.update(goods_id for goods_id, _, _ in chunk)
+                chunk = []
+        if chunk:
+            _rebuild_chunk(redis_conn, chunk)
+            indexed_ids.update(goods_id for goods_id, _, _ in chunk)
+
+        # 索引中有、但本次没有写入的商品：重新确认不在售后再移除，避免误删重建期间新发布的商品
+        doc_prefix = cache.make_key('search:doc:')
+        candidate_ids = set()
+        for key in redis_conn.scan_iter(match=f'{doc_prefix}*', count=1000):
+            goods_id = int(key.decode()[len(doc_prefix):])
+            if goods_id not in indexed_ids:
+                candidate_ids.add(goods_id)
+        if candidate_ids:
+            on_sale_ids = set(
+                Goods.objects.filter(id__in=candidate_ids, status=Goods.STATUS_ON).values_list('id', flat=True)
+            )
+            for goods_id in candidate_ids - on_sale_ids:
+                remove_goods(goods_id)
+
+        redis_conn.set(_built_key(), 1)
+    finally:
+        release_lock(_rebuild_lock_key(), token)
+
+    logging.info(f"搜索索引重建完成，共索引 {len(indexed_ids)} 个在售商品")
+    return len(indexed_ids)
+
+
+_rebuild_thread_lock = threading.Lock()
+_rebuild_thread = None
+
+
+def _rebuild_in_background():
+    try:
+        rebuild_search_index()
+    except Exception as e:
+        logging.error(f"后台重建搜索索引失败：{str(e)}")
+    finally:
+        # 关闭后台线程自己的数据库连接
+        connection.close()
+
+
+def rebuild_search_index_in_background():
+    """在后台线程中重建搜索索引，每个进程同一时间只启动一个线程，多个进程之间由重建锁保证只有一个执行"""
+    global _rebuild_thread
+    with _rebuild_thread_lock:
+        if _rebuild_thread is not None and _rebuild_thread.is_alive():
+            return
+        _rebuild_thread = threading.Thread(target=_rebuild_in_background, name='search-index-rebuild', daemon=True)
+        _rebuild_thread.start()
+
+
+def _rebuild_chunk(redis_conn, rows):
+    # 一次管道读取这批商品原来的词项，再一次管道写入新的词项
+    pipe = redis_conn.pipeline(transaction=False)
+    for goods_id, _, _ in rows:
+        pipe.smembers(_doc_key(goods_id))
+    old_terms_list = pipe.execute()
+
+    pipe = redis_conn.pipeline(transaction=False)
+    for (goods_id, title, details), old_terms in zip(rows, old_terms_list):
+        _write_goods(pipe, goods_id, _goods_term_weights(title, details), [term.decode() for term in old_terms])
+    pipe.execute()
+
+
+def search_goods_ids(keyword, offset=0, limit=20):
+    """
+    在倒排索引中搜索商品
+    :param keyword: 搜索关键词
+    :param offset: 跳过的结果数量（分页）
+    :param limit: 返回的最大结果数量
+    :return: (按相关度从高到低排列的商品 id 列表, 匹配的商品总数)；
+             索引无法回答这个关键词、或者索引还没有建立时返回 (None, 0)，由调用方查询数据库
+    """
+    terms = tokenize_for_query(keyword)
+    if not terms or any(len(term) > MAX_SUBSTRING_LENGTH for term in terms):
+        return None, 0
+
+    redis_conn = get_redis_connection('default')
+    if not redis_conn.exists(_built_key()):
+        # 索引应该在部署时由 rebuild_search_index 命令建立，这里只在 Redis 数据丢失后兜底：
+        # 不在用户请求中重建，本次查询数据库，索引在后台线程中重建
+        logging.warning("搜索索引还没有建立，使用数据库查询并在后台重建索引")
+        rebuild_search_index_in_background()
+        return None, 0
+
+    stop = offset + limit - 1
+    if len(terms) == 1:
+        pipe = redis_conn.pipeline()
+        pipe.zrevrange(_term_key(terms[0]), offset, stop)
+        pipe.zcard(_term_key(terms[0]))
+        goods_ids, total = pipe.execute()
+    else:
+        # 多个词项求交集，分数相加作为相关度
+        result_key = cache.make_key(f'search:tmp:{uuid.uuid4().hex}')
+        pipe = redis_conn.pipeline()
+        pipe.zinterstore(result_key, [_term_key(term) for term in terms], aggregate='SUM')
+        pipe.expire(result_key, TMP_RESULT_TTL)
+        pipe.zrevrange(result_key, offset, stop)
+        pipe.zcard(result_key)
+        pipe.delete(result_key)
+        _, _, goods_ids, total, _ = pipe.execute()
+
+    return [int(goods_id) for goods_id in goods_ids], total
+
+
+def search_on_sale_goods(keyword, offset=0, limit=20, fields=GOODS_SEARCH_FIELDS):
+    """
+    搜索在售商品，返回 (按相关度排序的商品字典列表, 匹配的商品总数)
+    商品搜索接口和 AI 助手的 search_goods 工具共用此函数
+    """
+    fields = tuple(dict.fromkeys(("id",) + tuple(fields)))
+    goods_ids, total = search_goods_ids(keyword, offset=offset, limit=limit)
+    if goods_ids is None:
+        return _search_on_sale_goods_in_db(keyword, offset, limit, fields)
+    if not goods_ids:
+        return [], total
+
+    queryset = Goods.objects.filter(id__in=goods_ids, status=Goods.STATUS_ON)
+    rows = {row["id"]: row for row in serialize_goods_queryset(queryset, fields=fields)}
+    return [rows[goods_id] for goods_id in goods_ids if goods_id in rows], total
+
+
+def _search_on_sale_goods_in_db(keyword, offset, limit, fields):
+    # 索引无法回答或者还没有建立时的兜底：原来的 LIKE 模糊查询，按发布时间倒序
+    queryset = Goods.objects.filter(
+        Q(title__icontains=keyword) | Q(details__icontains=keyword),
+        status=Goods.STATUS_ON
+    )
+    total = queryset.count()
+    page = queryset.order_by('-create_time', '-id')[offset:offset + limit]
+    return serialize_goods_queryset(page, fields=fields), total
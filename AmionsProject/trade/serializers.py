@@ -0,0 +1,96 @@
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import OuterRef, Subquery
+
+from trade.models import GoodsCategory
+
+# 商品列表统一序列化：只查询需要的列，发布者昵称通过 JOIN、分类名称通过子查询在同一条 SQL 中取回，
+# 无论返回多少商品都只执行一次查询，避免循环中访问 goods.publisher 导致的 N+1 查询
+
+# 输出字段名 -> values() 中使用的查询字段
+GOODS_FIELD_SOURCES = {
+    "id": "id",
+    "title": "title",
+    "category_id": "category_id",
+    "category_name": "category_name",
+    "price": "price",
+    "quality": "quality",
+    "status": "status",
+    "create_time": "create_time",
+    "image": "image",
+    "publisher_id": "publisher_id",
+    "publisher_nickname": "publisher__nickname",
+    "details": "details",
+}
+
+# 常用的字段组合
+GOODS_LIST_FIELDS = (
+    "id", "title", "category_id", "price", "quality", "status",
+    "create_time", "image", "publisher_id", "publisher_nickname",
+)
+GOODS_SEARCH_FIELDS = (
+    "id", "title", "price", "quality", "status", "image",
+    "publisher_id", "publisher_nickname", "details",
+)
+
+DEFAULT_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def goods_image_url(image):
+    """把数据库中存储的图片相对路径转换成完整的图片URL"""
+    if not image:
+        return ""
+    return f"{settings.MEDIA_URL}{image}".replace("\\", "/")
+
+
+def _format_time(value, time_format):
+    if value is None:
+        return ""
+    if time_format is None:
+        return value.isoformat()
+    return value.strftime(time_format)
+
+
+def serialize_goods_queryset(queryset, fields=GOODS_LIST_FIELDS, time_format=DEFAULT_TIME_FORMAT,
+                             default_category_name="未知分类", extra=None):
+    """
+    将商品查询集序列化为字典列表
+    :param queryset: Goods 查询集（可以已经带有 filter/order_by）
+    :param fields: 需要输出的字段，取值见 GOODS_FIELD_SOURCES
+    :param time_format: 时间格式，None 表示使用 isoformat
+    :param default_category_name: 分类不存在时显示的名称
+    :param extra: 额外输出的注解字段 {输出字段名: 查询表达式}，例如收藏时间
+    :return: 商品字典列表
+    """
+    extra = extra or {}
+    if "category_name" in fields:
+        queryset = queryset.annotate(
+            category_name=Subquery(
+                GoodsCategory.objects.filter(id=OuterRef("category_id")).values("name")[:1]
+            )
+        )
+    if extra:
+        queryset = queryset.annotate(**extra)
+
+    columns = [GOODS_FIELD_SOURCES[field] for field in fields] + list(extra)
+
+    results = []
+    for row in queryset.values(*columns):
+        item = {}
+        for field in fields:
+            value = row[GOODS_FIELD_SOURCES[field]]
+            if field == "price":
+                value = float(value)
+            elif field == "image":
+                value = goods_image_url(value)
+            elif field == "create_time":
+                value = _format_time(value, time_format)
+            elif field == "category_name" and value is None:
+                value = default_category_name
+            item[field] = value
+        for field in extra:
+            value = row[field]
+            item[field] = _format_time(value, time_format) if isinstance(value, datetime) else value
+        results.append(item)
+    return results
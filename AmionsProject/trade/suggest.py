@@ -0,0 +1,267 @@
+import logging
+import re
+import threading
+
+from django.core.cache import cache
+from django.db import connection
+from django_redis import get_redis_connection
+from pypinyin import Style, lazy_pinyin
+
+from trade.locks import acquire_lock, release_lock
+from trade.models import Goods
+
+# 搜索联想（输入提示）索引（基于 Redis）
+#   suggest:prefix:{前缀}  有序集合，成员为商品 id，分数也是商品 id，ZREVRANGE 直接按发布先后（最新在前）取出
+#   suggest:titles        哈希，商品 id -> 商品标题
+#   suggest:doc:{商品id}   集合，记录该商品写入的所有前缀，用于更新/删除时清理
+#   suggest:built:{版本}   标记当前版本的索引已经从数据库完整构建过
+# 每个在售商品的标题会生成三类前缀键：标题本身、全拼（shoujike）、拼音首字母（sjk），
+# 标题中的每个单词开头也会生成一份，这样输入"iph"也能联想到"二手 iPhone 13"；
+# 每个前缀键的前 MAX_PREFIX_LENGTH 个字符的所有前缀都写入索引，输入更长时按前 MAX_PREFIX_LENGTH 个字符联想
+# 索引在服务启动时（asgi.py/wsgi.py 调用 ensure_suggest_index）或部署时（rebuild_suggest_index 命令）建立，
+# 联想请求只访问 Redis：索引还没有建立时不返回联想，并在后台线程中重建
+
+# 标题中最多为前几个单词生成前缀键
+MAX_WORDS_PER_TITLE = 5
+# 前缀的最大长度（字符）
+MAX_PREFIX_LENGTH = 20
+DEFAULT_SUGGEST_LIMIT = 10
+MAX_SUGGEST_LIMIT = 20
+REBUILD_CHUNK_SIZE = 500
+# 全量重建锁的过期时间（秒）
+REBUILD_LOCK_TIMEOUT = 600
+# 标题相同的商品只联想一次，多取出几倍的商品用于去重
+SUGGEST_CANDIDATES_FACTOR = 3
+# 索引格式版本，格式变化后递增，部署后旧版本的索引视为未建立并重建
+INDEX_VERSION = 2
+
+_WHITESPACE_PATTERN = re.compile(r'\s+')
+
+
+def _prefix_key(prefix):
+    return cache.make_key(f'suggest:prefix:{prefix}')
+
+
+def _titles_key():
+    return cache.make_key('suggest:titles')
+
+
+def _doc_key(goods_id):
+    return cache.make_key(f'suggest:doc:{goods_id}')
+
+
+def _built_key():
+    return cache.make_key(f'suggest:built:{INDEX_VERSION}')
+
+
+def normalize(text):
+    """统一转小写并去掉空白，前缀键和用户输入都按此规则处理"""
+    return _WHITESPACE_PATTERN.sub('', (text or '').lower())
+
+
+def _prefix_keys(title):
+    """为商品标题生成所有前缀键：原文、全拼、拼音首字母，标题中每个单词开头各一份"""
+    words = _WHITESPACE_PATTERN.split((title or '').strip())
+    keys = set()
+    for start in range(min(len(words), MAX_WORDS_PER_TITLE)):
+        text = ''.join(words[start:])
+        if not text:
+            continue
+        keys.add(normalize(text))
+        keys.add(normalize(''.join(lazy_pinyin(text))))
+        keys.add(normalize(''.join(lazy_pinyin(text, style=Style.FIRST_LETTER))))
+    keys.discard('')
+    return keys
+
+
+def _prefixes(title):
+    """商品标题需要写入索引的所有前缀"""
+    return {
+        key[:length]
+        for key in _prefix_keys(title)
+        for length in range(1, min(len(key), MAX_PREFIX_LENGTH) + 1)
+    }
+
+
+def _write_goods(pipe, goods_id, title, old_prefixes=()):
+    prefixes = _prefixes(title)
+    for prefix in set(old_prefixes) - prefixes:
+        pipe.zrem(_prefix_key(prefix), goods_id)
+    pipe.delete(_doc_key(goods_id))
+    for prefix in prefixes:
+        pipe.zadd(_prefix_key(prefix), {goods_id: goods_id})
+    if prefixes:
+        pipe.sadd(_doc_key(goods_id), *prefixes)
+    pipe.hset(_titles_key(), goods_id, title)
+
+
+def index_goods_suggest(goods):
+    """商品新增或修改时更新联想索引，只有在售商品会被索引"""
+    try:
+        if goods.status != Goods.STATUS_ON:
+            remove_goods_suggest(goods.id)
+            return
+
+        redis_conn = get_redis_connection('default')
+        old_prefixes = [prefix.decode() for prefix in redis_conn.smembers(_doc_key(goods.id))]
+        pipe = redis_conn.pipeline()
+        _write_goods(pipe, goods.id, goods.title, old_prefixes)
+        pipe.execute()
+    except Exception as e:
+        logging.error(f"更新商品 ID: {goods.id} 的联想索引失败：{str(e)}")
+
+
+def remove_goods_suggest(goods_id):
+    """商品删除或下架时从联想索引中移除"""
+    try:
+        redis_conn = get_redis_connection('default')
+        old_prefixes = [prefix.decode() for prefix in redis_conn.smembers(_doc_key(goods_id))]
+        pipe = redis_conn.pipeline()
+        for prefix in old_prefixes:
+            pipe.zrem(_prefix_key(prefix), goods_id)
+        pipe.delete(_doc_key(goods_id))
+        pipe.hdel(_titles_key(), goods_id)
+        pipe.execute()
+    except Exception as e:
+        logging.error(f"移除商品 ID: {goods_id} 的联想索引失败：{str(e)}")
+
+
+def _rebuild_lock_key():
+    return 'suggest:rebuild_lock'
+
+
+def rebuild_suggest_index():
+    """
+    从数据库全量重建联想索引，返回被索引的商品数量；其他请求或进程正在重建时返回 None
+    与搜索索引相同，不再先删除整个索引，逐个覆盖在售商品的前缀，最后移除已经不在售的商品
+    """
+    token = acquire_lock(_rebuild_lock_key(), REBUILD_LOCK_TIMEOUT)
+    if token is None:
+        logging.info("联想索引正在由其他请求或进程重建，跳过")
+        return None
+
+    try:
+        redis_conn = get_redis_connection('default')
+        # 旧版本按字典序查询的索引
+        redis_conn.delete(cache.make_key('suggest:index'))
+
+        indexed_ids = set()
+        goods_values = Goods.objects.filter(status=Goods.STATUS_ON).values_list('id', 'title')
+        chunk = []
+        for row in goods_values.iterator(chunk_size=REBUILD_CHUNK_SIZE):
+            chunk.append(row)
+            if len(chunk) == REBUILD_CHUNK_SIZE:
+                _rebuild_chunk(redis_conn, chunk)
+                indexed_ids.update(goods_id for goods_id, _ in chunk)
+                chunk = []
+        if chunk:
+            _rebuild_chunk(redis_conn, chunk)
+            indexed_ids.update(goods_id for goods_id, _ in chunk)
+
+        # 索引中有、但本次没有写入的商品：重新确认不在售后再移除，避免误删重建期间新发布的商品
+        doc_prefix = cache.make_key('suggest:doc:')
+        candidate_ids = set()
+        for key in redis_conn.scan_iter(match=f'{doc_prefix}*', count=1000):
+            goods_id = int(key.decode()[len(doc_prefix):])
+            if goods_id not in indexed_ids:
+                candidate_ids.add(goods_id)
+        if candidate_ids:
+            on_sale_ids = set(
+                Goods.objects.filter(id__in=candidate_ids, status=Goods.STATUS_ON).values_list('id', flat=True)
+            )
+            for goods_id in candidate_ids - on_sale_ids:
+                remove_goods_suggest(goods_id)
+
+        redis_conn.set(_built_key(), 1)
+    finally:
+        release_lock(_rebuild_lock_key(), token)
+
+    logging.info(f"联想索引重建完成，共索引 {len(indexed_ids)} 个在售商品")
+    return len(indexed_ids)
+
+
+def _rebuild_chunk(redis_conn, rows):
+    # 一次管道读取这批商品原来的前缀，再一次管道写入新的前缀
+    pipe = redis_conn.pipeline(transaction=False)
+    for goods_id, _ in rows:
+        pipe.smembers(_doc_key(goods_id))
+    old_prefixes_list = pipe.execute()
+
+    pipe = redis_conn.pipeline(transaction=False)
+    for (goods_id, title), old_prefixes in zip(rows, old_prefixes_list):
+        _write_goods(pipe, goods_id, title, [prefix.decode() for prefix in old_prefixes])
+    pipe.execute()
+
+
+_rebuild_thread_lock = threading.Lock()
+_rebuild_thread = None
+
+
+def _rebuild_in_background():
+    try:
+        rebuild_suggest_index()
+    except Exception as e:
+        logging.error(f"后台重建联想索引失败：{str(e)}")
+    finally:
+        # 关闭后台线程自己的数据库连接
+        connection.close()
+
+
+def rebuild_suggest_index_in_background():
+    """在后台线程中重建联想索引，每个进程同一时间只启动一个线程，多个进程之间由重建锁保证只有一个执行"""
+    global _rebuild_thread
+    with _rebuild_thread_lock:
+        if _rebuild_thread is not None and _rebuild_thread.is_alive():
+            return
+        _rebuild_thread = threading.Thread(target=_rebuild_in_background, name='suggest-index-rebuild', daemon=True)
+        _rebuild_thread.start()
+
+
+def ensure_suggest_index():
+    """服务启动时调用：联想索引还没有建立时在后台线程中从数据库构建，不阻塞服务启动"""
+    try:
+        if not get_redis_connection('default').exists(_built_key()):
+            logging.info("联想索引还没有建立，在后台从数据库构建")
+            rebuild_suggest_index_in_background()
+    except Exception as e:
+        logging.error(f"检查联想索引失败：{str(e)}")
+
+
+def suggest_titles(prefix, limit=DEFAULT_SUGGEST_LIMIT):
+    """
+    根据输入前缀返回联想的商品标题，只访问 Redis，不查询数据库
+    按发布先后（商品 id 越大越新）返回最新的 limit 个匹配商品，标题相同的商品只联想一次
+    :param prefix: 用户输入的前缀，支持中文、全拼和拼音首字母
+    :param limit: 最多返回的联想数量
+    :return: [{"id": 商品id, "title": 商品标题}, ...]
+    """
+    prefix = normalize(prefix)[:MAX_PREFIX_LENGTH]
+    if not prefix:
+        return []
+
+    redis_conn = get_redis_connection('default')
+    if not redis_conn.exists(_built_key()):
+        # 索引应该在服务启动或部署时建立，这里只在 Redis 数据丢失后兜底：
+        # 联想请求不查询数据库，索引建立之前不返回联想
+        logging.warning("联想索引还没有建立，在后台从数据库重建")
+        rebuild_suggest_index_in_background()
+        return []
+
+    goods_ids = redis_conn.zrevrange(_prefix_key(prefix), 0, limit * SUGGEST_CANDIDATES_FACTOR - 1)
+    if not goods_ids:
+        return []
+    titles = redis_conn.hmget(_titles_key(), goods_ids)
+
+    results = []
+    seen_titles = set()
+    for goods_id, title in zip(goods_ids, titles):
+        if title is None:
+            continue
+        title = title.decode()
+        if title in seen_titles:
+            continue
+        seen_titles.add(title)
+        results.append({"id": int(goods_id), "title": title})
+        if len(results) >= limit:
+            break
+    return results
@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase, override_settings
+from django_redis import get_redis_connection
+
+from trade import local_cache
+
+# 测试共用的基类：缓存使用单独的键前缀，测试开始前只清除这个前缀下的键，
+# 不会影响开发环境 Redis 中的数据；进程内缓存也在每个测试开始前清空
+TEST_KEY_PREFIX = f"{settings.CACHES['default'].get('KEY_PREFIX', '')}_test"
+
+redis_test_settings = override_settings(CACHES={
+    **settings.CACHES,
+    'default': {**settings.CACHES['default'], 'KEY_PREFIX': TEST_KEY_PREFIX},
+})
+
+
+class RedisTestMixin:
+    def setUp(self):
+        super().setUp()
+        self.redis = get_redis_connection('default')
+        self.clear_redis()
+        self.addCleanup(self.clear_redis)
+        local_cache.local_cache.clear()
+
+    def clear_redis(self):
+        keys = list(self.redis.scan_iter(match=f"{cache.make_key('')}*", count=1000))
+        if keys:
+            self.redis.delete(*keys)
+
+
+@redis_test_settings
+class RedisTestCase(RedisTestMixin, TestCase):
+    pass
+
+
+# WebSocket 消费者在其他线程中访问数据库，需要测试数据真正提交，使用 TransactionTestCase；
+# 频道层使用进程内实现，不依赖 Redis 频道层
+@redis_test_settings
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class RedisTransactionTestCase(RedisTestMixin, TransactionTestCase):
+    pass
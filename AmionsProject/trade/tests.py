@@ -1,3 +1,696 @@
-from django.test import TestCase
+import json
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+
+from rest_framework_simplejwt.tokens import AccessToken
+
+from trade import authentication, categories, goods_cache, local_cache, search_index, suggest
+from trade import views as trade_views  # 导入视图模块时注册商品的信号处理函数
+from trade.conditional import (
+    TABLE_GOODS, TABLE_GOODS_CATEGORY, TABLE_ORDER, TABLE_USER, TABLE_USER_WISH, get_table_versions
+)
+from trade.loaders import ModelLoader, RequestLoaders
+from trade.locks import acquire_lock, release_lock
+from trade.models import Goods, GoodsCategory, Order, User, UserWish
+from trade.testing import RedisTestCase
+
+
+class GoodsTestMixin:
+    def create_goods(self, title, details='', category_id=1, price='10.00', **kwargs):
+        return Goods.objects.create(
+            title=title, details=details, category_id=category_id, price=Decimal(price), quality=8,
+            publisher=self.seller, **kwargs
+        )
+
+
+# 商品搜索倒排索引的测试
+class SearchIndexTests(GoodsTestMixin, RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.seller = User.objects.create(phone='13800000101', password='x', nickname='seller')
+        self.iphone = self.create_goods('二手 Apple iPhone13 手机', details='电池健康 90%')
+        self.case = self.create_goods('手机壳', details='适用 iphone')
+        self.bike = self.create_goods('山地自行车', details='27 速')
+        search_index.rebuild_search_index()
+
+    def search(self, keyword, **params):
+        response = self.client.get('/api/goods/search/', {'keyword': keyword, **params})
+        return json.loads(response.content)
+
+    def ids(self, keyword):
+        return sorted(row['id'] for row in self.search(keyword)['data'])
+
+    def test_substring_matches_like_icontains(self):
+        # 与原来的 LIKE '%关键词%' 一样，英文/数字可以匹配单词中间的部分
+        self.assertEqual(self.ids('phone'), sorted([self.iphone.id, self.case.id]))
+        self.assertEqual(self.ids('13'), [self.iphone.id])
+        self.assertEqual(self.ids('PHONE13'), [self.iphone.id])
+        self.assertEqual(self.ids('手机'), sorted([self.iphone.id, self.case.id]))
+        self.assertEqual(self.ids('自行车'), [self.bike.id])
+        self.assertEqual(self.ids('电视'), [])
+
+    def test_title_match_ranks_first(self):
+        # iphone 出现在 iphone13 的标题中，出现在手机壳的详情中，标题权重更高
+        data = self.search('iphone')['data']
+        self.assertEqual([row['id'] for row in data], [self.iphone.id, self.case.id])
+
+    def test_index_follows_save_and_delete(self):
+        self.bike.title = '公路自行车'
+        self.bike.save()
+        self.assertEqual(self.ids('公路'), [self.bike.id])
+        self.assertEqual(self.ids('山地'), [])
+
+        self.bike.status = Goods.STATUS_OFF
+        self.bike.save()
+        self.assertEqual(self.ids('自行车'), [])
+
+        self.case.delete()
+        self.assertEqual(self.ids('手机'), [self.iphone.id])
+        self.assertFalse(self.redis.exists(search_index._doc_key(self.case.id)))
+
+    def test_pagination(self):
+        for index in range(4):
+            self.create_goods(f'自行车配件 {index}')
+        seen = []
+        for page in (1, 2, 3):
+            result = self.search('自行车', page=page, page_size=2)
+            self.assertEqual(result['total'], 5)
+            seen.extend(row['id'] for row in result['data'])
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(len(set(seen)), 5)
+
+    def test_rebuild_removes_goods_taken_off_sale_without_signals(self):
+        Goods.objects.filter(id=self.bike.id).update(status=Goods.STATUS_SOLD)
+        self.assertEqual(search_index.rebuild_search_index(), 2)
+        self.assertEqual(self.ids('自行车'), [])
+
+    def test_missing_index_falls_back_to_database(self):
+        self.redis.delete(search_index._built_key())
+        with mock.patch('trade.search_index.rebuild_search_index') as rebuild, \
+                mock.patch('trade.search_index.threading.Thread') as thread:
+            result = self.search('phone')
+        # 用户请求中不重建索引，只启动后台线程
+        rebuild.assert_not_called()
+        thread.return_value.start.assert_called_once()
+        self.assertEqual(result['total'], 2)
+        self.assertEqual(sorted(row['id'] for row in result['data']), sorted([self.iphone.id, self.case.id]))
+
+    def test_keyword_the_index_cannot_answer_uses_like(self):
+        cable = self.create_goods('USB-C 数据线', details='型号 abcdefghijklmnopqrstuvwxyz0123')
+        self.assertEqual(self.ids('-'), [cable.id])
+        self.assertEqual(self.ids('abcdefghijklmnopqrstuvwxyz0123'), [cable.id])
+
+    def test_rebuild_lock_held_by_another_worker(self):
+        token = search_index.acquire_lock(search_index._rebuild_lock_key(), 30)
+        self.addCleanup(search_index.release_lock, search_index._rebuild_lock_key(), token)
+        self.assertIsNone(search_index.rebuild_search_index())
+
+
+# 搜索联想索引的测试
+class SuggestIndexTests(GoodsTestMixin, RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.seller = User.objects.create(phone='13800000102', password='x', nickname='seller')
+        suggest.rebuild_suggest_index()
+
+    def suggest(self, prefix, limit=None):
+        params = {'prefix': prefix}
+        if limit:
+            params['limit'] = limit
+        return json.loads(self.client.get('/api/goods/suggest/', params).content)['data']
+
+    def test_title_pinyin_and_initials(self):
+        goods = self.create_goods('二手 iPhone 13')
+        for prefix in ('二手', 'ershou', 'es', 'iph', 'IPHONE 1'):
+            self.assertEqual(self.suggest(prefix), [{'id': goods.id, 'title': '二手 iPhone 13'}], prefix)
+        self.assertEqual(self.suggest('android'), [])
+
+    def test_newest_goods_first_for_common_prefix(self):
+        # 字典序靠前的旧商品不会挤掉最新发布的商品
+        old = [self.create_goods(f'手机 a{index:02d}') for index in range(30)]
+        newest = self.create_goods('手机 zz')
+        result = self.suggest('手机', limit=3)
+        self.assertEqual([row['id'] for row in result], [newest.id, old[-1].id, old[-2].id])
+
+    def test_same_title_is_suggested_once(self):
+        self.create_goods('自行车')
+        newest = self.create_goods('自行车')
+        self.assertEqual(self.suggest('zxc'), [{'id': newest.id, 'title': '自行车'}])
+
+    def test_index_follows_save_and_delete(self):
+        goods = self.create_goods('篮球')
+        goods.title = '足球'
+        goods.save()
+        self.assertEqual(self.suggest('lanqiu'), [])
+        self.assertEqual([row['id'] for row in self.suggest('zuqiu')], [goods.id])
+
+        goods.status = Goods.STATUS_RESERVED
+        goods.save()
+        self.assertEqual(self.suggest('zuqiu'), [])
+
+        goods.status = Goods.STATUS_ON
+        goods.save()
+        goods_id = goods.id
+        goods.delete()
+        self.assertEqual(self.suggest('zuqiu'), [])
+        self.assertIsNone(self.redis.hget(suggest._titles_key(), goods_id))
+
+    def test_rebuild_removes_goods_taken_off_sale_without_signals(self):
+        goods = self.create_goods('吉他')
+        Goods.objects.filter(id=goods.id).update(status=Goods.STATUS_OFF)
+        self.assertEqual(suggest.rebuild_suggest_index(), 0)
+        self.assertEqual(self.suggest('jita'), [])
+
+    def test_suggest_never_queries_database(self):
+        self.create_goods('手机壳')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(len(self.suggest('sjk')), 1)
+            # 索引丢失时也不查询数据库，只在后台线程中重建
+            self.redis.delete(suggest._built_key())
+            with mock.patch('trade.suggest.threading.Thread') as thread:
+                self.assertEqual(self.suggest('sjk'), [])
+        self.assertEqual(len(queries), 0)
+        thread.return_value.start.assert_called_once()
+
+    def test_startup_builds_missing_index_in_background(self):
+        with mock.patch('trade.suggest.rebuild_suggest_index_in_background') as rebuild:
+            suggest.ensure_suggest_index()
+            rebuild.assert_not_called()
+            self.redis.delete(suggest._built_key())
+            suggest.ensure_suggest_index()
+            rebuild.assert_called_once()
+
+
+# 进程内缓存（两级缓存的第一级）的测试
+class LocalCacheTests(RedisTestCase):
+    def load(self, key, value, during_load=None):
+        calls = []
+
+        def loader():
+            calls.append(key)
+            if during_load:
+                during_load()
+            return value
+
+        return local_cache.get_or_load(key, loader, ttl=60), calls
+
+    def test_loaded_value_is_cached(self):
+        self.assertEqual(self.load('k', 1), (1, ['k']))
+        self.assertEqual(self.load('k', 2), (1, []))
+
+    def test_invalidation_during_load_discards_stale_value(self):
+        # 加载期间收到失效消息（订阅线程调用 delete）：本次调用仍然返回加载结果，但不写入本地缓存
+        value, _ = self.load('k', 'stale', during_load=lambda: local_cache.local_cache.delete('k'))
+        self.assertEqual(value, 'stale')
+        self.assertEqual(self.load('k', 'fresh'), ('fresh', ['k']))
+        self.assertEqual(self.load('k', 'other'), ('fresh', []))
+
+    def test_clear_during_load_discards_stale_value(self):
+        # 订阅重连时会清空本地缓存，正在进行的加载同样作废
+        self.load('k', 'stale', during_load=local_cache.local_cache.clear)
+        self.assertEqual(self.load('k', 'fresh'), ('fresh', ['k']))
+
+    def test_invalidating_other_key_keeps_loaded_value(self):
+        self.load('k', 1, during_load=lambda: local_cache.local_cache.delete('other'))
+        self.assertEqual(self.load('k', 2), (1, []))
+
+    def test_failed_load_leaves_no_state(self):
+        def loader():
+            raise ValueError('boom')
+
+        with self.assertRaises(ValueError):
+            local_cache.get_or_load('k', loader)
+        self.assertEqual(local_cache.local_cache._loading, {})
+        self.assertEqual(self.load('k', 1), (1, ['k']))
+
+
+# 分类商品索引（有序集合 + 占位成员）的测试
+class CategoryIndexTests(GoodsTestMixin, RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.seller = User.objects.create(phone='13800000103', password='x', nickname='seller')
+        self.goods = [self.create_goods(f'商品 {index}', category_id=1 + index % 2) for index in range(4)]
+
+    def category_ids(self, category_id):
+        return sorted(goods.id for goods in Goods.objects.filter(category_id=category_id))
+
+    def index_members(self, category_id):
+        key = trade_views._category_index_key(category_id)
+        return [int(member) for member in self.redis.zrange(key, 0, -1)]
+
+    def sub_menu_ids(self, category_id):
+        response = self.client.get('/api/goods/second', {'id': category_id})
+        return sorted(row['id'] for row in json.loads(response.content)['goods_list'])
+
+    def test_partial_index_is_rebuilt(self):
+        # 商品发布时信号只增量写入了成员，没有占位成员，第一次读取时从数据库重建，重建会丢弃过期成员
+        self.redis.zadd(trade_views._category_index_key(1), {12345: 1})
+        self.assertEqual(self.sub_menu_ids(1), self.category_ids(1))
+        members = self.index_members(1)
+        self.assertEqual(members[0], trade_views.CATEGORY_INDEX_SENTINEL)
+        self.assertEqual(sorted(members[1:]), self.category_ids(1))
+
+    def test_empty_category_keeps_sentinel(self):
+        self.assertEqual(self.sub_menu_ids(99), [])
+        self.assertEqual(self.index_members(99), [trade_views.CATEGORY_INDEX_SENTINEL])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.sub_menu_ids(99), [])
+        self.assertEqual(len(queries), 0)
+
+    def test_signals_keep_built_index_current(self):
+        trade_views.build_category_index(1)
+        trade_views.build_category_index(2)
+
+        moved = self.goods[0]
+        moved.category_id = 2
+        moved.save()
+        added = self.create_goods('新商品', category_id=1)
+        self.goods[2].delete()
+
+        for category_id in (1, 2):
+            members = self.index_members(category_id)
+            self.assertEqual(members[0], trade_views.CATEGORY_INDEX_SENTINEL)
+            self.assertEqual(sorted(members[1:]), self.category_ids(category_id))
+        self.assertIn(added.id, self.index_members(1))
+        self.assertIn(moved.id, self.index_members(2))
+
+    def test_rebuild_lock_held_reads_database(self):
+        lock_key = trade_views._category_index_lock_key(1)
+        token = acquire_lock(lock_key, 30)
+        self.redis.delete(trade_views._category_index_key(1))
+        self.assertEqual(sorted(trade_views.build_category_index(1)), self.category_ids(1))
+        # 没有写入索引，也没有释放其他请求持有的锁
+        self.assertFalse(self.redis.exists(trade_views._category_index_key(1)))
+        self.assertFalse(release_lock(lock_key, 'other-token'))
+        self.assertTrue(release_lock(lock_key, token))
+        self.assertIsNotNone(acquire_lock(lock_key, 30))
+
+
+# 商品列表游标分页（按 id 的 keyset 分页）的测试
+class GoodsListCursorTests(GoodsTestMixin, RedisTestCase):
+    url = '/api/goods/goodslist/'
+
+    def setUp(self):
+        super().setUp()
+        self.seller = User.objects.create(phone='13800000104', password='x', nickname='seller')
+        self.goods_ids = [self.create_goods(f'商品 {index}').id for index in range(5)]
+
+    def page(self, **params):
+        return json.loads(self.client.get(self.url, params).content)
+
+    def pages(self, limit):
+        cursor, result = '', []
+        while True:
+            page = self.page(cursor=cursor, limit=limit)
+            result.append([row['id'] for row in page['data']])
+            if not page['has_more']:
+                self.assertIsNone(page['next_cursor'])
+                return result
+            self.assertEqual(page['next_cursor'], result[-1][-1])
+            cursor = page['next_cursor']
+
+    def test_pages_cover_all_goods_once(self):
+        ids = self.goods_ids
+        self.assertEqual(self.pages(2), [ids[0:2], ids[2:4], ids[4:]])
+        # 商品数正好是每页数量的整数倍时，最后一页不会多出一个空页
+        self.assertEqual(self.pages(5), [ids])
+        self.assertEqual(self.pages(1), [[goods_id] for goods_id in ids])
+
+    def test_cursor_boundaries(self):
+        last = self.goods_ids[-1]
+        page = self.page(cursor=last, limit=2)
+        self.assertEqual((page['data'], page['has_more'], page['next_cursor']), ([], False, None))
+        # 游标指向的商品已被删除时，从它之后继续
+        Goods.objects.filter(id=self.goods_ids[1]).delete()
+        self.assertEqual([row['id'] for row in self.page(cursor=self.goods_ids[1], limit=2)['data']], self.goods_ids[2:4])
+
+    def test_goods_added_while_paging_are_not_repeated(self):
+        first = self.page(cursor='', limit=3)
+        added = self.create_goods('新商品')
+        second = self.page(cursor=first['next_cursor'], limit=3)
+        self.assertEqual([row['id'] for row in second['data']], self.goods_ids[3:] + [added.id])
+
+    def test_limit_is_clamped_and_validated(self):
+        self.assertEqual(self.page(cursor='', limit=0)['count'], 1)
+        with mock.patch.object(trade_views, 'GOODS_LIST_MAX_LIMIT', 2):
+            self.assertEqual(self.page(limit=100)['count'], 2)
+        self.assertEqual(self.page(cursor='abc')['status'], '400')
+        self.assertEqual(self.page(limit='abc')['status'], '400')
+
+
+# 单个商品缓存防击穿的测试：回源锁单飞、等待回填、XFetch 提前刷新
+class GoodsCacheTests(GoodsTestMixin, RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.seller = User.objects.create(phone='13800000105', password='x', nickname='seller')
+        self.goods = self.create_goods('二手自行车')
+        goods_cache.reset_metrics()
+
+    def get(self):
+        return trade_views.get_goods_from_cache_or_db(self.goods.id)
+
+    def metrics(self):
+        return {name: count for name, count in goods_cache.get_metrics().items() if count}
+
+    def test_miss_refills_cache_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.get()['title'], '二手自行车')
+            self.assertEqual(self.get()['title'], '二手自行车')
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(self.metrics(), {'miss': 1, 'refill': 1})
+        _, meta = goods_cache.read_goods_entry(self.goods.id)
+        self.assertGreater(meta['expiry'], time.time() + goods_cache.GOODS_CACHE_TTL_MIN - 5)
+        # 回源锁已经释放
+        self.assertFalse(self.redis.exists(cache.make_key(goods_cache.goods_lock_key(self.goods.id))))
+
+    def test_missing_goods_are_cached_as_empty(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertIsNone(trade_views.get_goods_from_cache_or_db(999999))
+            self.assertIsNone(trade_views.get_goods_from_cache_or_db(999999))
+        self.assertEqual(len(queries), 1)
+
+    def test_waits_for_lock_holder_instead_of_querying(self):
+        token = goods_cache.acquire_refill_lock(self.goods.id)
+        # 持锁请求稍后回填缓存
+        refill = threading.Timer(0.1, goods_cache.write_goods_entry, (self.goods.id, {'title': '回填的数据'}, 0.01))
+        refill.start()
+        self.addCleanup(refill.cancel)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.get(), {'title': '回填的数据'})
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(self.metrics(), {'miss': 1, 'wait': 1})
+        goods_cache.release_refill_lock(self.goods.id, token)
+
+    def test_wait_timeout_falls_back_to_database(self):
+        goods_cache.acquire_refill_lock(self.goods.id)
+        with mock.patch.object(goods_cache, 'GOODS_LOCK_WAIT', 0.05):
+            self.assertEqual(self.get()['title'], '二手自行车')
+        self.assertEqual(self.metrics(), {'miss': 1, 'wait': 1, 'wait_timeout': 1})
+
+    def test_release_only_own_lock(self):
+        token = goods_cache.acquire_refill_lock(self.goods.id)
+        self.assertIsNone(goods_cache.acquire_refill_lock(self.goods.id))
+        goods_cache.release_refill_lock(self.goods.id, 'other-token')
+        self.assertIsNone(goods_cache.acquire_refill_lock(self.goods.id))
+        goods_cache.release_refill_lock(self.goods.id, token)
+        self.assertIsNotNone(goods_cache.acquire_refill_lock(self.goods.id))
+
+    def test_should_refresh_early(self):
+        now = time.time()
+        self.assertFalse(goods_cache.should_refresh_early(None))
+        self.assertFalse(goods_cache.should_refresh_early({'delta': 'x', 'expiry': now}))
+        with mock.patch('trade.goods_cache.random.random', return_value=0.5):
+            # -ln(0.5) * delta ≈ 0.69 秒：离过期更近时刷新，更远时不刷新
+            self.assertTrue(goods_cache.should_refresh_early({'delta': 1.0, 'expiry': now + 0.5}))
+            self.assertFalse(goods_cache.should_refresh_early({'delta': 1.0, 'expiry': now + 5}))
+            self.assertTrue(goods_cache.should_refresh_early({'delta': 1.0, 'expiry': now - 1}))
+
+    def test_early_refresh_reloads_before_expiry(self):
+        self.get()
+        # 绕过信号修改数据库，缓存中仍是旧数据
+        Goods.objects.filter(id=self.goods.id).update(title='新标题')
+        with mock.patch('trade.goods_cache.should_refresh_early', return_value=True):
+            # 其他请求正在刷新时继续返回旧数据
+            token = goods_cache.acquire_refill_lock(self.goods.id)
+            self.assertEqual(self.get()['title'], '二手自行车')
+            goods_cache.release_refill_lock(self.goods.id, token)
+
+            self.assertEqual(self.get()['title'], '新标题')
+        self.assertEqual(self.get()['title'], '新标题')
+        self.assertEqual(self.metrics(), {'miss': 1, 'refill': 1, 'early_refresh': 1})
+
+
+# 首页分类菜单的测试：按分类版本号缓存，分类变更时通过信号递增版本号并清除两级缓存
+class CategoryMenuTests(RedisTestCase):
+    url = '/api/goods/first'
+
+    def setUp(self):
+        super().setUp()
+        self.phone = GoodsCategory.objects.create(name='数码', parent_id=0)
+        self.case = GoodsCategory.objects.create(name='手机壳', parent_id=self.phone.id)
+
+    def menu(self, **headers):
+        return self.client.get(self.url, headers=headers)
+
+    def test_menu_tree_and_not_modified(self):
+        response = self.menu()
+        data = json.loads(response.content)
+        self.assertEqual(response['ETag'], categories.category_menu_etag(data['version']))
+        self.assertEqual([category['id'] for category in data['goods_category']], [self.phone.id, self.case.id])
+        self.assertEqual(data['category_tree'][0]['children'][0]['name'], '手机壳')
+
+        with CaptureQueriesContext(connection) as queries:
+            cached = self.menu()
+            not_modified = self.menu(if_none_match=response['ETag'])
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(cached.content, response.content)
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_category_changes_invalidate_menu(self):
+        def rename():
+            self.phone.name = '数码产品'
+            self.phone.save()
+
+        etag = self.menu()['ETag']
+        for change, expected_names in (
+            (lambda: GoodsCategory.objects.create(name='耳机', parent_id=self.phone.id), ['数码', '手机壳', '耳机']),
+            (rename, ['数码产品', '手机壳', '耳机']),
+            (lambda: self.case.delete(), ['数码产品', '耳机']),
+        ):
+            change()
+            response = self.menu(if_none_match=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+            names = [category['name'] for category in json.loads(response.content)['goods_category']]
+            self.assertEqual(names, expected_names)
+            etag = response['ETag']
+        self.assertEqual(categories.get_category_name_map(), {category.id: category.name for category in GoodsCategory.objects.all()})
+
+    def test_stale_load_only_writes_old_version(self):
+        old_version = categories._category_version()
+        stale = categories._load_category_list(old_version)
+        GoodsCategory.objects.create(name='耳机', parent_id=self.phone.id)
+        # 失效之前开始的加载把旧数据写回旧版本的键，不影响新版本
+        cache.set(categories._category_list_key(old_version), stale)
+        local_cache.local_cache.clear()
+        self.assertEqual(len(categories.get_category_list()), 3)
+
+    def test_missing_version_starts_from_timestamp(self):
+        self.redis.delete(cache.make_key(categories.CATEGORY_VERSION_KEY))
+        version = categories._category_version()
+        self.assertGreater(version, time.time() - 60)
+        self.assertEqual(categories._category_version(), version)
+
+
+# 条件请求的测试：ETag 由依赖的数据表版本号计算，模型的 save/delete 信号递增版本号
+class ConditionalGetTests(GoodsTestMixin, RedisTestCase):
+    url = '/api/goods/goodslist/'
+
+    def setUp(self):
+        super().setUp()
+        self.seller = User.objects.create(phone='13800000106', password='x', nickname='seller')
+        self.buyer = User.objects.create(phone='13800000107', password='x', nickname='buyer')
+        self.goods = [self.create_goods(f'商品 {index}', details='详情' * 100) for index in range(5)]
+
+    def version(self, table):
+        return get_table_versions([table])[0]
+
+    def test_matching_etag_returns_304_without_queries(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        with CaptureQueriesContext(connection) as queries:
+            not_modified = self.client.get(self.url, headers={'if-none-match': response['ETag']})
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+        self.assertEqual(len(queries), 0)
+        # 不同的查询参数是不同的资源
+        self.assertNotEqual(self.client.get(self.url, {'limit': 2})['ETag'], response['ETag'])
+
+    def test_compressed_response_weak_etag_matches(self):
+        response = self.client.get(self.url, headers={'accept-encoding': 'gzip'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertTrue(response['ETag'].startswith('W/"'))
+        not_modified = self.client.get(self.url, headers={'accept-encoding': 'gzip', 'if-none-match': response['ETag']})
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_small_response_is_not_compressed(self):
+        response = self.client.get(self.url, {'limit': 1}, headers={'accept-encoding': 'gzip'})
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_signals_bump_table_versions(self):
+        goods = self.goods[0]
+        changes = (
+            (TABLE_GOODS, lambda: self.create_goods('新商品')),
+            (TABLE_GOODS, lambda: goods.save()),
+            (TABLE_GOODS_CATEGORY, lambda: GoodsCategory.objects.create(name='数码', parent_id=0)),
+            (TABLE_USER, lambda: self.buyer.save()),
+            (TABLE_USER_WISH, lambda: UserWish.objects.create(user=self.buyer, goods=goods)),
+            (TABLE_ORDER, lambda: Order.objects.create(goods=goods, buyer=self.buyer, seller=self.seller, price=goods.price)),
+            (TABLE_GOODS, lambda: self.goods[1].delete()),
+        )
+        for table, change in changes:
+            before = self.version(table)
+            change()
+            self.assertGreater(self.version(table), before, table)
+
+    def test_etag_follows_dependent_tables_only(self):
+        etag = self.client.get(self.url)['ETag']
+        Order.objects.create(goods=self.goods[0], buyer=self.buyer, seller=self.seller, price=self.goods[0].price)
+        # 商品列表不依赖订单表
+        self.assertEqual(self.client.get(self.url, headers={'if-none-match': etag}).status_code, 304)
+
+        # 发布者昵称出现在商品列表中，用户表变化后 ETag 失效
+        self.seller.nickname = 'new seller'
+        self.seller.save()
+        response = self.client.get(self.url, headers={'if-none-match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['data'][0]['publisher_nickname'], 'new seller')
+
+    def test_failed_response_has_no_etag(self):
+        with mock.patch('trade.views.get_category_name_map', side_effect=RuntimeError('boom')):
+            response = self.client.get(self.url)
+        self.assertEqual(json.loads(response.content)['status'], '500')
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_missing_version_is_seeded_with_timestamp(self):
+        # 版本号被淘汰后不能从 0 重新计数，否则会与客户端手中旧的 ETag 重复
+        self.redis.delete(cache.make_key(f'table_version:{TABLE_GOODS}'))
+        version = self.version(TABLE_GOODS)
+        self.assertGreater(version, (time.time() - 60) * 1000000)
+        self.assertEqual(self.version(TABLE_GOODS), version)
+
+
+# JWT 认证中间件的测试：本地校验令牌，封禁用户的令牌立即失效
+class JWTAuthenticationTests(GoodsTestMixin, RedisTestCase):
+    url = '/api/user/profiles/'
+
+    def setUp(self):
+        super().setUp()
+        self.seller = User.objects.create(phone='13800000108', password='x', nickname='seller')
+        self.admin = User.objects.create(phone='13800000109', password='x', nickname='admin', role=User.ROLE_ADMIN)
+        self.goods = self.create_goods('二手自行车')
+
+    def token(self, user):
+        return str(AccessToken.for_user(user))
+
+    def published(self, authorization=None, **params):
+        headers = {'authorization': authorization} if authorization else {}
+        return json.loads(self.client.get(self.url, params, headers=headers).content)
+
+    def ban(self):
+        return json.loads(self.client.post('/api/admin_manage/ban_user', json.dumps({
+            'user_id': self.seller.id, 'current_user_id': self.admin.id
+        }), content_type='application/json').content)
+
+    def test_jwt_required(self):
+        self.assertEqual(self.published()['msg'], '认证失败: 缺少认证令牌')
+        self.assertEqual(self.published('Token abc')['msg'], '认证失败: 无效的认证头格式')
+        self.assertEqual(self.published('Bearer abc')['status'], '401')
+
+        expired = AccessToken.for_user(self.seller)
+        expired.set_exp(lifetime=-timedelta(seconds=1))
+        self.assertEqual(self.published(f'Bearer {expired}')['status'], '401')
+
+        response = self.published(f'Bearer {self.token(self.seller)}')
+        self.assertEqual(response['status'], '200')
+        self.assertEqual([goods['id'] for goods in response['goods_list']], [self.goods.id])
+
+    def test_user_id_parameter_must_match_token(self):
+        response = self.published(f'Bearer {self.token(self.admin)}', user_id=self.seller.id)
+        self.assertEqual(response['status'], '403')
+
+    def test_banned_user_token_is_revoked_immediately(self):
+        authorization = f'Bearer {self.token(self.seller)}'
+        self.assertEqual(self.published(authorization)['status'], '200')
+
+        self.assertEqual(self.ban()['msg'], '封禁成功')
+        self.assertEqual(self.published(authorization)['msg'], '认证失败: 账号已被禁用')
+
+        self.assertEqual(self.ban()['msg'], '解封成功')
+        self.assertEqual(self.published(authorization)['status'], '200')
+
+    def test_revoked_set_is_rebuilt_from_database(self):
+        User.objects.filter(id=self.seller.id).update(status=User.STATUS_DISABLE)
+        self.redis.delete(authentication._revoked_users_key())
+        local_cache.local_cache.clear()
+        self.assertEqual(authentication.authenticate_token(self.token(self.seller)), (None, '账号已被禁用'))
+        self.assertEqual(authentication.authenticate_token(self.token(self.admin)), (self.admin.id, None))
+
+    def test_valid_token_needs_no_redis_or_database(self):
+        token = self.token(self.seller)
+        authentication.authenticate_token(token)
+        with mock.patch('trade.authentication.get_redis_connection') as redis_conn, \
+                CaptureQueriesContext(connection) as queries:
+            self.assertEqual(authentication.authenticate_token(token), (self.seller.id, None))
+        redis_conn.assert_not_called()
+        self.assertEqual(len(queries), 0)
+
+    def test_revocation_check_failure_does_not_block_requests(self):
+        with mock.patch('trade.authentication.get_revoked_users', side_effect=ConnectionError('redis down')):
+            self.assertEqual(authentication.authenticate_token(self.token(self.seller)), (self.seller.id, None))
+
+
+# 请求内身份映射 / 批量加载器的测试：同一个主键在一个请求中只查询一次，多个主键合并成一条查询
+class RequestLoaderTests(GoodsTestMixin, RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.seller = User.objects.create(phone='13800000110', password='x', nickname='seller')
+        self.buyer = User.objects.create(phone='13800000111', password='x', nickname='buyer')
+        self.admin = User.objects.create(phone='13800000112', password='x', nickname='admin', role=User.ROLE_ADMIN)
+        self.goods = self.create_goods('二手自行车')
+
+    def test_repeated_loads_query_once(self):
+        loader = ModelLoader(User)
+        with self.assertNumQueries(2):
+            self.assertEqual(loader.get(self.seller.id), self.seller)
+            self.assertIs(loader.get(str(self.seller.id)), loader.get(self.seller.id))
+            # 不存在的主键也只查询一次
+            self.assertIsNone(loader.load(self.seller.id + 1000))
+            self.assertIsNone(loader.load(self.seller.id + 1000))
+            self.assertEqual(loader.get_many([self.seller.id]), [self.seller])
+        self.assertEqual((loader.lookups, loader.queries), (6, 2))
+
+    def test_get_many_batches_missing_ids(self):
+        loader = ModelLoader(User)
+        loader.load(self.seller.id)
+        with self.assertNumQueries(1):
+            users = loader.get_many([self.buyer.id, self.seller.id, self.admin.id])
+        self.assertEqual(users, [self.buyer, self.seller, self.admin])
+
+    def test_get_many_raises_when_any_missing(self):
+        loader = ModelLoader(User)
+        with self.assertRaises(User.DoesNotExist):
+            loader.get_many([self.seller.id, self.seller.id + 1000])
+        with self.assertNumQueries(0):
+            self.assertEqual(loader.get(self.seller.id), self.seller)
+
+    def test_prime_skips_query(self):
+        loader = ModelLoader(Goods)
+        loader.prime(self.goods)
+        with self.assertNumQueries(0):
+            self.assertIs(loader.get(self.goods.id), self.goods)
+
+    def test_attach_publishers(self):
+        loaders = RequestLoaders()
+        goods = Goods.objects.get(id=self.goods.id)
+        with self.assertNumQueries(1):
+            users = loaders.attach_publishers([goods], self.buyer.id)
+            self.assertEqual(goods.publisher, self.seller)
+        self.assertEqual(users[self.buyer.id], self.buyer)
+        self.assertEqual(loaders.queries_saved(), 1)
+
+    @override_settings(DEBUG=True)
+    def test_middleware_reports_queries_saved(self):
+        response = self.client.post('/api/admin_manage/ban_user', json.dumps({
+            'user_id': self.buyer.id, 'current_user_id': self.admin.id
+        }), content_type='application/json')
+        self.assertEqual(json.loads(response.content)['status'], '200')
+        self.assertEqual(response['X-Queries-Saved'], '1')
@@ -8,5 +8,8 @@ urlpatterns = [
     path('first', GoodsMenuView.as_view(), name='goods_main_menu'),
     path('second', GoodsSubMenu.as_view(), name='goods_sub_menu'),
     path('search/', Search.as_view(), name='Search'),
+    path('suggest/', GoodsSuggestView.as_view(), name='GoodsSuggestView'),
     path('goodslist/', GoodsListView.as_view(), name='GoodsListView'),
+    path('stats/', GoodsStatsView.as_view(), name='GoodsStatsView'),
+    path('cache_metrics/', GoodsCacheMetricsView.as_view(), name='GoodsCacheMetricsView'),
 ]
@@ -1,90 +1,58 @@
-import json
-from django.db.models import Q
+from django.db.models import Q, F, Count, Min, Max, Avg, Window
+from django.db.models.functions import RowNumber, TruncDate
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 import logging
 import os
 import random
+import time
 from datetime import datetime
 from django.core.cache import cache
 from django.conf import settings
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from trade.responses import OrjsonResponse, dumps
+from django.utils.decorators import method_decorator
 from django.views import View
-from trade.models import Goods, User ,GoodsCategory
+from django_redis import get_redis_connection
+from trade import goods_cache, local_cache
+from trade.authentication import jwt_required
+from trade.categories import get_category_menu, get_category_name_map, invalidate_categories
+from trade.locks import acquire_lock, release_lock
+from trade.conditional import (
+    TABLE_GOODS, TABLE_GOODS_CATEGORY, TABLE_ORDER, TABLE_USER, TABLE_USER_WISH, bump_table_version, etag_by_tables
+)
+from trade.models import Goods, User ,GoodsCategory, Order, UserWish
+from trade.search_index import index_goods, remove_goods, search_on_sale_goods
+from trade.suggest import DEFAULT_SUGGEST_LIMIT, MAX_SUGGEST_LIMIT, index_goods_suggest, remove_goods_suggest, suggest_titles
 
 #获取一级菜单
 class GoodsMenuView(View):
     # 函数名固定，会通过函数名来确认请求方式
+    # 分类菜单（扁平列表 + 分类树）预先序列化成 bytes 缓存，ETag 为分类版本号，
+    # 客户端带 If-None-Match 且分类没有变化时直接返回 304，不做任何序列化
     def get(self, request):
-        # 获取商品分类表所有数据
-        goods_category = GoodsCategory.objects.all()
-
-        results_list = []
-        # 手动序列化id,name和parent_id字段
-        for gc in goods_category:
-            results_list.append({
-                "id": gc.id,
-                "name": gc.name,
-                "parent_id": gc.parent_id
-            })
-
-        results_json = {
-            "status": "200",
-            "goods_category": results_list
-        }
+        menu = get_category_menu()
 
-        print(print("用户正在浏览主页面"))
-        return HttpResponse(
-            # ensure_ascii=False防止乱码
-            json.dumps(results_json, indent=4, ensure_ascii=False),
+        if request.headers.get('If-None-Match') == menu['etag']:
+            response = HttpResponseNotModified()
+        else:
             # 指定响应类型和编码
-            content_type="application/json; charset=utf-8"
-        )
+            response = HttpResponse(menu['body'], content_type="application/json; charset=utf-8")
+        response['ETag'] = menu['etag']
+        return response
 
-    # 获取前端传递过来的发布页面的数据
+    # 获取前端传递过来的发布页面的数据，需要登录，发布者就是访问令牌中的用户
+    @method_decorator(jwt_required)
     def post(self, request):
         user_id = request.POST.get("user_id")
 
-        if not user_id:
-            return JsonResponse({
-                'status': '400',
-                'msg': '缺少用户ID参数'
-            })
-
-        # 从请求头获取token并验证格式
-        auth_header = request.META.get('HTTP_AUTHORIZATION', '')
-        print(f"请求头中获取的token:{auth_header}")
-
-        # 1. 检查认证头格式
-        if not auth_header.startswith('Bearer '):
-            return JsonResponse({
-                'status': '401',
-                'msg': '认证失败: 无效的认证头格式'
-            })
-        # 提取token
-        token = auth_header[7:]  # 移除'Bearer '
-        print(f"提取的JWT令牌: {token[:20]}...")
-
-        # 如果Redis中没有找到对应的令牌键，返回401
-        if not cache.get(f"jwt_token_{user_id}"):
-            print(f"❌ Redis中未找到对应的jwt_token_{{用户ID}}键，认证失败")
-            return JsonResponse({
-                'status': '401',
-                'msg': '认证失败: 令牌无效或已过期'
-            })
-
-        print(f"✅ 认证通过：JWT格式正确且Redis中存在对应令牌键")
-
-        # 获取用户对象
-        try:
-            validated_user = User.objects.get(id=user_id)
-            print(f"🎯 认证用户: {validated_user.nickname} (ID: {validated_user.id})")
-        except User.DoesNotExist:
-            print(f"❌ 数据库中未找到用户，ID: {user_id}")
-            return JsonResponse({
-                'status': '401',
-                'msg': f'认证失败: 用户不存在 (ID: {user_id})'
+        # 兼容旧版前端传来的 user_id，但必须与令牌中的用户一致
+        if user_id and str(user_id) != str(request.auth_user_id):
+            return OrjsonResponse({
+                'status': '403',
+                'msg': '认证失败: 用户ID与登录用户不一致'
             })
+        user_id = request.auth_user_id
 
         logger = logging.getLogger(__name__)
         logger.info("前端发布页面进入publish的post请求中")
@@ -103,7 +71,7 @@ class GoodsMenuView(View):
             details = "卖家啥也没写哦。。。。。。"
 
         if not all([title, category_id, price, quality, details]):  # details允许为空
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '400',
                 'msg': '缺少必要参数'
             })
@@ -116,13 +84,11 @@ class GoodsMenuView(View):
             status = int(status)
             details = str(details)
         except ValueError:
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '400',
                 'msg': '参数类型错误'
             })
 
-        # 使用已验证的用户作为发布者
-        publisher = validated_user
 
         # 处理图片上传（在所有验证通过后）
         image_path = None  # 初始化为None
@@ -150,7 +116,7 @@ class GoodsMenuView(View):
             category_id=category_id,
             price=price,
             quality=quality,
-            publisher=publisher,
+            publisher_id=publisher_id,
             status=status,
             details=details
         )
@@ -171,7 +137,7 @@ class GoodsMenuView(View):
         print(
             f"商品信息: {title}, {category_id}, {price}, {quality}, {status}, 发布者id: {publisher_id}, 图片路径: {image_path},商品详情:{details}")
 
-        return JsonResponse({
+        return OrjsonResponse({
             'status': '200',
             'msg': '商品发布成功',
             'goods_id': goods.id,  # 返回新创建的商品ID
@@ -179,39 +145,61 @@ class GoodsMenuView(View):
         })
 
 
+#商品列表分页/流式输出的参数
+GOODS_LIST_DEFAULT_LIMIT = 200
+GOODS_LIST_MAX_LIMIT = 1000
+GOODS_LIST_CHUNK_SIZE = 500
+GOODS_LIST_FIELDS = (
+    'id', 'title', 'category_id', 'price', 'quality', 'status', 'image',
+    'publisher_id', 'publisher__nickname', 'details', 'create_time'
+)
+
+#把 values() 查询出来的一行商品数据转换成前端需要的格式
+def _goods_list_row(row, categories):
+    image_url = ""
+    if row['image']:
+        image_url = f"{settings.MEDIA_URL}{row['image']}".replace("\\", "/")
+
+    return {
+        "id": row['id'],
+        "title": row['title'],
+        "category_id": row['category_id'],
+        "category_name": categories.get(row['category_id'], "未知分类"),
+        "price": float(row['price']),
+        "quality": row['quality'],
+        "status": row['status'],
+        "image": image_url,
+        "publisher_id": row['publisher_id'],
+        "publisher_nickname": row['publisher__nickname'],
+        "details": row['details'],
+        "create_time": row['create_time'].strftime("%Y-%m-%d %H:%M:%S")
+    }
+
 #获取要所有商品列表(前端Echarts需要)
+#支持三种模式：
+#  1. 不带参数：一次性返回全部商品（兼容旧版前端）
+#  2. ?cursor=<上一页最后一个商品id>&limit=<每页数量>：按 id 做游标分页，翻页代价与页码无关
+#  3. ?format=ndjson：以 NDJSON 流式输出，每行一个商品，内存占用与商品总数无关
+#商品、分类、用户（发布者昵称）没有变化时，带 If-None-Match 的请求直接返回 304
+@method_decorator(etag_by_tables(TABLE_GOODS, TABLE_GOODS_CATEGORY, TABLE_USER), name='get')
 class GoodsListView(View):
     def get(self, request):
         try:
-            # 直接从MySQL查询商品数据，关联商品分类表
-            goods_list = Goods.objects.select_related('publisher').all()
-            
+            # 只查询需要的列，并通过 JOIN 拿到发布者昵称
+            goods_values = Goods.objects.values(*GOODS_LIST_FIELDS).order_by('id')
+
             # 获取所有分类信息用于名称映射
-            categories = {cat.id: cat.name for cat in GoodsCategory.objects.all()}
-            
+            categories = get_category_name_map()
+
+            if request.GET.get('format') == 'ndjson':
+                return self._stream_ndjson(goods_values, categories)
+
+            if 'cursor' in request.GET or 'limit' in request.GET:
+                return self._paginate(request, goods_values, categories)
+
             # 序列化商品数据
-            results = []
-            for goods in goods_list:
-                # 构造完整的图片URL
-                image_url = ""
-                if goods.image:
-                    image_url = f"{settings.MEDIA_URL}{goods.image}".replace("\\", "/")
-                
-                results.append({
-                    "id": goods.id,
-                    "title": goods.title,
-                    "category_id": goods.category_id,
-                    "category_name": categories.get(goods.category_id, "未知分类"),
-                    "price": float(goods.price),
-                    "quality": goods.quality,
-                    "status": goods.status,
-                    "image": image_url,
-                    "publisher_id": goods.publisher_id,
-                    "publisher_nickname": goods.publisher.nickname,
-                    "details": goods.details,
-                    "create_time": goods.create_time.strftime("%Y-%m-%d %H:%M:%S")
-                })
-            
+            results = [_goods_list_row(row, categories) for row in goods_values]
+
             # 构造返回结果
             results_json = {
                 "status": "200",
@@ -220,10 +208,7 @@ class GoodsListView(View):
                 "count": len(results)
             }
 
-            return HttpResponse(
-                json.dumps(results_json, indent=4, ensure_ascii=False),
-                content_type="application/json; charset=utf-8"
-            )
+            return OrjsonResponse(results_json)
             
         except Exception as e:
             logging.error(f"获取商品列表失败: {str(e)}")
@@ -233,40 +218,195 @@ class GoodsListView(View):
                 "data": [],
                 "count": 0
             }
-            return HttpResponse(
-                json.dumps(results_json, indent=4, ensure_ascii=False),
-                content_type="application/json; charset=utf-8"
-            )
+            return OrjsonResponse(results_json)
+
+    def _paginate(self, request, goods_values, categories):
+        """按商品 id 做游标分页（keyset），利用主键索引直接定位，不使用 OFFSET"""
+        try:
+            cursor = int(request.GET.get('cursor') or 0)
+            limit = int(request.GET.get('limit') or GOODS_LIST_DEFAULT_LIMIT)
+        except ValueError:
+            results_json = {
+                "status": "400",
+                "msg": "cursor和limit必须是数字",
+                "data": [],
+                "count": 0
+            }
+            return OrjsonResponse(results_json)
+        limit = max(1, min(limit, GOODS_LIST_MAX_LIMIT))
+
+        # 多取一条用来判断是否还有下一页
+        rows = list(goods_values.filter(id__gt=cursor)[:limit + 1])
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        results = [_goods_list_row(row, categories) for row in rows]
+        results_json = {
+            "status": "200",
+            "msg": "success",
+            "data": results,
+            "count": len(results),
+            "has_more": has_more,
+            "next_cursor": rows[-1]['id'] if has_more else None
+        }
+        return OrjsonResponse(results_json)
+
+    def _stream_ndjson(self, goods_values, categories):
+        """以 NDJSON 格式流式输出全部商品，服务端按块从数据库读取，前端可以边接收边渲染"""
+        def generate():
+            for row in goods_values.iterator(chunk_size=GOODS_LIST_CHUNK_SIZE):
+                yield dumps(_goods_list_row(row, categories)) + b"\n"
+
+        return StreamingHttpResponse(
+            generate(),
+            content_type="application/x-ndjson; charset=utf-8"
+        )
+
+#商品统计数据缓存 key 及过期时间，商品或分类变动时由信号清除
+GOODS_STATS_CACHE_KEY = 'goods:stats'
+GOODS_STATS_CACHE_TTL = 600
+#价格分布直方图的区间边界（元），最后一个区间为 [5000, +∞)
+GOODS_PRICE_BUCKETS = (0, 50, 100, 200, 500, 1000, 2000, 5000)
+GOODS_PRICE_QUANTILES = (0.25, 0.5, 0.75, 0.9)
+
+#在数据库中用 GROUP BY 聚合商品统计数据
+def build_goods_stats():
+    categories = get_category_name_map()
+    status_names = dict(Goods.STATUS_CHOICES)
+
+    # 每个分类的商品数量
+    category_counts = [
+        {
+            "category_id": row['category_id'],
+            "category_name": categories.get(row['category_id'], "未知分类"),
+            "count": row['count']
+        }
+        for row in Goods.objects.values('category_id').annotate(count=Count('id')).order_by('-count')
+    ]
+
+    # 每种状态的商品数量
+    status_counts = [
+        {
+            "status": row['status'],
+            "status_name": status_names.get(row['status'], "未知状态"),
+            "count": row['count']
+        }
+        for row in Goods.objects.values('status').annotate(count=Count('id')).order_by('status')
+    ]
+
+    # 每天发布的商品数量
+    daily_publish = [
+        {
+            "date": row['day'].strftime("%Y-%m-%d"),
+            "count": row['count']
+        }
+        for row in Goods.objects.annotate(day=TruncDate('create_time'))
+        .values('day').annotate(count=Count('id')).order_by('day')
+    ]
+
+    # 价格概览和分布直方图，在一条聚合查询中完成
+    bucket_aggregates = {}
+    for index, lower in enumerate(GOODS_PRICE_BUCKETS):
+        price_filter = Q(price__gte=lower)
+        if index + 1 < len(GOODS_PRICE_BUCKETS):
+            price_filter &= Q(price__lt=GOODS_PRICE_BUCKETS[index + 1])
+        bucket_aggregates[f'bucket_{index}'] = Count('id', filter=price_filter)
+    price_summary = Goods.objects.aggregate(
+        total=Count('id'),
+        min_price=Min('price'),
+        max_price=Max('price'),
+        avg_price=Avg('price'),
+        **bucket_aggregates
+    )
+
+    price_histogram = []
+    for index, lower in enumerate(GOODS_PRICE_BUCKETS):
+        upper = GOODS_PRICE_BUCKETS[index + 1] if index + 1 < len(GOODS_PRICE_BUCKETS) else None
+        price_histogram.append({
+            "min": lower,
+            "max": upper,
+            "count": price_summary[f'bucket_{index}']
+        })
+
+    # 分位数：用 ROW_NUMBER() 按价格排序编号，一条查询（一次排序）取出所有分位数所在的行
+    total = price_summary['total']
+    price_quantiles = {}
+    if total:
+        positions = {quantile: min(total - 1, int(quantile * (total - 1))) + 1 for quantile in GOODS_PRICE_QUANTILES}
+        quantile_prices = dict(
+            Goods.objects.annotate(row_number=Window(RowNumber(), order_by=(F('price').asc(), F('id').asc())))
+            .filter(row_number__in=set(positions.values()))
+            .values_list('row_number', 'price')
+        )
+        for quantile, position in positions.items():
+            price_quantiles[f"p{int(quantile * 100)}"] = float(quantile_prices[position])
+
+    return {
+        "total": total,
+        "category_counts": category_counts,
+        "status_counts": status_counts,
+        "daily_publish": daily_publish,
+        "price": {
+            "min": float(price_summary['min_price']) if price_summary['min_price'] is not None else None,
+            "max": float(price_summary['max_price']) if price_summary['max_price'] is not None else None,
+            "avg": round(float(price_summary['avg_price']), 2) if price_summary['avg_price'] is not None else None,
+            "quantiles": price_quantiles,
+            "histogram": price_histogram
+        }
+    }
+
+#获取商品统计数据(前端Echarts图表使用)，不再需要前端拉取全部商品自行计算
+class GoodsStatsView(View):
+    def get(self, request):
+        try:
+            stats = cache.get(GOODS_STATS_CACHE_KEY)
+            if stats is None:
+                logging.info("商品统计缓存未命中，从数据库聚合")
+                stats = build_goods_stats()
+                cache.set(GOODS_STATS_CACHE_KEY, stats, timeout=GOODS_STATS_CACHE_TTL)
+
+            results_json = {
+                "status": "200",
+                "msg": "success",
+                "data": stats
+            }
+            return OrjsonResponse(results_json)
+
+        except Exception as e:
+            logging.error(f"获取商品统计数据失败: {str(e)}")
+            results_json = {
+                "status": "500",
+                "msg": f"服务器错误: {str(e)}",
+                "data": {}
+            }
+            return OrjsonResponse(results_json)
+
+#将商品对象转换成缓存中存储的字典格式
+def _goods_to_cache_data(goods):
+    image_url = ""
+    if goods.image:
+        image_url = f"{settings.MEDIA_URL}{goods.image}".replace("\\", "/")
+
+    return {
+        "id": goods.id,
+        "title": goods.title,
+        "price": float(goods.price),
+        "quality": goods.quality,
+        "status": goods.status,
+        "image": image_url,
+        "publisher_id": goods.publisher_id,
+        "publisher_nickname": goods.publisher.nickname,
+        "details": goods.details,
+        "category_id": goods.category_id,
+        "create_time": goods.create_time.strftime("%Y-%m-%d %H:%M:%S")
+    }
 
 #将单个商品数据缓存到 Redis 中
 def cache_goods_data(goods_id=None):
     try:
         if goods_id:
             # 缓存单个商品
-            goods = Goods.objects.select_related('publisher').get(id=goods_id)
-            image_url = ""
-            if goods.image:
-                image_url = f"{settings.MEDIA_URL}{goods.image}".replace("\\", "/")
-            
-            goods_data = {
-                "id": goods.id,
-                "title": goods.title,
-                "price": float(goods.price),
-                "quality": goods.quality,
-                "status": goods.status,
-                "image": image_url,
-                "publisher_id": goods.publisher_id,
-                "publisher_nickname": goods.publisher.nickname,
-                "details": goods.details,
-                "category_id": goods.category_id,
-                "create_time": goods.create_time.strftime("%Y-%m-%d %H:%M:%S")
-            }
-            
-            # 生成随机过期时间：2-4 小时（7200-14400 秒），防止缓存雪崩
-            random_ttl = random.randint(7200, 14400)
-            # 存入 Redis
-            cache.set(f'goods:{goods_id}', goods_data, timeout=random_ttl)
-            logging.info(f"成功缓存商品 ID: {goods_id} 到 Redis (键：goods:{goods_id}, TTL: {random_ttl}秒)")
+            _load_goods_into_cache(goods_id)
         else:
             # goods_id: 商品 ID，如果为 None 则缓存所有商品
             all_goods = Goods.objects.select_related('publisher').all()
@@ -274,33 +414,93 @@ def cache_goods_data(goods_id=None):
                 cache_goods_data(goods.id)
             logging.info(f"成功缓存所有商品到 Redis")
             
-    except Goods.DoesNotExist:
-        logging.error(f"商品 ID: {goods_id} 不存在")
     except Exception as e:
         logging.error(f"缓存商品数据失败：{str(e)}")
 
+#从数据库查询单个商品并写入缓存（连同回源耗时一起写入，供 XFetch 提前刷新使用），商品不存在时缓存空值
+def _load_goods_into_cache(goods_id):
+    start = time.perf_counter()
+    try:
+        goods = Goods.objects.select_related('publisher').get(id=goods_id)
+    except Goods.DoesNotExist:
+        # 防止缓存穿透：将空结果也缓存起来，TTL 设置为 2 分钟（120 秒）
+        goods_cache.write_goods_not_found(goods_id)
+        logging.warning(f"商品 ID: {goods_id} 不存在，已缓存空值防止缓存穿透 (TTL: {goods_cache.GOODS_NOT_FOUND_TTL} 秒)")
+        return None
+
+    goods_data = _goods_to_cache_data(goods)
+    # 生成随机过期时间：2-4 小时，防止缓存雪崩
+    random_ttl = goods_cache.write_goods_entry(goods_id, goods_data, delta=time.perf_counter() - start)
+    logging.info(f"成功缓存商品 ID: {goods_id} 到 Redis (键：goods:{goods_id}, TTL: {random_ttl}秒)")
+    return goods_data
+
+#批量从数据库查询缓存未命中的商品并回填到 Redis，返回 {商品id: 商品数据}
+def _refill_goods_cache(goods_ids):
+    refilled = {}
+    if not goods_ids:
+        return refilled
+
+    # 使用 IN 查询批量获取缺失的商品（一次数据库查询）
+    start = time.perf_counter()
+    missing_goods_list = Goods.objects.filter(
+        id__in=goods_ids
+    ).select_related('publisher')
+
+    for goods in missing_goods_list:
+        refilled[goods.id] = _goods_to_cache_data(goods)
+    # XFetch 使用的是单个商品的回源耗时，整批查询的耗时按商品数量平均分摊
+    delta = (time.perf_counter() - start) / max(len(refilled), 1)
+
+    # 使用 pipeline 批量回填 Redis（一次网络往返），每个商品使用随机 TTL 防止雪崩
+    goods_cache.write_goods_entries({goods_id: (goods_data, delta) for goods_id, goods_data in refilled.items()})
+    logging.debug(f"已批量缓存 {len(refilled)} 个商品")
+
+    return refilled
+
 #从 Redis 获取商品数据，如果没有则从数据库查询并缓存，支持防止缓存穿透：对于不存在的数据也缓存空值
+#单个商品的回源使用 Redis SET NX 锁做单飞（single-flight），缓存快过期时按 XFetch 概率提前刷新，防止缓存击穿
 def get_goods_from_cache_or_db(goods_id=None):
     if goods_id:
         # 获取单个商品
-        cached_goods = cache.get(f'goods:{goods_id}')
-        
-        if cached_goods is not None:
+        cached_goods, meta = goods_cache.read_goods_entry(goods_id)
+
+        if cached_goods is not goods_cache.MISSING:
+            # 缓存即将过期：只让拿到锁的一个请求提前刷新，其余请求继续使用旧数据
+            if cached_goods is not None and goods_cache.should_refresh_early(meta):
+                token = goods_cache.acquire_refill_lock(goods_id)
+                if token:
+                    goods_cache.incr_metric('early_refresh')
+                    logging.info(f"商品 ID: {goods_id} 的缓存即将过期，提前刷新")
+                    try:
+                        return _load_goods_into_cache(goods_id)
+                    finally:
+                        goods_cache.release_refill_lock(goods_id, token)
+
             logging.info(f"从 Redis 缓存获取商品数据 (键：goods:{goods_id})")
             return cached_goods
-        else:
-            logging.info(f"Redis 缓存未命中，从数据库查询商品 ID: {goods_id}")
+
+        goods_cache.incr_metric('miss')
+        logging.info(f"Redis 缓存未命中，从数据库查询商品 ID: {goods_id}")
+
+        token = goods_cache.acquire_refill_lock(goods_id)
+        if token:
+            # 拿到锁的请求负责回源数据库并回填缓存
+            goods_cache.incr_metric('refill')
             try:
-                goods = Goods.objects.select_related('publisher').get(id=goods_id)
-                # 缓存该商品
-                cache_goods_data(goods_id)
-                # 重新从缓存获取
-                return cache.get(f'goods:{goods_id}')
-            except Goods.DoesNotExist:
-                # 防止缓存穿透：将空结果也缓存起来，TTL 设置为 2 分钟（120 秒）
-                cache.set(f'goods:{goods_id}', None, timeout=120)
-                logging.warning(f"商品 ID: {goods_id} 不存在，已缓存空值防止缓存穿透 (TTL: 120 秒)")
-                return None
+                return _load_goods_into_cache(goods_id)
+            finally:
+                goods_cache.release_refill_lock(goods_id, token)
+
+        # 其他请求等待持锁请求回填缓存，不再重复查询数据库
+        goods_cache.incr_metric('wait')
+        cached_goods = goods_cache.wait_for_refill(goods_id)
+        if cached_goods is not goods_cache.MISSING:
+            return cached_goods
+
+        # 持锁请求超时未回填（例如异常退出），自行回源
+        goods_cache.incr_metric('wait_timeout')
+        logging.warning(f"等待商品 ID: {goods_id} 的缓存回填超时，直接查询数据库")
+        return _load_goods_into_cache(goods_id)
     else:
         # 商品 ID，如果为 None 则返回所有商品 - 批量优化
         all_goods = Goods.objects.select_related('publisher').all()
@@ -328,55 +528,195 @@ def get_goods_from_cache_or_db(goods_id=None):
         
         # 如果有缺失的商品，批量查询并缓存
         if missing_goods_ids:
-            # 使用 IN 查询批量获取缺失的商品（一次数据库查询）
-            missing_goods_list = Goods.objects.filter(
-                id__in=missing_goods_ids
-            ).select_related('publisher')
-
-            
-            for goods in missing_goods_list:
-                image_url = ""
-                if goods.image:
-                    image_url = f"{settings.MEDIA_URL}{goods.image}".replace("\\", "/")
-                
-                goods_data = {
-                    "id": goods.id,
-                    "title": goods.title,
-                    "price": float(goods.price),
-                    "quality": goods.quality,
-                    "status": goods.status,
-                    "image": image_url,
-                    "publisher_id": goods.publisher_id,
-                    "publisher_nickname": goods.publisher.nickname,
-                    "details": goods.details,
-                    "category_id": goods.category_id,
-                    "create_time": goods.create_time.strftime("%Y-%m-%d %H:%M:%S")
-                }
-                
-                # 批量缓存到 Redis，使用随机 TTL 防止雪崩
-                random_ttl = random.randint(7200, 14400)
-                cache.set(f'goods:{goods.id}', goods_data, timeout=random_ttl)
-                results.append(goods_data)
-                logging.debug(f"已缓存商品 ID: {goods.id} (TTL: {random_ttl}秒)")
+            results.extend(_refill_goods_cache(missing_goods_ids).values())
         
         return results
 
+#商品详情在进程内缓存的时间（秒），商品修改后通过失效消息立即清除，TTL 只是兜底
+GOODS_DETAIL_LOCAL_TTL = 30
+
+#两级缓存读取单个商品：先读进程内缓存，未命中再走 get_goods_from_cache_or_db（Redis + 防击穿回源）
+def get_goods_from_local_cache(goods_id):
+    return local_cache.get_or_load(
+        goods_cache.goods_cache_key(goods_id),
+        lambda: get_goods_from_cache_or_db(goods_id),
+        ttl=GOODS_DETAIL_LOCAL_TTL
+    )
+
+#商品分类索引：每个分类在 Redis 中维护一个有序集合，成员为商品 id，分数为发布时间戳
+#这样分类页只需要读取该分类下的商品，而不是把整个商品表都拉出来再在 Python 里过滤
+def _category_index_key(category_id):
+    return cache.make_key(f'goods_category_index:{category_id}')
+
+#有序集合中的占位成员（商品 id 不会为 0），分数小于所有商品，排在第一位。
+#占位成员存在表示该分类的索引已经完整建立（空分类也只有占位成员）；
+#有序集合被淘汰、或者只有 update_category_index 增量写入的部分成员时没有占位成员，读取时重建
+CATEGORY_INDEX_SENTINEL = 0
+CATEGORY_INDEX_SENTINEL_SCORE = -1
+#重建分类索引的锁的过期时间（秒），同一时间只有一个请求从数据库重建同一个分类的索引
+CATEGORY_INDEX_LOCK_TIMEOUT = 30
+
+def _category_index_lock_key(category_id):
+    return f'goods_category_index:lock:{category_id}'
+
+#商品 id -> 分类 id 的映射，用于商品更换分类时从旧分类的索引中移除
+def _category_index_map_key():
+    return cache.make_key('goods_category_index:map')
+
+def _goods_index_score(goods_create_time):
+    return goods_create_time.timestamp() if goods_create_time else 0
+
+def _query_category_goods(category_id):
+    return list(
+        Goods.objects.filter(category_id=category_id)
+        .order_by('create_time', 'id')
+        .values_list('id', 'create_time')
+    )
+
+#从数据库重建某个分类的商品索引，返回按发布时间升序排列的商品 id 列表
+#重建时先完整写入临时键，再 RENAME 替换正式索引，读取方不会看到写到一半的索引，
+#重建前已删除或换到其他分类的商品也会随旧索引一起被丢弃；查询数据库之后才发生的商品变动
+#由 post_save/post_delete 信号增量写入。其他请求正在重建时直接返回数据库查询结果，不写 Redis
+def build_category_index(category_id):
+    lock_key = _category_index_lock_key(category_id)
+    token = acquire_lock(lock_key, CATEGORY_INDEX_LOCK_TIMEOUT)
+    if token is None:
+        logging.info(f"分类 ID: {category_id} 的商品索引正在由其他请求重建，直接查询数据库")
+        return [goods_id for goods_id, _ in _query_category_goods(category_id)]
+
+    try:
+        rows = _query_category_goods(category_id)
+
+        redis_conn = get_redis_connection('default')
+        index_key = _category_index_key(category_id)
+        tmp_key = f'{index_key}:rebuild:{token}'
+        members = {CATEGORY_INDEX_SENTINEL: CATEGORY_INDEX_SENTINEL_SCORE}
+        members.update({goods_id: _goods_index_score(create_time) for goods_id, create_time in rows})
+        pipe = redis_conn.pipeline(transaction=True)
+        pipe.zadd(tmp_key, members)
+        pipe.rename(tmp_key, index_key)
+        if rows:
+            pipe.hset(_category_index_map_key(), mapping={goods_id: category_id for goods_id, _ in rows})
+        pipe.execute()
+    finally:
+        release_lock(lock_key, token)
+
+    logging.info(f"已重建分类 ID: {category_id} 的商品索引，共 {len(rows)} 个商品")
+    return [goods_id for goods_id, _ in rows]
+
+#获取某个分类下的所有商品：先读分类索引拿到商品 id，再批量从 Redis 获取商品数据，未命中的回源数据库
+def get_category_goods_from_cache_or_db(category_id):
+    redis_conn = get_redis_connection('default')
+
+    members = [int(goods_id) for goods_id in redis_conn.zrange(_category_index_key(category_id), 0, -1)]
+    if members and members[0] == CATEGORY_INDEX_SENTINEL:
+        goods_ids = members[1:]
+    else:
+        logging.info(f"分类 ID: {category_id} 的商品索引不存在或不完整，从数据库重建")
+        goods_ids = build_category_index(category_id)
+
+    if not goods_ids:
+        return []
+
+    # 使用 mget 批量从 Redis 获取该分类下的商品数据（一次网络请求）
+    cached_results = cache.get_many([f'goods:{goods_id}' for goods_id in goods_ids])
+
+    goods_map = {}
+    missing_goods_ids = []
+    for goods_id in goods_ids:
+        cached_goods = cached_results.get(f'goods:{goods_id}')
+        if cached_goods is not None:
+            goods_map[goods_id] = cached_goods
+        else:
+            missing_goods_ids.append(goods_id)
+
+    logging.info(f"分类 ID: {category_id} 商品数：{len(goods_ids)}, 缓存命中：{len(goods_map)}, 未命中：{len(missing_goods_ids)}")
+
+    if missing_goods_ids:
+        goods_map.update(_refill_goods_cache(missing_goods_ids))
+
+    # 按索引顺序返回，已被删除但索引尚未同步的商品直接跳过
+    return [goods_map[goods_id] for goods_id in goods_ids if goods_id in goods_map]
+
+#商品新增或修改时增量更新分类索引
+def update_category_index(goods):
+    try:
+        redis_conn = get_redis_connection('default')
+        old_category_id = redis_conn.hget(_category_index_map_key(), goods.id)
+
+        pipe = redis_conn.pipeline()
+        if old_category_id is not None and int(old_category_id) != goods.category_id:
+            pipe.zrem(_category_index_key(int(old_category_id)), goods.id)
+        pipe.zadd(_category_index_key(goods.category_id), {goods.id: _goods_index_score(goods.create_time)})
+        pipe.hset(_category_index_map_key(), goods.id, goods.category_id)
+        pipe.execute()
+    except Exception as e:
+        logging.error(f"更新商品 ID: {goods.id} 的分类索引失败：{str(e)}")
+
+#商品删除时从分类索引中移除
+def remove_from_category_index(goods):
+    try:
+        redis_conn = get_redis_connection('default')
+        pipe = redis_conn.pipeline()
+        pipe.zrem(_category_index_key(goods.category_id), goods.id)
+        pipe.hdel(_category_index_map_key(), goods.id)
+        pipe.execute()
+    except Exception as e:
+        logging.error(f"移除商品 ID: {goods.id} 的分类索引失败：{str(e)}")
+
 # 监听 Goods 模型的增删改操作，自动清除对应商品的 Redis 缓存
 @receiver(post_save, sender=Goods)
 #当 Goods 表发生新增或修改时，清除对应商品的 Redis 缓存
 def clear_goods_cache_on_save(sender, instance, **kwargs):
-    cache.delete(f'goods:{instance.id}')
+    goods_cache.delete_goods_entry(instance.id)
+    local_cache.invalidate(goods_cache.goods_cache_key(instance.id))
     logging.info(f"已清除商品 ID: {instance.id} 的 Redis 缓存 (键：goods:{instance.id})")
+    update_category_index(instance)
+    index_goods(instance)
+    index_goods_suggest(instance)
+    cache.delete(GOODS_STATS_CACHE_KEY)
+    bump_table_version(TABLE_GOODS)
 
 @receiver(post_delete, sender=Goods)
 def clear_goods_cache_on_delete(sender, instance, **kwargs):
     """
     当 Goods 表发生删除时，清除对应商品的 Redis 缓存
     """
-    cache.delete(f'goods:{instance.id}')
+    goods_cache.delete_goods_entry(instance.id)
+    local_cache.invalidate(goods_cache.goods_cache_key(instance.id))
     logging.info(f"已清除删除商品 ID: {instance.id} 的 Redis 缓存 (键：goods:{instance.id})")
+    remove_from_category_index(instance)
+    remove_goods(instance.id)
+    remove_goods_suggest(instance.id)
+    cache.delete(GOODS_STATS_CACHE_KEY)
+    bump_table_version(TABLE_GOODS)
+
+#分类新增、改名或删除时，清除分类缓存（包括所有进程内的缓存）和商品统计缓存（统计结果中包含分类名称）
+@receiver(post_save, sender=GoodsCategory)
+@receiver(post_delete, sender=GoodsCategory)
+def clear_goods_stats_on_category_change(sender, instance, **kwargs):
+    invalidate_categories()
+    cache.delete(GOODS_STATS_CACHE_KEY)
+    bump_table_version(TABLE_GOODS_CATEGORY)
+
+#订单、收藏、用户发生变化时递增对应数据表的版本号，使依赖它们的列表接口 ETag 失效
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def bump_order_version(sender, instance, **kwargs):
+    bump_table_version(TABLE_ORDER)
+
+@receiver(post_save, sender=UserWish)
+@receiver(post_delete, sender=UserWish)
+def bump_user_wish_version(sender, instance, **kwargs):
+    bump_table_version(TABLE_USER_WISH)
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def bump_user_version(sender, instance, **kwargs):
+    bump_table_version(TABLE_USER)
 
 #显示二级菜单，也就是具体的goods
+@method_decorator(etag_by_tables(TABLE_GOODS, TABLE_USER), name='get')
 class GoodsSubMenu(View):
     def get(self, request):
 
@@ -388,32 +728,20 @@ class GoodsSubMenu(View):
                 "msg": "缺少分类ID参数",
                 "goods_list": []
             }
-            return HttpResponse(
-                json.dumps(results_json, indent=4, ensure_ascii=False),
-                content_type="application/json; charset=utf-8"
-            )
+            return OrjsonResponse(results_json)
 
-        # 2. 从缓存获取所有商品数据
+        # 2. 通过分类索引只获取该分类下的商品数据
         try:
-            all_goods_data = get_goods_from_cache_or_db()
+            filtered_goods = get_category_goods_from_cache_or_db(int(param_id))
             
-            # 3. 根据分类ID过滤商品
-            filtered_goods = [
-                goods for goods in all_goods_data 
-                if goods['category_id'] == int(param_id)
-            ]
-            
-            # 4. 构造返回结果
+            # 3. 构造返回结果
             results_json = {
                 "status": "200",
                 "msg": "success",
                 "goods_list": filtered_goods
             }
 
-            return HttpResponse(
-                json.dumps(results_json, indent=4, ensure_ascii=False),
-                content_type="application/json; charset=utf-8"
-            )
+            return OrjsonResponse(results_json)
             
         except ValueError:
             results_json = {
@@ -421,12 +749,13 @@ class GoodsSubMenu(View):
                 "msg": "分类ID必须是数字",
                 "goods_list": []
             }
-            return HttpResponse(
-                json.dumps(results_json, indent=4, ensure_ascii=False),
-                content_type="application/json; charset=utf-8"
-            )
+            return OrjsonResponse(results_json)
 
-#搜索
+#搜索每页默认/最大返回数量
+SEARCH_DEFAULT_PAGE_SIZE = 50
+SEARCH_MAX_PAGE_SIZE = 100
+
+#搜索，基于 Redis 倒排索引（见 trade/search_index.py），支持相关度排序和分页
 class Search(View):
     def get(self,request):
         keyword=request.GET.get("keyword")
@@ -435,52 +764,89 @@ class Search(View):
         try:
             # 非空判断
             if not keyword:
-                return JsonResponse({
+                return OrjsonResponse({
                     'status': '400',
                     'msg': '缺少参数',
                     'data': []
                 })
 
-            # 对goods表进行模糊查询
-            goods_list = Goods.objects.filter(
-                Q(title__icontains=keyword) |
-                Q(details__icontains=keyword),
-                status=Goods.STATUS_ON
-            )
-
-            # 序列化查询结果
-            results = []
-            for goods in goods_list:
-                # 构造完整的图片URL
-                image_url = ""
-                if goods.image:
-                    from django.conf import settings
-                    image_url = f"{settings.MEDIA_URL}{goods.image}".replace("\\", "/")
-
-                results.append({
-                    "id": goods.id,
-                    "title": goods.title,
-                    "price": float(goods.price),
-                    "quality": goods.quality,
-                    "status": goods.status,
-                    "image": image_url,
-                    "publisher_id": goods.publisher_id,
-                    "publisher_nickname": goods.publisher.nickname,
-                    "details": goods.details
+            try:
+                page = max(1, int(request.GET.get('page', 1)))
+                page_size = int(request.GET.get('page_size', SEARCH_DEFAULT_PAGE_SIZE))
+            except ValueError:
+                return OrjsonResponse({
+                    'status': '400',
+                    'msg': '分页参数必须是数字',
+                    'data': []
                 })
+            page_size = max(1, min(page_size, SEARCH_MAX_PAGE_SIZE))
 
+            # 在倒排索引中查询，按相关度排序，商品数据通过一条查询序列化
+            results, total = search_on_sale_goods(
+                keyword,
+                offset=(page - 1) * page_size,
+                limit=page_size
+            )
 
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '200',
                 'msg': '查询成功',
-                'data': results
+                'data': results,
+                'total': total,
+                'page': page,
+                'page_size': page_size
             })
 
         except Exception as e:
-            return JsonResponse({
+            return OrjsonResponse({
                 'status': '500',
                 'msg': f'{str(e)}',
                 'data':[]
             })
 
 
+#搜索联想：根据输入前缀（中文、全拼或拼音首字母）返回商品标题，只访问 Redis
+class GoodsSuggestView(View):
+    def get(self, request):
+        prefix = request.GET.get('prefix', '')
+
+        try:
+            limit = int(request.GET.get('limit', DEFAULT_SUGGEST_LIMIT))
+        except ValueError:
+            return OrjsonResponse({
+                'status': '400',
+                'msg': 'limit必须是数字',
+                'data': []
+            })
+        limit = max(1, min(limit, MAX_SUGGEST_LIMIT))
+
+        try:
+            return OrjsonResponse({
+                'status': '200',
+                'msg': 'success',
+                'data': suggest_titles(prefix, limit=limit)
+            })
+        except Exception as e:
+            logging.error(f"获取搜索联想失败: {str(e)}")
+            return OrjsonResponse({
+                'status': '500',
+                'msg': f'{str(e)}',
+                'data': []
+            })
+
+#商品缓存指标：缓存未命中、回源、等待回填、提前刷新等次数
+class GoodsCacheMetricsView(View):
+    def get(self, request):
+        try:
+            return OrjsonResponse({
+                'status': '200',
+                'msg': 'success',
+                'data': goods_cache.get_metrics()
+            })
+        except Exception as e:
+            logging.error(f"获取商品缓存指标失败: {str(e)}")
+            return OrjsonResponse({
+                'status': '500',
+                'msg': f'{str(e)}',
+                'data': {}
+            })